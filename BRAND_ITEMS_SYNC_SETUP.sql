@@ -0,0 +1,72 @@
+-- ================================================================================
+-- ЛЕНТА ИЗМЕНЕНИЙ BRAND ITEMS ДЛЯ ИНКРЕМЕНТАЛЬНОЙ СИНХРОНИЗАЦИИ
+-- ================================================================================
+-- Бэкенд держит каталог брендов и поисковый индекс в памяти и обновляет их только
+-- изменившимися строками (backend/brand_changes.py). RLS отдает anon-ключу лишь
+-- одобренные активные товары, поэтому снятые с публикации и удаленные строки
+-- бэкенд видит через функцию brand_item_changes.
+--
+-- Выполните этот SQL в Supabase SQL Editor. Без него бэкенд работает как раньше:
+-- каталог каждый раз загружается целиком.
+-- ================================================================================
+
+-- updated_at растет при любом изменении строки (в т.ч. смене is_active / is_approved)
+CREATE OR REPLACE FUNCTION brand_items_touch_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.updated_at = NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS brand_items_touch ON brand_items;
+CREATE TRIGGER brand_items_touch
+    BEFORE UPDATE ON brand_items
+    FOR EACH ROW
+    EXECUTE FUNCTION brand_items_touch_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_brand_items_updated_at ON brand_items(updated_at);
+
+-- Удаленные товары (надгробия): бэкенд убирает их из каталога
+CREATE TABLE IF NOT EXISTS brand_items_deleted (
+  id UUID PRIMARY KEY,
+  deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_brand_items_deleted_at ON brand_items_deleted(deleted_at);
+
+CREATE OR REPLACE FUNCTION brand_items_tombstone()
+RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO brand_items_deleted (id, deleted_at)
+  VALUES (OLD.id, NOW())
+  ON CONFLICT (id) DO UPDATE SET deleted_at = NOW();
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS brand_items_deleted_tombstone ON brand_items;
+CREATE TRIGGER brand_items_deleted_tombstone
+    AFTER DELETE ON brand_items
+    FOR EACH ROW
+    EXECUTE FUNCTION brand_items_tombstone();
+
+-- Лента: id строк, измененных начиная с since, и видны ли они публично
+-- (полные строки видимых товаров бэкенд читает обычным select под RLS).
+-- >=, а не >: строка с тем же updated_at, что и отметка, могла закоммититься
+-- после прошлого чтения ленты; повторно пришедшие граничные строки безвредны
+CREATE OR REPLACE FUNCTION brand_item_changes(since TIMESTAMP WITH TIME ZONE)
+RETURNS TABLE (id UUID, updated_at TIMESTAMP WITH TIME ZONE, visible BOOLEAN) AS $$
+  SELECT bi.id, bi.updated_at, (bi.is_approved AND bi.is_active) AS visible
+  FROM brand_items bi
+  WHERE bi.updated_at >= since
+  UNION ALL
+  SELECT d.id, d.deleted_at, false
+  FROM brand_items_deleted d
+  WHERE d.deleted_at >= since
+  ORDER BY 2;
+$$ LANGUAGE sql STABLE SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION brand_item_changes(TIMESTAMP WITH TIME ZONE) TO anon, authenticated;
+
+COMMENT ON TABLE brand_items_deleted IS 'Удаленные товары брендов (для инкрементальной синхронизации бэкенда)';
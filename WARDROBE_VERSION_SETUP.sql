@@ -0,0 +1,64 @@
+-- ================================================================================
+-- ВЕРСИЯ ГАРДЕРОБА ДЛЯ КЭША НА БЭКЕНДЕ
+-- ================================================================================
+-- Бэкенд загружает гардероб по telegram_id сам (backend/wardrobe_store.py) и кэширует
+-- его по версии. Версия растет на каждый INSERT/UPDATE/DELETE в wardrobe —
+-- фронтенд пишет в таблицу напрямую, поэтому счетчик ведет триггер.
+--
+-- Выполните этот SQL в Supabase SQL Editor. Без него бэкенд работает как раньше,
+-- но читает гардероб из Supabase на каждый запрос (без кэша).
+-- ================================================================================
+
+CREATE TABLE IF NOT EXISTS wardrobe_version (
+  telegram_id TEXT PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Читать версию может бэкенд (anon key); писать — только триггер
+ALTER TABLE wardrobe_version ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Public can read wardrobe version" ON wardrobe_version;
+CREATE POLICY "Public can read wardrobe version"
+ON wardrobe_version
+FOR SELECT
+TO anon, authenticated
+USING (true);
+
+-- Увеличение версии гардероба пользователя
+CREATE OR REPLACE FUNCTION bump_wardrobe_version(p_telegram_id TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+  new_version BIGINT;
+BEGIN
+  INSERT INTO wardrobe_version (telegram_id, version, updated_at)
+  VALUES (p_telegram_id, 1, NOW())
+  ON CONFLICT (telegram_id)
+  DO UPDATE SET version = wardrobe_version.version + 1, updated_at = NOW()
+  RETURNING version INTO new_version;
+  RETURN new_version;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Триггер: любое изменение вещи увеличивает версию ее владельца
+-- (при смене telegram_id — версии обоих пользователей)
+CREATE OR REPLACE FUNCTION wardrobe_version_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM bump_wardrobe_version(NEW.telegram_id);
+  END IF;
+  IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.telegram_id IS DISTINCT FROM NEW.telegram_id) THEN
+    PERFORM bump_wardrobe_version(OLD.telegram_id);
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS wardrobe_version_bump ON wardrobe;
+CREATE TRIGGER wardrobe_version_bump
+    AFTER INSERT OR UPDATE OR DELETE ON wardrobe
+    FOR EACH ROW
+    EXECUTE FUNCTION wardrobe_version_trigger();
+
+COMMENT ON TABLE wardrobe_version IS 'Версия гардероба пользователя (растет при любом изменении wardrobe), ключ кэша бэкенда';
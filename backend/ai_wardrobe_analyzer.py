@@ -8,8 +8,12 @@ from dataclasses import dataclass
 from enum import Enum
 import asyncio
 from functools import lru_cache
+from collections import OrderedDict
+import threading
+import time
 import openai
 import os
+from resilience import OPENAI, get_dependency, guard
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -38,6 +42,33 @@ class AnalysisResult:
     explanation: str
     timestamp: datetime
 
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализация для кэша (enum — значением, дата — ISO-строкой)"""
+        return {
+            'category': self.category,
+            'season': self.season,
+            'style': self.style,
+            'colors': list(self.colors),
+            'confidence': self.confidence,
+            'ai_type': self.ai_type.value,
+            'explanation': self.explanation,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'AnalysisResult':
+        timestamp = data.get('timestamp')
+        return cls(
+            category=data['category'],
+            season=data['season'],
+            style=data['style'],
+            colors=list(data.get('colors') or []),
+            confidence=float(data['confidence']),
+            ai_type=AIType(data['ai_type']),
+            explanation=data['explanation'],
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+        )
+
 @dataclass
 class UserFeedback:
     """Обратная связь пользователя"""
@@ -177,6 +208,44 @@ class RuleBasedAnalyzer:
             timestamp=datetime.now()
         )
 
+# Полный системный промпт (правила) – из сообщения пользователя
+GPT_VISION_SYSTEM_PROMPT = (
+    "Ты — эксперт по распознаванию одежды на фотографиях.\n"
+    "Твоя задача — по изображению определить конкретный тип вещи, её сезонность и составить информативное краткое описание, которое будет использоваться стилистом для создания капсул и стилистических рекомендаций.\n\n"
+    "Верни результат в формате строго валидного JSON:\n"
+    "{\n"
+    "\"type\": \"\",          // Название конкретной вещи\n"
+    "\"season\": \"\",        // Сезонность\n"
+    "\"description\": \"\"    // Краткое, точное описание\n"
+    "}\n\n"
+    "Пояснение к каждому полю:\n\n"
+    "1. \"type\"\n   Укажи конкретный тип вещи, используя профессиональные названия. Например:\n\n"
+    "* \"водолазка\"\n* \"свитер\"\n* \"джемпер\"\n* \"футболка\"\n* \"рубашка\"\n* \"брюки\"\n* \"джинсы\"\n* \"юбка\"\n* \"пальто\"\n* \"платье\"\n* \"босоножки\"\n* \"ботинки\"\n* \"сумка\"\n* \"шарф\"\n\n"
+    "Не упрощай до категорий вроде \"верх\", \"низ\", \"аксессуар\", \"обувь\" — это делает другой ассистент.\n\n"
+    "2. \"season\"\n   Укажи один из сезонов, в который вещь уместна:\n\n"
+    "* \"лето\" — лёгкие, открытые вещи\n* \"осень-весна\" — средняя плотность, базовые вещи\n* \"зима\" — утеплённые, тёплые вещи\n* \"всесезон\" — можно носить круглый год (например, футболки, рубашки, джинсы)\n\n"
+    "3. \"description\"\n   Кратко, но по делу. Укажи:\n\n"
+    "* фасон (прямой, oversize, приталенный и т.д.)\n* цвет\n* материал (если можно определить)\n* особенности (воротник, рукава, застёжки, длина, декор и т.д.)\n\n"
+    "Примеры:\n\n"
+    "* \"Водолазка приталенного кроя, бежевого цвета, вязаная, с высоким воротом\"\n"
+    "* \"Свитер oversize, серый, крупной вязки, с круглым вырезом\"\n"
+    "* \"Юбка миди, чёрная, прямого кроя, с разрезом спереди\"\n\n"
+    "Важно:\n\n"
+    "* Не придумывай — анализируй только то, что видно на фото\n"
+    "* Не добавляй никакой текст кроме JSON\n"
+    "* Всегда указывай \"type\", даже если он не очевиден — выбери наиболее вероятный\n"
+    "* Не сокращай и не упрощай описание\n"
+    "* Не используй markdown или дополнительные пояснения — только JSON"
+)
+
+# Короткий пользовательский текст без дублирования правил
+GPT_VISION_USER_TEXT = "Проанализируй изображение и верни строго валидный JSON по правилам выше."
+
+# Версия промпта входит в ключ кэша: при изменении текста старые ответы не используются
+GPT_VISION_PROMPT_VERSION = hashlib.sha256(
+    (GPT_VISION_SYSTEM_PROMPT + GPT_VISION_USER_TEXT).encode('utf-8')
+).hexdigest()[:12]
+
 class GPTAnalyzer:
     """GPT анализатор для анализа гардероба"""
     
@@ -187,49 +256,29 @@ class GPTAnalyzer:
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY не установлен")
         
-        # Глобальный таймаут на уровне клиента, чтобы SDK гарантированно применял его
-        self.client = openai.OpenAI(api_key=self.api_key, timeout=60)
+        # Ключ из окружения — общий клиент процесса (openai_client.py); иначе свой,
+        # с глобальным таймаутом на уровне клиента, чтобы SDK гарантированно применял его
+        from openai_client import get_openai_client
+        self.client = get_openai_client() if self.api_key == os.getenv('OPENAI_API_KEY') else None
+        if self.client is None:
+            self.client = openai.OpenAI(api_key=self.api_key, timeout=60)
+    
+    @property
+    def cache_version(self) -> str:
+        """Модель + версия промпта (часть ключа кэша результатов)"""
+        return f"{self.model}:{GPT_VISION_PROMPT_VERSION}"
     
     def analyze(self, image_description: str, image_base64: str = None) -> AnalysisResult:
         """Анализирует изображение с помощью GPT (Vision)"""
+        if not get_dependency(OPENAI).available():
+            # Предохранитель OpenAI открыт — не загружаем фото и не ждем очередь
+            print("⚡ OpenAI недоступен (предохранитель открыт) — распознавание пропущено")
+            return self._unrecognized('OpenAI временно недоступен, попробуйте позже')
         try:
             print(f"🔍 Начинаем GPT анализ. image_base64: {'есть' if image_base64 else 'нет'}")
             if image_base64:
                 print(f"📏 Размер base64: {len(image_base64)} символов")
             
-            # Полный системный промпт (правила) – из сообщения пользователя
-            system_prompt = (
-                "Ты — эксперт по распознаванию одежды на фотографиях.\n"
-                "Твоя задача — по изображению определить конкретный тип вещи, её сезонность и составить информативное краткое описание, которое будет использоваться стилистом для создания капсул и стилистических рекомендаций.\n\n"
-                "Верни результат в формате строго валидного JSON:\n"
-                "{\n"
-                "\"type\": \"\",          // Название конкретной вещи\n"
-                "\"season\": \"\",        // Сезонность\n"
-                "\"description\": \"\"    // Краткое, точное описание\n"
-                "}\n\n"
-                "Пояснение к каждому полю:\n\n"
-                "1. \"type\"\n   Укажи конкретный тип вещи, используя профессиональные названия. Например:\n\n"
-                "* \"водолазка\"\n* \"свитер\"\n* \"джемпер\"\n* \"футболка\"\n* \"рубашка\"\n* \"брюки\"\n* \"джинсы\"\n* \"юбка\"\n* \"пальто\"\n* \"платье\"\n* \"босоножки\"\n* \"ботинки\"\n* \"сумка\"\n* \"шарф\"\n\n"
-                "Не упрощай до категорий вроде \"верх\", \"низ\", \"аксессуар\", \"обувь\" — это делает другой ассистент.\n\n"
-                "2. \"season\"\n   Укажи один из сезонов, в который вещь уместна:\n\n"
-                "* \"лето\" — лёгкие, открытые вещи\n* \"осень-весна\" — средняя плотность, базовые вещи\n* \"зима\" — утеплённые, тёплые вещи\n* \"всесезон\" — можно носить круглый год (например, футболки, рубашки, джинсы)\n\n"
-                "3. \"description\"\n   Кратко, но по делу. Укажи:\n\n"
-                "* фасон (прямой, oversize, приталенный и т.д.)\n* цвет\n* материал (если можно определить)\n* особенности (воротник, рукава, застёжки, длина, декор и т.д.)\n\n"
-                "Примеры:\n\n"
-                "* \"Водолазка приталенного кроя, бежевого цвета, вязаная, с высоким воротом\"\n"
-                "* \"Свитер oversize, серый, крупной вязки, с круглым вырезом\"\n"
-                "* \"Юбка миди, чёрная, прямого кроя, с разрезом спереди\"\n\n"
-                "Важно:\n\n"
-                "* Не придумывай — анализируй только то, что видно на фото\n"
-                "* Не добавляй никакой текст кроме JSON\n"
-                "* Всегда указывай \"type\", даже если он не очевиден — выбери наиболее вероятный\n"
-                "* Не сокращай и не упрощай описание\n"
-                "* Не используй markdown или дополнительные пояснения — только JSON"
-            )
-            
-            # Короткий пользовательский текст без дублирования правил
-            user_text = "Проанализируй изображение и верни строго валидный JSON по правилам выше."
-            
             # Попытка использовать загрузку файла для очень больших изображений, чтобы избежать огромных data URL
             use_file_upload = False
             file_id: Optional[str] = None
@@ -237,10 +286,11 @@ class GPTAnalyzer:
                 if image_base64 and len(image_base64) > 4_000_000:  # ~4М символов
                     import base64
                     image_bytes = base64.b64decode(image_base64)
-                    file = self.client.files.create(
-                        file=("image.jpg", image_bytes, "image/jpeg"),
-                        purpose="vision"
-                    )
+                    with guard(OPENAI):
+                        file = self.client.files.create(
+                            file=("image.jpg", image_bytes, "image/jpeg"),
+                            purpose="vision"
+                        )
                     file_id = file.id
                     use_file_upload = True
                     print(f"📄 Загружен файл в OpenAI Files, id={file_id}")
@@ -256,9 +306,9 @@ class GPTAnalyzer:
             # Если не использовали файл, отправляем через Chat Completions с data URL
             if not use_file_upload:
                 messages = [
-                    {"role": "system", "content": system_prompt}
+                    {"role": "system", "content": GPT_VISION_SYSTEM_PROMPT}
                 ]
-                user_content: List[Dict[str, Any]] = [{"type": "text", "text": user_text}]
+                user_content: List[Dict[str, Any]] = [{"type": "text", "text": GPT_VISION_USER_TEXT}]
                 if image_base64:
                     user_content.append({
                         "type": "image_url",
@@ -266,7 +316,10 @@ class GPTAnalyzer:
                     })
                 messages.append({"role": "user", "content": user_content})
                 
-                response = self.client.chat.completions.create(
+                from openai_client import PRIORITY_ANALYSIS, get_openai_scheduler
+                response = get_openai_scheduler().chat_completion(
+                    PRIORITY_ANALYSIS,
+                    client=self.client,
                     model=self.model,
                     messages=messages,
                     temperature=0.1,
@@ -306,16 +359,21 @@ class GPTAnalyzer:
         except Exception as e:
             logger.error(f"Ошибка GPT анализа: {e}")
             # Возврат минимального результата без догадок
-            return AnalysisResult(
-                category='не распознано',
-                season='не распознано',
-                style='не распознано',
-                colors=['не распознано'],
-                confidence=0.0,
-                ai_type=AIType.GPT,
-                explanation='GPT не смог распознать предмет',
-                timestamp=datetime.now()
-            )
+            return self._unrecognized('GPT не смог распознать предмет')
+    
+    @staticmethod
+    def _unrecognized(explanation: str) -> AnalysisResult:
+        """Результат «не распознано» (confidence 0 — в кэш не попадает)"""
+        return AnalysisResult(
+            category='не распознано',
+            season='не распознано',
+            style='не распознано',
+            colors=['не распознано'],
+            confidence=0.0,
+            ai_type=AIType.GPT,
+            explanation=explanation,
+            timestamp=datetime.now()
+        )
 
 class RedisCache:
     """Кэш для AI результатов"""
@@ -367,6 +425,34 @@ class RedisCache:
             logger.error(f"Ошибка удаления из кэша: {e}")
             return False
 
+class MemoryLRUCache:
+    """L1-кэш в памяти процесса (LRU с TTL), перед Redis"""
+    
+    def __init__(self, max_size: int = 512, ttl: int = 86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Dict) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
 class AIMetrics:
     """Метрики для отслеживания качества AI"""
     
@@ -437,29 +523,41 @@ class AIMetrics:
 class AIWardrobeAnalyzer:
     """Основной класс для анализа гардероба с fallback и кэшированием"""
     
-    def __init__(self, primary_ai=None, fallback_ai=None, cache_url: str = "redis://localhost:6379"):
+    def __init__(self, primary_ai=None, fallback_ai=None, cache_url: str = "redis://localhost:6379",
+                 cache_ttl: int = 2592000, l1_size: int = 512):
         self.primary_ai = primary_ai
         self.fallback_ai = fallback_ai or RuleBasedAnalyzer()
         self.cache = RedisCache(cache_url)
+        self.cache_ttl = cache_ttl
+        self.l1_cache = MemoryLRUCache(max_size=l1_size, ttl=cache_ttl)
         self.metrics = AIMetrics(cache_url)
-        self.circuit_breaker = CircuitBreaker()
+        # Общий для воркера предохранитель OpenAI (resilience.py)
+        self.circuit_breaker = get_dependency(OPENAI).breaker
     
-    def analyze_item(self, image_description: str, user_id: str = None, image_base64: str = None) -> AnalysisResult:
-        """Анализирует предмет гардероба с fallback"""
+    def analyze_item(self, image_description: str, user_id: str = None, image_base64: str = None,
+                     image_key: str = None) -> AnalysisResult:
+        """
+        Анализирует предмет гардероба с fallback
+        
+        image_key — хеш пикселей обработанного фото (см. image_cache.image_key);
+        если не передан, ключом служит хеш самого изображения/описания.
+        """
         
-        # Создаем хеш для кэширования
-        image_hash = self._create_image_hash(image_description)
+        # Ключ кэша: содержимое + модель + версия промпта
+        cache_key = self._create_cache_key(image_description, image_base64, image_key)
         
-        # Отключаем кэш для анализа изображений
-        # cached_result = self.cache.get(image_hash)
-        # if cached_result:
-        #     logger.info("Используем кэшированный результат")
-        #     return AnalysisResult(**cached_result)
+        cached_result = self._get_cached(cache_key)
+        if cached_result:
+            logger.info("Используем кэшированный результат")
+            return cached_result
         
         try:
             # Используем только GPT AI
             if self.primary_ai:
                 result = self.primary_ai.analyze(image_description, image_base64)
+                # Неудачи не кэшируем — следующая попытка снова пойдет в модель
+                if result.confidence > 0:
+                    self._set_cached(cache_key, result)
                 return result
             else:
                 raise AIError("GPT AI не инициализирован")
@@ -493,6 +591,37 @@ class AIWardrobeAnalyzer:
         """Создает хеш для изображения"""
         return hashlib.md5(description.encode()).hexdigest()
     
+    def _create_cache_key(self, image_description: str, image_base64: str = None, image_key: str = None) -> str:
+        """Ключ кэша: хеш содержимого + модель и версия промпта"""
+        if image_key:
+            content_hash = f"px:{image_key}"
+        elif image_base64:
+            content_hash = f"b64:{hashlib.sha256(image_base64.encode()).hexdigest()}"
+        else:
+            content_hash = f"txt:{self._create_image_hash(image_description or '')}"
+        version = getattr(self.primary_ai, 'cache_version', type(self.primary_ai).__name__)
+        return f"ai_analysis:{version}:{content_hash}"
+    
+    def _get_cached(self, cache_key: str) -> Optional[AnalysisResult]:
+        """L1 (память процесса) → Redis"""
+        data = self.l1_cache.get(cache_key)
+        if data is None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                self.l1_cache.set(cache_key, data)
+        if data is None:
+            return None
+        try:
+            return AnalysisResult.from_dict(data)
+        except Exception as e:
+            logger.warning(f"Битая запись кэша {cache_key}: {e}")
+            return None
+    
+    def _set_cached(self, cache_key: str, result: AnalysisResult) -> None:
+        data = result.to_dict()
+        self.l1_cache.set(cache_key, data)
+        self.cache.set(cache_key, data, ttl=self.cache_ttl)
+    
     def record_feedback(self, analysis_result: AnalysisResult, feedback: UserFeedback):
         """Записывает обратную связь пользователя"""
         try:
@@ -512,39 +641,6 @@ class AIWardrobeAnalyzer:
         
         return stats
 
-class CircuitBreaker:
-    """Circuit breaker для защиты от сбоев AI"""
-    
-    def __init__(self, failure_threshold: int = 5, timeout: int = 60):
-        self.failure_threshold = failure_threshold
-        self.timeout = timeout
-        self.failure_count = 0
-        self.last_failure_time = None
-        self.state = "CLOSED"  # CLOSED, OPEN, HALF_OPEN
-    
-    def is_open(self) -> bool:
-        """Проверяет, открыт ли circuit breaker"""
-        if self.state == "OPEN":
-            if datetime.now() - self.last_failure_time > timedelta(seconds=self.timeout):
-                self.state = "HALF_OPEN"
-                return False
-            return True
-        return False
-    
-    def record_success(self):
-        """Записывает успешный запрос"""
-        self.failure_count = 0
-        self.state = "CLOSED"
-    
-    def record_failure(self):
-        """Записывает неудачный запрос"""
-        self.failure_count += 1
-        self.last_failure_time = datetime.now()
-        
-        if self.failure_count >= self.failure_threshold:
-            self.state = "OPEN"
-            logger.warning(f"Circuit breaker открыт после {self.failure_count} неудач")
-
 # Фабрика для создания анализаторов
 class AIAnalyzerFactory:
     """Фабрика для создания AI анализаторов"""
@@ -1,61 +1,80 @@
 from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
-try:
-    # Используем явную сессию и тюним маттинг для более качественной сегментации
-    from rembg.bg import remove as _rembg_remove, new_session as _rembg_new_session
-    _REMBG_SESSION = None
+import importlib.util
+from bg_removal_pool import remove_background as _pool_remove_background, BackgroundRemovalBusy, BG_REMOVAL_VERSION
+from image_cache import get_image_cache, image_key
 
-    def _ensure_rembg_session():
-        global _REMBG_SESSION
-        if _REMBG_SESSION is None:
-            try:
-                _REMBG_SESSION = _rembg_new_session(model_name='u2net')
-                print('✅ rembg session initialized (u2net)')
-            except Exception as _se:
-                print(f'❌ rembg session init failed: {_se}')
-                _REMBG_SESSION = None
-
-    def remove_bg(image):
-        """Удаляет фон, возвращая PIL.Image RGBA. В случае ошибки возвращает исходное изображение."""
-        try:
-            _ensure_rembg_session()
-            kwargs = {}
-            if _REMBG_SESSION is not None:
-                kwargs.update({
-                    'session': _REMBG_SESSION,
-                    'alpha_matting': True,
-                    'alpha_matting_foreground_threshold': 240,
-                    'alpha_matting_background_threshold': 10,
-                    'alpha_matting_erode_size': 10,
-                    'post_process_mask': True,
-                })
-            out = _rembg_remove(image, **kwargs)
-            # rembg.remove может вернуть bytes (PNG) — конвертируем в PIL.Image
-            if isinstance(out, (bytes, bytearray)):
-                buf = io.BytesIO(out)
-                img = Image.open(buf)
-                return img.convert('RGBA') if img.mode != 'RGBA' else img
-            if isinstance(out, Image.Image):
-                return out.convert('RGBA') if out.mode != 'RGBA' else out
-            return image
-        except Exception as _re:
-            print(f'⚠️ rembg failed, returning original image: {_re}')
-            return image
-    REMBG_AVAILABLE = True
-except Exception as _e:
-    # rembg/onnxruntime not available in slim image; fall back to no-op
-    def remove_bg(image):
+# rembg/onnxruntime работают в отдельном пуле процессов (bg_removal_pool.py);
+# в процесс воркера модель не загружается
+REMBG_AVAILABLE = importlib.util.find_spec('rembg') is not None
+
+
+def remove_bg(image):
+    """
+    Удаляет фон, возвращая PIL.Image RGBA. В случае ошибки возвращает исходное изображение.
+    BackgroundRemovalBusy пробрасывается — очередь пула заполнена, клиенту отвечаем 429.
+    """
+    if not REMBG_AVAILABLE:
+        # rembg/onnxruntime not available in slim image; fall back to no-op
+        return image
+    try:
+        return _pool_remove_background(image)
+    except BackgroundRemovalBusy:
+        raise
+    except Exception as _re:
+        print(f'⚠️ rembg failed, returning original image: {_re}')
+        return image
+
+
+def _orient_photo(image):
+    """Поворот по EXIF (пиксели в том виде, в каком фото видит пользователь)"""
+    from PIL import ImageOps
+    try:
+        return ImageOps.exif_transpose(image)
+    except Exception:
         return image
-    REMBG_AVAILABLE = False
+
+
+def _normalize_photo(image, max_side: int = 1024):
+    """
+    Поворот по EXIF, RGB (без палитры/альфы) и уменьшение до max_side —
+    одинаково во всех маршрутах обработки фото, чтобы ключ кэша совпадал
+    """
+    image = _orient_photo(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side))
+    return image
+
+
+def _image_cache_key(image):
+    """Ключ кэша результатов удаления фона по пикселям фото (None, если посчитать не удалось)"""
+    try:
+        return image_key(image, BG_REMOVAL_VERSION)
+    except Exception as e:
+        print(f"⚠️ Не удалось вычислить ключ кэша фото: {e}")
+        return None
+
+
+def _bg_removal_busy_response(**extra):
+    """Ответ 429, когда очередь удаления фона заполнена"""
+    response = jsonify({'error': 'Сервер перегружен обработкой фото, попробуйте через несколько секунд', **extra})
+    response.status_code = 429
+    response.headers['Retry-After'] = '5'
+    return response
+
 from PIL import Image
 import io
 import base64
 import uuid
 import os
-import requests
+from http_client import get_http_stats
 import asyncio
 import threading
 import time
+import random
 from datetime import datetime
 from dotenv import load_dotenv
 from config import Config
@@ -69,18 +88,24 @@ import hashlib
 from typing import List, Dict, Any
 import logging
 from functools import lru_cache
-import openai
 import json as _json_for_cache
 
 # Redis client (optional)
-try:
-    import redis as _redis
-    _redis_client = _redis.from_url(getattr(Config, 'REDIS_URL', 'redis://localhost:6379'))
-    _ = _redis_client.ping()
-    print(f"✅ Redis подключен: {Config.REDIS_URL}")
-except Exception as _re:
-    print(f"⚠️ Redis недоступен или не сконфигурирован: {_re}")
-    _redis_client = None
+from redis_client import get_redis_client
+from capsule_cache import (
+    capsule_cache_key, choose_encoding, encode_response, load_decoded, load_encoded,
+    response_body, store_encoded, weather_temperature
+)
+from single_flight import get_single_flight
+from wardrobe_store import get_wardrobe_store, wardrobe_image_url
+from search_index import get_search_index
+from weather_cache import WeatherError, get_weather_cache
+from resilience import DependencyUnavailable, get_resilience_stats
+from openai_client import (
+    PRIORITY_CHAT, PRIORITY_RECOMMENDATIONS, estimate_tokens, get_openai_client, get_openai_scheduler
+)
+from chat_service import CHAT_ASSISTANT_ID, format_history_messages, prepare_chat_image, run_tool_calls
+_redis_client = get_redis_client()
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
@@ -152,7 +177,9 @@ except Exception as e:
 try:
     ai_analyzer = AIAnalyzerFactory.create_analyzer(
         ai_type=Config.AI_GENERATOR_TYPE,
-        cache_url=Config.REDIS_URL if hasattr(Config, 'REDIS_URL') else "redis://localhost:6379"
+        cache_url=Config.REDIS_URL if hasattr(Config, 'REDIS_URL') else "redis://localhost:6379",
+        cache_ttl=Config.AI_ANALYSIS_CACHE_TTL,
+        l1_size=Config.AI_ANALYSIS_L1_SIZE
     )
     print(f"✅ AI анализатор гардероба инициализирован")
 except Exception as e:
@@ -168,6 +195,33 @@ def health_check():
         'service': 'wardrobe-background-removal'
     })
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Внутренняя статистика воркера (клиенты, кэши, задержки)"""
+    from supabase_client import get_supabase_stats
+    from brand_catalog import get_brand_catalog
+    from brand_service_v4 import get_brand_fetch
+    from bg_removal_pool import get_bg_removal_stats
+    from catalog_snapshot import get_snapshot_store
+    snapshots = get_snapshot_store()
+    return jsonify({
+        'pid': os.getpid(),
+        'timestamp': datetime.now().isoformat(),
+        'supabase': get_supabase_stats(),
+        'brand_catalog': get_brand_catalog().stats(),
+        'brand_fetch': get_brand_fetch().stats(),
+        'bg_removal': get_bg_removal_stats(),
+        'image_cache': get_image_cache().stats(),
+        'single_flight': get_single_flight().stats(),
+        'wardrobe_store': get_wardrobe_store().stats(),
+        'search_index': get_search_index().stats(),
+        'http': get_http_stats(),
+        'weather_cache': get_weather_cache().stats(),
+        'openai': get_openai_scheduler().stats(),
+        'dependencies': get_resilience_stats(),
+        'catalog_snapshot': snapshots.stats() if snapshots is not None else None
+    })
+
 @app.route('/remove-background', methods=['POST'])
 def remove_background():
     """Удаление фона с изображения"""
@@ -182,16 +236,31 @@ def remove_background():
         if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
             return jsonify({'error': 'Invalid file type. Only PNG, JPG, JPEG, and WebP are supported'}), 400
         
-        # Читаем изображение
-        image = Image.open(file.stream)
+        # Фон удаляется с полноразмерного фото (после поворота по EXIF); ключ кэша —
+        # по уменьшенной копии, как в /analyze-wardrobe-item (хешируется 1024 px, а не оригинал)
+        image = _orient_photo(Image.open(file.stream))
         
-        # Удаляем фон (если доступно); иначе возвращаем исходное
-        result = remove_bg(image)
+        # Повторная загрузка того же фото — отдаем результат из кэша. Вариант полноразмерный,
+        # отдельный от вырезки 1024 px из /analyze-wardrobe-item: размер ответа не зависит от кэша
+        image_cache = get_image_cache()
+        cache_key = _image_cache_key(_normalize_photo(image))
+        img_byte_arr = image_cache.get(cache_key, 'cutout_full') if cache_key else None
         
-        # Конвертируем в байты
-        img_byte_arr = io.BytesIO()
-        result.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
+        if img_byte_arr is None:
+            # Удаляем фон (если доступно); иначе возвращаем исходное
+            try:
+                result = remove_bg(image)
+            except BackgroundRemovalBusy:
+                return _bg_removal_busy_response()
+            
+            # Конвертируем в байты
+            img_byte_arr = io.BytesIO()
+            result.save(img_byte_arr, format='PNG')
+            img_byte_arr = img_byte_arr.getvalue()
+            
+            # Кэшируем только реальный результат (не исходник после ошибки rembg)
+            if cache_key and result is not image:
+                image_cache.set(cache_key, 'cutout_full', img_byte_arr)
         
         # Возвращаем изображение
         return send_file(
@@ -289,6 +358,7 @@ def wardrobe_recommendations():
     """Возвращает умные рекомендации по гардеробу на основе профиля и списка вещей.
 
     Тело запроса: { "profile": {...}, "wardrobe": [...] }
+    или { "profile": {...}, "telegram_id": "..." } — гардероб загружается на бэкенде
     Ответ: { "recommendations": "строка с пунктами рекомендаций" }
     """
     try:
@@ -298,6 +368,9 @@ def wardrobe_recommendations():
         data = request.get_json(force=True) or {}
         profile = data.get('profile') or {}
         wardrobe = data.get('wardrobe') or []
+        telegram_id = data.get('telegram_id') or profile.get('telegram_id')
+        if not wardrobe and telegram_id:
+            wardrobe = get_wardrobe_store().get(telegram_id).items
 
         if not wardrobe:
             return jsonify({
@@ -407,8 +480,6 @@ def wardrobe_recommendations():
         api_key = os.getenv('OPENAI_API_KEY')
         if api_key:
             try:
-                client = openai.OpenAI(api_key=api_key)
-                
                 # Готовим данные о вещах для анализа GPT
                 items_for_model = []
                 for it in wardrobe:
@@ -432,7 +503,8 @@ def wardrobe_recommendations():
                     "}. Без лишних ключей и без markdown. Если неподходящих вещей немного, верни пустой массив."
                 )
 
-                resp = client.chat.completions.create(
+                resp = get_openai_scheduler().chat_completion(
+                    PRIORITY_RECOMMENDATIONS,
                     model="gpt-4o-mini",
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -497,25 +569,26 @@ def wardrobe_recommendations():
 
 @app.route('/weather', methods=['GET'])
 def get_weather():
-    """Получение погоды по координатам"""
+    """Получение погоды по координатам (кэш по ячейкам координат, см. weather_cache.py)"""
     try:
         lat = request.args.get('lat')
         lon = request.args.get('lon')
         
         if not lat or not lon:
             return jsonify({'error': 'Latitude and longitude required'}), 400
+        try:
+            lat, lon = float(lat), float(lon)
+        except ValueError:
+            return jsonify({'error': 'Latitude and longitude must be numbers'}), 400
         
-        # Получаем API ключ из переменных окружения
-        api_key = os.getenv('OPENWEATHER_API_KEY', 'd69e489c7ddeb793bff2350cc232dab7')
-        weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={api_key}&units=metric&lang=ru"
-        
-        import requests
-        weather_response = requests.get(weather_url, timeout=10)
-        
-        if weather_response.status_code == 200:
-            return jsonify(weather_response.json()), 200
-        else:
-            return jsonify({'error': 'Weather API error'}), weather_response.status_code
+        try:
+            return jsonify(get_weather_cache().get(lat, lon)), 200
+        except WeatherError as e:
+            return jsonify({'error': 'Weather API error'}), e.status
+        except DependencyUnavailable as e:
+            # OpenWeatherMap недоступен (предохранитель/bulkhead) — отвечаем сразу
+            retry_in = int(getattr(e, 'retry_in', 0)) or 1
+            return jsonify({'error': 'Weather service temporarily unavailable'}), 503, {'Retry-After': str(retry_in)}
             
     except Exception as e:
         print(f"Ошибка получения погоды: {e}")
@@ -553,22 +626,14 @@ def analyze_wardrobe_item():
         # Создаем объект изображения из байтов
         try:
             image = Image.open(io.BytesIO(file_content))
-            # Поправка ориентации по EXIF
-            try:
-                from PIL import ImageOps
-                image = ImageOps.exif_transpose(image)
-            except Exception:
-                pass
+            # Поворот по EXIF, RGB и уменьшение до разумного размера перед удалением фона
+            image = _normalize_photo(image)
             
             # Конвертируем HEIC в RGB если нужно
             if file.filename.lower().endswith(('.heic', '.heif')):
                 # Конвертируем в RGB если изображение в другом формате
                 if image.mode != 'RGB':
                     image = image.convert('RGB')
-            
-            # Убеждаемся, что изображение в формате RGB для дальнейшей обработки
-            if image.mode in ('RGBA', 'LA', 'P'):
-                image = image.convert('RGB')
                 
         except Exception as e:
             print(f"❌ Ошибка открытия изображения: {e}")
@@ -577,40 +642,54 @@ def analyze_wardrobe_item():
                 'success': False
             }), 400
         
-        # Уменьшаем изображение до разумного размера перед удалением фона
-        try:
-            max_side = 1024
-            w, h = image.size
-            if max(w, h) > max_side:
-                image = image.copy()
-                image.thumbnail((max_side, max_side))
-        except Exception:
-            pass
-
-        # Удаляем фон (если доступно); иначе сохраняем как есть
-        result_image = remove_bg(image)
-        
-        # Сжимаем и уменьшаем изображение перед base64 (JPEG 512x512)
-        work_img = result_image
-        # Сохраняем прозрачность, конвертируем в RGBA если нужно
-        print(f"🔍 Режим изображения до конвертации: {work_img.mode}")
-        if work_img.mode != 'RGBA':
-            work_img = work_img.convert('RGBA')
-            print(f"✅ Конвертировали в RGBA режим")
-
-        work_img.thumbnail((512, 512))
-        img_byte_arr = io.BytesIO()
-        work_img.save(img_byte_arr, format='PNG', optimize=True)
-        print(f"✅ Сохранили изображение в PNG формате с прозрачностью")
-        img_byte_arr.seek(0)
-        image_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+        # Повторная загрузка того же фото: вырезка и превью 512 px берутся из кэша
+        image_cache = get_image_cache()
+        cache_key = _image_cache_key(image)
+        thumb_png = image_cache.get(cache_key, 'thumb512') if cache_key else None
+        
+        if thumb_png is None:
+            cutout_png = image_cache.get(cache_key, 'cutout') if cache_key else None
+            if cutout_png is not None:
+                result_image = Image.open(io.BytesIO(cutout_png))
+                bg_removed = True
+            else:
+                # Удаляем фон (если доступно); иначе сохраняем как есть
+                try:
+                    result_image = remove_bg(image)
+                except BackgroundRemovalBusy:
+                    return _bg_removal_busy_response(success=False)
+                bg_removed = result_image is not image
+                if cache_key and bg_removed:
+                    cutout_buf = io.BytesIO()
+                    result_image.save(cutout_buf, format='PNG', compress_level=3)
+                    image_cache.set(cache_key, 'cutout', cutout_buf.getvalue())
+            
+            # Сжимаем и уменьшаем изображение перед base64 (JPEG 512x512)
+            work_img = result_image
+            # Сохраняем прозрачность, конвертируем в RGBA если нужно
+            print(f"🔍 Режим изображения до конвертации: {work_img.mode}")
+            if work_img.mode != 'RGBA':
+                work_img = work_img.convert('RGBA')
+                print(f"✅ Конвертировали в RGBA режим")
+
+            work_img.thumbnail((512, 512))
+            img_byte_arr = io.BytesIO()
+            work_img.save(img_byte_arr, format='PNG', optimize=True)
+            print(f"✅ Сохранили изображение в PNG формате с прозрачностью")
+            thumb_png = img_byte_arr.getvalue()
+            if cache_key and bg_removed:
+                image_cache.set(cache_key, 'thumb512', thumb_png)
+        else:
+            print(f"🟢 Фото уже обрабатывалось — превью из кэша")
+        image_base64 = base64.b64encode(thumb_png).decode('utf-8')
         
         # Если у нас есть AI анализатор, используем его
         analysis_result = None
         if ai_analyzer:
             try:
                 # Передаем изображение в base64 для GPT Vision анализа
-                analysis_result = ai_analyzer.analyze_item("", user_id, image_base64=image_base64)
+                # Ключ кэша результата — пиксели обработанного фото (повторная загрузка не идет в GPT)
+                analysis_result = ai_analyzer.analyze_item("", user_id, image_base64=image_base64, image_key=cache_key)
                 
                 return jsonify({
                     'success': True,
@@ -647,6 +726,14 @@ def analyze_wardrobe_item():
             'success': False
         }), 500
 
+def _encoded_json_response(body: bytes, encoding=None) -> Response:
+    """JSON-ответ из готовых (возможно сжатых) байтов"""
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/generate-capsules', methods=['POST'])
 def generate_capsules():
     """Генерация капсул гардероба"""
@@ -664,35 +751,60 @@ def generate_capsules():
         if weather is None:
             weather = {}
         
+        # Без wardrobe в теле — загружаем гардероб сами по telegram_id (кэш по версии)
+        wardrobe_fingerprint = None
+        telegram_id = data.get('telegram_id') or (profile or {}).get('telegram_id')
+        if not wardrobe and telegram_id:
+            snapshot = get_wardrobe_store().get(telegram_id)
+            wardrobe = snapshot.eligible_items()
+            wardrobe_fingerprint = snapshot.fingerprint
+        
         if not wardrobe:
             return jsonify({'error': 'No wardrobe items provided'}), 400
         
         # Попытка отдать из кэша (можно отключить флагом no_cache=true)
         no_cache = str(data.get('no_cache') or data.get('force_refresh') or '').lower() in ['1','true','yes']
         
-        # Ключ кэша по профилю+гардеробу+погоде
-        # При force_refresh добавляем timestamp для уникальности ключа
+        # Seed генерации: явный seed из запроса воспроизводит результат (например, при разборе),
+        # иначе берем новый. Возвращается в meta.seed
+        explicit_seed = data.get('seed')
+        if explicit_seed is not None:
+            try:
+                explicit_seed = int(explicit_seed) % (2**32)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'Invalid seed'}), 400
+        seed = explicit_seed if explicit_seed is not None else random.SystemRandom().getrandbits(32)
+        rng = random.Random(seed)
+        
+        # Канонический ключ кэша: только то, что читает генератор (см. capsule_cache.py)
+        engine = str(data.get('engine') or '').lower()
+        use_enhanced = data.get('use_enhanced_engine', True)  # По умолчанию используем улучшенный
+        enable_brand_mixing = data.get('enable_brand_items', True)
+        exclude_combos = data.get('exclude_combinations') or []
+        current_season = get_season_from_date()
         try:
-            cache_key_src = {
-                'wardrobe': wardrobe,
-                'profile': profile,
-                'weather': weather,
-                'engine': str((request.get_json() or {}).get('engine') or (request.get_json() or {}).get('rule_engine') or (request.get_json() or {}).get('no_gpt'))
-            }
-            # Если force_refresh, добавляем timestamp для уникальности (но не сохраняем в кэш)
-            if no_cache:
-                cache_key_src['_refresh_ts'] = int(time.time() * 1000)  # миллисекунды для уникальности
-            cache_key_hash = hashlib.sha256(_json_for_cache.dumps(cache_key_src, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
-            cache_key = f"capsules:{cache_key_hash}"
-        except Exception:
+            cache_key = capsule_cache_key(
+                wardrobe=wardrobe,
+                profile=profile,
+                weather=weather,
+                season=current_season,
+                engine=engine,
+                use_enhanced=bool(use_enhanced),
+                enable_brand_items=bool(enable_brand_mixing),
+                exclude_combinations=exclude_combos,
+                seed=explicit_seed,
+                wardrobe_fingerprint=wardrobe_fingerprint
+            )
+        except Exception as e:
+            print(f"⚠️ cache_key не создан: {e}")
             cache_key = None
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
         if _redis_client and cache_key and not no_cache:
             try:
-                cached = _redis_client.get(cache_key)
+                cached = load_encoded(_redis_client, cache_key, encoding)
                 if cached:
                     print(f"🟢 CACHE HIT: {cache_key}")
-                    cached_obj = json.loads(cached)
-                    return jsonify(cached_obj)
+                    return _encoded_json_response(*cached)
             except Exception:
                 print(f"⚠️ CACHE ERROR (read): {cache_key}")
         else:
@@ -703,146 +815,176 @@ def generate_capsules():
             elif not cache_key:
                 print("⚠️ cache_key не создан — кэш пропущен")
 
-        # Выбор движка: rule-based или GPT
-        engine = str(data.get('engine') or '').lower()
-        # По умолчанию используем RULE-движок; GPT только при явном engine=gpt
-        use_rule = engine != 'gpt'
-        if use_rule and rule_generate_capsules:
-            print('🧩 Используем rule-based генератор капсул (engine=rule, по умолчанию)')
-            print(f'📊 Статистика гардероба: всего {len(wardrobe)} вещей')
-            current_season = get_season_from_date()
-            temp_c = weather.get('main', {}).get('temp') or weather.get('temperature', 20)
-            try:
-                temp_c = float(temp_c)
-            except Exception:
-                temp_c = 20.0
-            # Лимит 20 капсул и исключение уже показанных комбинаций (если пришли с фронта)
-            exclude_combos = data.get('exclude_combinations') or []
-            
-            # Проверяем режим генерации: enhanced (улучшенный) или rule (базовый)
-            use_enhanced = data.get('use_enhanced_engine', True)  # По умолчанию используем улучшенный
+        encoded = {}  # сжатые варианты ответа, если считали в этом запросе
+
+        def compute_capsules():
+            """Генерация, подмешивание брендов и запись в кэш (выполняет лидер single-flight)"""
+            # Выбор движка: rule-based или GPT
+            # По умолчанию используем RULE-движок; GPT только при явном engine=gpt
+            use_rule = engine != 'gpt'
+            if use_rule and rule_generate_capsules:
+                print('🧩 Используем rule-based генератор капсул (engine=rule, по умолчанию)')
+                print(f'📊 Статистика гардероба: всего {len(wardrobe)} вещей')
+                temp_c = weather_temperature(weather)
+                # Лимит 20 капсул и исключение уже показанных комбинаций (если пришли с фронта)
             
-            if use_enhanced:
-                print(f'🎨 Параметры генерации (ENHANCED): сезон={current_season}, температура={temp_c}, max_total=20')
-                from capsule_engine_v6 import generate_capsules
+                # Проверяем режим генерации: enhanced (улучшенный) или rule (базовый)
+                if use_enhanced:
+                    print(f'🎨 Параметры генерации (ENHANCED): сезон={current_season}, температура={temp_c}, max_total=20')
+                    from capsule_engine_v6 import generate_capsules
                 
-                capsules_core = generate_capsules(
-                    wardrobe_items=wardrobe,
-                    season_hint=current_season,
-                    temp_c=temp_c,
-                    predpochtenia="Повседневный",
-                    figura=profile.get('figura',''),
-                    cvetotip=profile.get('cvetotip',''),
-                    banned_ids=[],
-                    allowed_ids=None,
-                    max_total=20
-                )
+                    capsules_core = generate_capsules(
+                        wardrobe_items=wardrobe,
+                        season_hint=current_season,
+                        temp_c=temp_c,
+                        predpochtenia="Повседневный",
+                        figura=profile.get('figura',''),
+                        cvetotip=profile.get('cvetotip',''),
+                        banned_ids=[],
+                        allowed_ids=None,
+                        max_total=20,
+                        rng=rng
+                    )
+                else:
+                    print(f'🔧 Параметры генерации (BASIC): сезон={current_season}, температура={temp_c}, max_total=20')
+                    capsules_core = rule_generate_capsules(
+                        wardrobe_items=wardrobe,
+                        season_hint=current_season,
+                        temp_c=temp_c,
+                        predpochtenia="Повседневный",
+                        figura=profile.get('figura',''),
+                        cvetotip=profile.get('cvetotip',''),
+                        banned_ids=[],
+                        allowed_ids=None,
+                        max_total=20,
+                        exclude_combinations=exclude_combos,  # ← ДОБАВЛЕНО: исключения
+                        rng=rng
+                    )
+                try:
+                    total_caps = sum(len(cat.get('fullCapsules', [])) for cat in capsules_core.get('categories', []))
+                except Exception:
+                    total_caps = 0
+                capsules_payload = { 'capsules': capsules_core, 'meta': { 'source': 'rule', 'total_capsules': total_caps, 'insufficient': total_caps == 0 } }
             else:
-                print(f'🔧 Параметры генерации (BASIC): сезон={current_season}, температура={temp_c}, max_total=20')
-                capsules_core = rule_generate_capsules(
-                    wardrobe_items=wardrobe,
-                    season_hint=current_season,
-                    temp_c=temp_c,
-                    predpochtenia="Повседневный",
-                    figura=profile.get('figura',''),
-                    cvetotip=profile.get('cvetotip',''),
-                    banned_ids=[],
-                    allowed_ids=None,
-                    max_total=20,
-                    exclude_combinations=exclude_combos  # ← ДОБАВЛЕНО: исключения
-                )
-            try:
-                total_caps = sum(len(cat.get('fullCapsules', [])) for cat in capsules_core.get('categories', []))
-            except Exception:
-                total_caps = 0
-            capsules_payload = { 'capsules': capsules_core, 'meta': { 'source': 'rule', 'total_capsules': total_caps, 'insufficient': total_caps == 0 } }
-        else:
-            # Generate capsules using GPT (без кэша)
-            capsules_payload = generate_capsules_with_ai(wardrobe, profile, weather)
-
-        # Backward/forward compatible shape: flatten to {capsules, meta}
-        if isinstance(capsules_payload, dict) and 'capsules' in capsules_payload:
-            capsules_obj = capsules_payload.get('capsules')
-            meta_obj = capsules_payload.get('meta', {})
-        else:
-            # fallback if helper returned plain structure
-            capsules_obj = capsules_payload
-            meta_obj = {}
+                # Generate capsules using GPT (без кэша)
+                capsules_payload = generate_capsules_with_ai(wardrobe, profile, weather)
 
-        # Дополнение капсул брендовыми товарами (если недостаточно вещей)
-        enable_brand_mixing = data.get('enable_brand_items', True)
-        
-        if enable_brand_mixing and capsules_obj:
-            try:
-                from brand_service_v5 import mix_brand_items_v5
-                from brand_service_v4 import supplement_capsules_with_brand_items
+            # Backward/forward compatible shape: flatten to {capsules, meta}
+            if isinstance(capsules_payload, dict) and 'capsules' in capsules_payload:
+                capsules_obj = capsules_payload.get('capsules')
+                meta_obj = capsules_payload.get('meta', {})
+            else:
+                # fallback if helper returned plain structure
+                capsules_obj = capsules_payload
+                meta_obj = {}
+            meta_obj['seed'] = seed
+
+            # Дополнение капсул брендовыми товарами (если недостаточно вещей)
+            mix_brands = bool(enable_brand_mixing and capsules_obj)
+            if mix_brands:
+                from brand_catalog import get_brand_catalog
+                if not get_brand_catalog().available(current_season):
+                    # Источники каталога недоступны — капсулы без товаров брендов, без ожидания
+                    print(f"⚠️ Каталог брендов [{current_season}] недоступен — подмешивание пропущено")
+                    mix_brands = False
+                    meta_obj['brand_mixing'] = 'unavailable'
+            if mix_brands:
+                try:
+                    from brand_service_v5 import mix_brand_items_v5
+                    from brand_service_v4 import supplement_capsules_with_brand_items
                 
-                # СНАЧАЛА дополняем недостающие капсулы
-                if 'categories' in capsules_obj:
-                    for category in capsules_obj['categories']:
-                        user_capsules = category.get('fullCapsules', [])
+                    # СНАЧАЛА дополняем недостающие капсулы
+                    if 'categories' in capsules_obj:
+                        for category in capsules_obj['categories']:
+                            user_capsules = category.get('fullCapsules', [])
                         
-                        if len(user_capsules) < total_caps:
-                            print(f"🛍️ ДОПОЛНЯЕМ КАПСУЛЫ брендовыми товарами...")
-                            supplemented = supplement_capsules_with_brand_items(
-                                user_capsules=user_capsules,
-                                target_count=total_caps,
-                                season=current_season,
-                                temperature=temp_c
-                            )
-                            category['fullCapsules'] = supplemented
-                            category['capsules'] = supplemented
+                            if len(user_capsules) < total_caps:
+                                print(f"🛍️ ДОПОЛНЯЕМ КАПСУЛЫ брендовыми товарами...")
+                                supplemented = supplement_capsules_with_brand_items(
+                                    user_capsules=user_capsules,
+                                    target_count=total_caps,
+                                    season=current_season,
+                                    temperature=temp_c,
+                                    rng=rng
+                                )
+                                category['fullCapsules'] = supplemented
+                                category['capsules'] = supplemented
                 
-                # ПОТОМ подмешиваем товары в существующие капсулы
-                print("🛍️ НАЧИНАЕМ ПОДМЕШИВАНИЕ V5...")
-                print("✅ V5 импортирован успешно")
+                    # ПОТОМ подмешиваем товары в существующие капсулы
+                    print("🛍️ НАЧИНАЕМ ПОДМЕШИВАНИЕ V5...")
+                    print("✅ V5 импортирован успешно")
                 
-                # Получаем капсулы из результата
-                if 'categories' in capsules_obj:
-                    for category in capsules_obj['categories']:
-                        user_capsules = category.get('fullCapsules', [])
+                    # Получаем капсулы из результата
+                    if 'categories' in capsules_obj:
+                        for category in capsules_obj['categories']:
+                            user_capsules = category.get('fullCapsules', [])
                         
-                        # V5 вызывается ВСЕГДА, даже если user_capsules пустые
-                        print(f"🔄 Вызываем V5 для {len(user_capsules)} капсул...")
-                        # НОВАЯ ЛОГИКА V5: гибкое распределение (7+6+3+3+1)
-                        mixed = mix_brand_items_v5(
-                            user_capsules=user_capsules,
-                            wardrobe=wardrobe,
-                            season=current_season,
-                            temperature=temp_c,
-                            exclude_combinations=exclude_combos
-                        )
-                        print("✅ V5 завершен успешно")
+                            # V5 вызывается ВСЕГДА, даже если user_capsules пустые
+                            print(f"🔄 Вызываем V5 для {len(user_capsules)} капсул...")
+                            # НОВАЯ ЛОГИКА V5: гибкое распределение (7+6+3+3+1)
+                            mixed = mix_brand_items_v5(
+                                user_capsules=user_capsules,
+                                wardrobe=wardrobe,
+                                season=current_season,
+                                temperature=temp_c,
+                                exclude_combinations=exclude_combos,
+                                rng=rng
+                            )
+                            print("✅ V5 завершен успешно")
                         
-                        category['fullCapsules'] = mixed
-                        category['capsules'] = mixed
+                            category['fullCapsules'] = mixed
+                            category['capsules'] = mixed
                         
-                        print(f"  🛍️ Подмешивание V5 завершено для категории")
-            except Exception as mix_error:
-                print(f"  ⚠️ Ошибка подмешивания товаров брендов: {mix_error}")
-                import traceback
-                traceback.print_exc()
-                # Продолжаем без подмешивания
+                            print(f"  🛍️ Подмешивание V5 завершено для категории")
+                except Exception as mix_error:
+                    print(f"  ⚠️ Ошибка подмешивания товаров брендов: {mix_error}")
+                    import traceback
+                    traceback.print_exc()
+                    # Продолжаем без подмешивания
 
-        response_obj = {
-            'capsules': capsules_obj,
-            'meta': meta_obj,
-            'message': 'Capsules generated successfully'
-        }
+            response_obj = {
+                'capsules': capsules_obj,
+                'meta': meta_obj,
+                'message': 'Capsules generated successfully'
+            }
 
-        # Сохраняем в кэш (только если не force_refresh)
-        if _redis_client and cache_key and not no_cache:
+            # Сохраняем в кэш (только если не force_refresh и ответ не урезан из-за недоступных зависимостей)
+            cacheable = bool(_redis_client and cache_key and not no_cache and 'brand_mixing' not in meta_obj)
+
+            # Сериализуем и сжимаем один раз: эти же байты идут в кэш и в ответ;
+            # некэшируемый ответ сжимаем только в кодировку клиента
+            encoded['variants'] = encode_response(response_obj) if cacheable else encode_response(response_obj, encoding)
+
+            if cacheable:
+                try:
+                    # Используем REDIS_TTL (24 часа) вместо CACHE_TTL для капсул
+                    ttl = getattr(Config, 'REDIS_TTL', 86400)  # 24 часа
+                    store_encoded(_redis_client, cache_key, encoded['variants'], ttl)
+                    print(f"🟡 CACHE SET: {cache_key} ttl={ttl}")
+                except Exception:
+                    print(f"⚠️ CACHE ERROR (write): {cache_key}")
+            elif no_cache:
+                print("⛔ force_refresh=true — кэш не сохраняется")
+            return response_obj
+
+        def load_cached():
+            if not _redis_client or no_cache:
+                return None
             try:
-                # Используем REDIS_TTL (24 часа) вместо CACHE_TTL для капсул
-                ttl = getattr(Config, 'REDIS_TTL', 86400)  # 24 часа
-                _redis_client.setex(cache_key, ttl, json.dumps(response_obj, ensure_ascii=False))
-                print(f"🟡 CACHE SET: {cache_key} ttl={ttl}")
+                return load_decoded(_redis_client, cache_key)
             except Exception:
-                print(f"⚠️ CACHE ERROR (write): {cache_key}")
-        elif no_cache:
-            print("⛔ force_refresh=true — кэш не сохраняется")
+                return None
+
+        # Одинаковые одновременные запросы (двойной тап, несколько вкладок) считаются один раз.
+        # force_refresh/no_cache всегда считается заново — не берет результат чужого лидера
+        if cache_key and not no_cache:
+            response_obj = get_single_flight().run(cache_key, compute_capsules, load=load_cached)
+        else:
+            response_obj = compute_capsules()
 
-        return jsonify(response_obj)
+        # Ведомые single-flight получили объект от лидера — сжимаем сами (только для своего клиента)
+        variants = encoded.get('variants') or encode_response(response_obj, encoding)
+        return _encoded_json_response(*response_body(variants, encoding))
         
     except TimeoutError as e:
         print(f"Timeout generating capsules: {str(e)}")
@@ -947,8 +1089,6 @@ def generate_capsules_with_gpt(wardrobe, profile, weather):
         
         print(f"🔑 API ключ найден (длина: {len(api_key)} символов)")
         
-        client = openai.OpenAI(api_key=api_key)
-        
         # 1. Определяем сезон детерминированно (без GPT)
         current_season = get_season_from_date()
         
@@ -1154,7 +1294,8 @@ def generate_capsules_with_gpt(wardrobe, profile, weather):
             print(f"⚠️ Не удалось вывести переменные системного промпта: {_spv_err}")
 
         try:
-            response = client.chat.completions.create(
+            response = get_openai_scheduler().chat_completion(
+                PRIORITY_RECOMMENDATIONS,
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -1328,8 +1469,6 @@ def get_current_season_with_gpt(weather_data):
         if not api_key:
             return "Круглогодично"
         
-        client = openai.OpenAI(api_key=api_key)
-        
         temp = weather_data.get('temperature', 20)
         condition = weather_data.get('condition', 'ясно')
         
@@ -1343,7 +1482,8 @@ def get_current_season_with_gpt(weather_data):
         Верни только название сезона без дополнительного текста.
         """
         
-        response = client.chat.completions.create(
+        response = get_openai_scheduler().chat_completion(
+            PRIORITY_RECOMMENDATIONS,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты метеоролог. Отвечай только названием сезона."},
@@ -1681,6 +1821,7 @@ def generate_looks():
       "name": "Название (опц)",
       "items": [ { "id": "..", "src": "https://...png", "category": "Футболка" }, ... ]
     }
+    или { "name": "..", "telegram_id": "..", "item_ids": ["..", ...] } — вещи берутся из гардероба на бэкенде
 
     Ответ: {
       "looks": [
@@ -1698,6 +1839,20 @@ def generate_looks():
         raw_items = data.get('items') or []
         look_name = data.get('name') or 'Образ'
 
+        # Вещи по id из гардероба пользователя (кэш по версии гардероба)
+        telegram_id = data.get('telegram_id')
+        item_ids = data.get('item_ids') or []
+        if not raw_items and telegram_id and item_ids:
+            by_id = {str(it.get('id')): it for it in get_wardrobe_store().get(telegram_id).items}
+            raw_items = [
+                {
+                    'id': item_id,
+                    'src': wardrobe_image_url(telegram_id, by_id[item_id].get('image_id')),
+                    'category': by_id[item_id].get('category')
+                }
+                for item_id in map(str, item_ids) if item_id in by_id
+            ]
+
         # Ключ кэша
         cache_key = None
         if _redis_client:
@@ -1719,268 +1874,87 @@ def generate_looks():
             except Exception:
                 cache_key = None
 
-        # Нормализуем вход
-        items = []
-        for it in (raw_items or [])[:6]:
-            try:
-                items.append({
-                    'id': str(it.get('id')),
-                    'src': it.get('src') or '',
-                    'category': str(it.get('category') or ''),
+        def compute_looks():
+            # Нормализуем вход
+            items = []
+            for it in (raw_items or [])[:6]:
+                try:
+                    items.append({
+                        'id': str(it.get('id')),
+                        'src': it.get('src') or '',
+                        'category': str(it.get('category') or ''),
+                    })
+                except Exception:
+                    continue
+
+            # Простейший расклад по слотам (в процентах). ratio = 4:5 (0.8)
+            slots = [
+                { 'x': 28, 'y': 35, 'w': 40, 'z': 2 },  # топ/платье
+                { 'x': 70, 'y': 60, 'w': 40, 'z': 2 },  # низ/outer
+                { 'x': 28, 'y': 75, 'w': 32, 'z': 3 },  # обувь
+                { 'x': 70, 'y': 28, 'w': 26, 'z': 3 },  # аксессуар
+                { 'x': 52, 'y': 50, 'w': 28, 'z': 1 },  # доп аксессуар
+                { 'x': 50, 'y': 82, 'w': 22, 'z': 1 },  # мелочь
+            ]
+
+            # Приоритезируем: dress -> top -> bottom -> shoes -> accessories -> outer -> rest
+            def cat(it):
+                c = (it.get('category') or '').lower()
+                if c in ['платье','dress','сарафан']: return 0
+                if c in ['блузка','футболка','рубашка','свитер','топ','джемпер','кофта','водолазка']: return 1
+                if c in ['юбка','брюки','джинсы','шорты','легинсы','леггинсы']: return 2
+                if c in ['обувь','туфли','ботинки','кроссовки','сапоги','сандалии','мокасины','балетки']: return 3
+                if c in ['сумка','аксессуары','украшения','пояс','шарф','часы','очки','серьги','колье','браслет','рюкзак']: return 4
+                if c in ['пиджак','куртка','пальто','кардиган','жакет','жилет']: return 5
+                return 6
+
+            items_sorted = sorted(items, key=cat)
+            placed = []
+            for i, it in enumerate(items_sorted[:len(slots)]):
+                slot = slots[i]
+                placed.append({
+                    'id': it['id'],
+                    'src': it['src'],
+                    'x': slot['x'],
+                    'y': slot['y'],
+                    'w': slot['w'],
+                    'z': slot['z'],
+                    'r': 0
                 })
-            except Exception:
-                continue
 
-        # Простейший расклад по слотам (в процентах). ratio = 4:5 (0.8)
-        slots = [
-            { 'x': 28, 'y': 35, 'w': 40, 'z': 2 },  # топ/платье
-            { 'x': 70, 'y': 60, 'w': 40, 'z': 2 },  # низ/outer
-            { 'x': 28, 'y': 75, 'w': 32, 'z': 3 },  # обувь
-            { 'x': 70, 'y': 28, 'w': 26, 'z': 3 },  # аксессуар
-            { 'x': 52, 'y': 50, 'w': 28, 'z': 1 },  # доп аксессуар
-            { 'x': 50, 'y': 82, 'w': 22, 'z': 1 },  # мелочь
-        ]
-
-        # Приоритезируем: dress -> top -> bottom -> shoes -> accessories -> outer -> rest
-        def cat(it):
-            c = (it.get('category') or '').lower()
-            if c in ['платье','dress','сарафан']: return 0
-            if c in ['блузка','футболка','рубашка','свитер','топ','джемпер','кофта','водолазка']: return 1
-            if c in ['юбка','брюки','джинсы','шорты','легинсы','леггинсы']: return 2
-            if c in ['обувь','туфли','ботинки','кроссовки','сапоги','сандалии','мокасины','балетки']: return 3
-            if c in ['сумка','аксессуары','украшения','пояс','шарф','часы','очки','серьги','колье','браслет','рюкзак']: return 4
-            if c in ['пиджак','куртка','пальто','кардиган','жакет','жилет']: return 5
-            return 6
-
-        items_sorted = sorted(items, key=cat)
-        placed = []
-        for i, it in enumerate(items_sorted[:len(slots)]):
-            slot = slots[i]
-            placed.append({
-                'id': it['id'],
-                'src': it['src'],
-                'x': slot['x'],
-                'y': slot['y'],
-                'w': slot['w'],
-                'z': slot['z'],
-                'r': 0
-            })
+            look = {
+                'id': 'look_1',
+                'name': look_name,
+                'canvas': { 'ratio': 0.8 },
+                'items': placed
+            }
+            resp = { 'looks': [look] }
 
-        look = {
-            'id': 'look_1',
-            'name': look_name,
-            'canvas': { 'ratio': 0.8 },
-            'items': placed
-        }
-        resp = { 'looks': [look] }
+            if _redis_client and cache_key:
+                try:
+                    ttl = getattr(Config, 'REDIS_TTL', 86400)
+                    _redis_client.setex(cache_key, ttl, json.dumps(resp, ensure_ascii=False))
+                except Exception:
+                    pass
+            return resp
 
-        if _redis_client and cache_key:
+        def load_cached():
             try:
-                ttl = getattr(Config, 'REDIS_TTL', 86400)
-                _redis_client.setex(cache_key, ttl, json.dumps(resp, ensure_ascii=False))
+                cached = _redis_client.get(cache_key)
+                return json.loads(cached) if cached else None
             except Exception:
-                pass
+                return None
+
+        if cache_key:
+            resp = get_single_flight().run(cache_key, compute_looks, load=load_cached)
+        else:
+            resp = compute_looks()
 
         return jsonify(resp)
     except Exception as e:
         print(f"❌ Ошибка формирования луков: {e}")
         return jsonify({ 'looks': [] }), 200
 
-def handle_tool_call(tool_name: str, tool_args: dict, telegram_id: str, openai_client) -> str:
-    """
-    Обработка вызовов инструментов ассистента
-    
-    Args:
-        tool_name: название инструмента
-        tool_args: аргументы инструмента
-        telegram_id: ID пользователя
-        openai_client: клиент OpenAI
-    
-    Returns:
-        JSON строка с результатом выполнения инструмента
-    """
-    try:
-        from brand_service_v4 import get_supabase_client
-        supabase = get_supabase_client()
-        
-        if tool_name == 'about_user':
-            # Получаем данные пользователя
-            if not supabase:
-                return json.dumps({"error": "Supabase не доступен"})
-            
-            profile_response = supabase.table('user_profile').select('*').eq('telegram_id', telegram_id).execute()
-            if profile_response.data:
-                profile = profile_response.data[0]
-                return json.dumps({
-                    "figura": profile.get('figura', 'не указано'),
-                    "cvetotip": profile.get('cvetotip', 'не указано'),
-                    "stil_zhizni": profile.get('stil_zhizni', 'не указано'),
-                    "celi": profile.get('celi', 'не указано'),
-                    "predpochtenia": profile.get('predpochtenia', 'не указано'),
-                    "name": profile.get('name', 'не указано'),
-                    "age": profile.get('age', 'не указано')
-                }, ensure_ascii=False)
-            else:
-                return json.dumps({"error": "Профиль не найден"})
-        
-        elif tool_name == 'wardrobe':
-            # Получаем гардероб пользователя
-            if not supabase:
-                return json.dumps({"error": "Supabase не доступен"})
-            
-            wardrobe_response = supabase.table('wardrobe').select('id, category, description, season').eq('telegram_id', telegram_id).execute()
-            if wardrobe_response.data:
-                wardrobe_items = wardrobe_response.data  # Возвращаем все вещи без ограничений
-                return json.dumps({
-                    "items": [
-                        {
-                            "id": str(item.get('id', '')),
-                            "category": item.get('category', ''),
-                            "description": item.get('description', ''),
-                            "season": item.get('season', '')
-                        }
-                        for item in wardrobe_items
-                    ],
-                    "count": len(wardrobe_items)
-                }, ensure_ascii=False)
-            else:
-                return json.dumps({"items": [], "count": 0})
-        
-        elif tool_name == 'get_weather':
-            # Получаем погоду по координатам из профиля (как на главной странице)
-            if not supabase:
-                return json.dumps({"error": "Supabase не доступен"})
-            
-            try:
-                # Получаем профиль пользователя с координатами
-                profile_response = supabase.table('user_profile').select('*').eq('telegram_id', telegram_id).execute()
-                if not profile_response.data:
-                    return json.dumps({
-                        "error": "Профиль пользователя не найден. Пожалуйста, укажите температуру вручную."
-                    }, ensure_ascii=False)
-                
-                profile = profile_response.data[0]
-                location_latitude = profile.get('location_latitude')
-                location_longitude = profile.get('location_longitude')
-                
-                # Проверяем наличие координат
-                if not location_latitude or not location_longitude:
-                    return json.dumps({
-                        "error": "Координаты не указаны в профиле. Пожалуйста, укажите температуру вручную или добавьте геолокацию в профиль."
-                    }, ensure_ascii=False)
-                
-                # Получаем погоду через OpenWeatherMap API (как на главной странице)
-                import requests
-                api_key = 'd69e489c7ddeb793bff2350cc232dab7'
-                weather_url = f"https://api.openweathermap.org/data/2.5/weather?lat={location_latitude}&lon={location_longitude}&appid={api_key}&units=metric&lang=ru"
-                
-                print(f"   🌤️ Запрос погоды для координат: lat={location_latitude}, lon={location_longitude}", flush=True)
-                
-                weather_response = requests.get(weather_url, timeout=10)
-                
-                if weather_response.status_code == 200:
-                    weather_data = weather_response.json()
-                    
-                    # Формируем ответ в удобном формате
-                    result = {
-                        "temperature": round(weather_data.get('main', {}).get('temp', 20), 1),
-                        "feels_like": round(weather_data.get('main', {}).get('feels_like', 20), 1),
-                        "temp_max": round(weather_data.get('main', {}).get('temp_max', 20), 1),
-                        "temp_min": round(weather_data.get('main', {}).get('temp_min', 20), 1),
-                        "humidity": weather_data.get('main', {}).get('humidity', 0),
-                        "description": weather_data.get('weather', [{}])[0].get('description', 'ясно') if weather_data.get('weather') else 'ясно',
-                        "main_condition": weather_data.get('weather', [{}])[0].get('main', 'Clear') if weather_data.get('weather') else 'Clear',
-                        "city": weather_data.get('name', 'Неизвестно'),
-                        "country": weather_data.get('sys', {}).get('country', ''),
-                        "full_data": weather_data  # Полные данные для совместимости
-                    }
-                    
-                    print(f"   ✅ Погода получена: {result['temperature']}°C, {result['description']}", flush=True)
-                    
-                    return json.dumps(result, ensure_ascii=False)
-                else:
-                    error_msg = f"Ошибка получения погоды: HTTP {weather_response.status_code}"
-                    print(f"   ⚠️ {error_msg}", flush=True)
-                    return json.dumps({
-                        "error": error_msg
-                    }, ensure_ascii=False)
-                    
-            except requests.exceptions.RequestException as e:
-                error_msg = f"Ошибка запроса к API погоды: {str(e)}"
-                print(f"   ⚠️ {error_msg}", flush=True)
-                return json.dumps({
-                    "error": error_msg
-                }, ensure_ascii=False)
-            except Exception as e:
-                error_msg = f"Ошибка получения погоды: {str(e)}"
-                print(f"   ⚠️ {error_msg}", flush=True)
-                import traceback
-                traceback.print_exc()
-                return json.dumps({
-                    "error": error_msg
-                }, ensure_ascii=False)
-        
-        elif tool_name == 'recommend':
-            # Рекомендации товаров брендов
-            if not supabase:
-                return json.dumps({"error": "Supabase не доступен"})
-            
-            season = tool_args.get('season', 'Всесезонно')
-            category = tool_args.get('category', None)
-            
-            query = supabase.table('brand_items').select('id, brand_id, category, season, description, image_id, shop_link, price, currency').eq('is_approved', True).eq('is_active', True)
-            
-            if season and season != 'Всесезонно':
-                query = query.eq('season', season)
-            
-            if category:
-                query = query.eq('category', category)
-            
-            response = query.limit(20).execute()
-            items = response.data if response.data else []
-            
-            # Формируем image_url
-            for item in items:
-                if item.get('image_id') and item.get('brand_id'):
-                    item['image_url'] = f"https://lipolo.store/storage/v1/object/public/brand-items-images/{item['brand_id']}/{item['image_id']}.jpg"
-                else:
-                    item['image_url'] = None
-            
-            return json.dumps({
-                "items": [
-                    {
-                        "id": str(item.get('id', '')),
-                        "category": item.get('category', ''),
-                        "description": item.get('description', ''),
-                        "season": item.get('season', ''),
-                        "image_url": item.get('image_url', ''),
-                        "shop_link": item.get('shop_link', ''),
-                        "price": item.get('price', ''),
-                        "currency": item.get('currency', '')
-                    }
-                    for item in items
-                ],
-                "count": len(items)
-            }, ensure_ascii=False)
-        
-        elif tool_name == 'search_web':
-            # Поиск в интернете (пока заглушка)
-            query = tool_args.get('query', '')
-            return json.dumps({
-                "query": query,
-                "results": [],
-                "note": "Поиск в интернете пока не реализован. Используйте инструмент recommend для поиска товаров."
-            }, ensure_ascii=False)
-        
-        else:
-            return json.dumps({"error": f"Неизвестный инструмент: {tool_name}"})
-    
-    except Exception as e:
-        print(f"⚠️ Ошибка обработки инструмента {tool_name}: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
-        return json.dumps({"error": str(e)})
-
 @app.route('/convert-heic-preview', methods=['POST', 'OPTIONS'])
 def convert_heic_preview():
     """Конвертирует HEIC файл в JPEG для превью"""
@@ -2068,42 +2042,16 @@ def chat_history():
         if not api_key:
             return jsonify({'error': 'OpenAI API key not configured'}), 500
         
-        client = openai.OpenAI(api_key=api_key)
+        client = get_openai_client()
         
         # Получаем сообщения из thread
-        messages = client.beta.threads.messages.list(
-            thread_id=thread_id,
-            limit=100  # Получаем до 100 последних сообщений
-        )
-        
-        # Преобразуем сообщения в формат для фронтенда
-        formatted_messages = []
-        for msg in messages.data:
-            role = msg.role
-            content_text = ''
-            image_url = None
-            
-            # Извлекаем текст и изображения из content
-            if hasattr(msg, 'content') and msg.content:
-                for content_block in msg.content:
-                    if hasattr(content_block, 'type'):
-                        if content_block.type == 'text':
-                            if hasattr(content_block, 'text') and hasattr(content_block.text, 'value'):
-                                content_text += content_block.text.value
-                        elif content_block.type == 'image_file':
-                            if hasattr(content_block, 'image_file') and hasattr(content_block.image_file, 'file_id'):
-                                # Для изображений можно вернуть file_id или загрузить файл
-                                image_url = f"file_id:{content_block.image_file.file_id}"
-            
-            if content_text or image_url:
-                formatted_messages.append({
-                    'role': role,
-                    'content': content_text,
-                    'image_url': image_url
-                })
+        with get_openai_scheduler().slot(PRIORITY_CHAT):
+            messages = client.beta.threads.messages.list(
+                thread_id=thread_id,
+                limit=100  # Получаем до 100 последних сообщений
+            )
         
-        # Сортируем по времени (старые первыми)
-        formatted_messages.reverse()
+        formatted_messages = format_history_messages(messages.data)
         
         return jsonify({
             'messages': formatted_messages,
@@ -2159,63 +2107,21 @@ def chat_style():
         if 'image' in request.files:
             image_file = request.files['image']
             if image_file and image_file.filename:
-                # Конвертируем в base64
-                try:
-                    # Правильно обрабатываем файл из Flask request.files
-                    # image_file - это FileStorage объект, нужно использовать его напрямую
-                    # Сбрасываем позицию потока на начало
-                    image_file.seek(0)
-                    
-                    # Проверяем формат файла
-                    filename_lower = image_file.filename.lower()
-                    is_heic = filename_lower.endswith(('.heic', '.heif'))
-                    
-                    if is_heic:
-                        print(f"📸 Обнаружен HEIC файл: {image_file.filename}")
-                        # Для HEIC нужно использовать pillow-heif
-                        try:
-                            import pillow_heif
-                            pillow_heif.register_heif_opener()
-                            print("✅ HEIC opener зарегистрирован")
-                        except ImportError:
-                            print("⚠️ pillow-heif не установлен, пытаемся открыть как обычное изображение")
-                    
-                    img = Image.open(image_file)
-                    print(f"✅ Изображение открыто: {img.format}, размер: {img.size}, режим: {img.mode}")
-                    
-                    # Уменьшаем размер изображения для чата (OpenAI имеет ограничения)
-                    max_size = 1024  # Максимальный размер стороны
-                    if max(img.size) > max_size:
-                        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                        print(f"📐 Изображение уменьшено до: {img.size}")
-                    
-                    # Конвертируем в RGB если нужно
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # Сохраняем с меньшим качеством для уменьшения размера
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='JPEG', quality=75, optimize=True)
-                    buffer.seek(0)
-                    image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    print(f"✅ Изображение конвертировано в base64, размер: {len(image_base64)} символов ({len(image_base64) / 1024 / 1024:.2f} MB)")
-                except Exception as e:
-                    print(f"⚠️ Ошибка обработки изображения: {e}")
-                    import traceback
-                    traceback.print_exc()
+                image_file.seek(0)
+                image_base64 = prepare_chat_image(image_file, image_file.filename)
         
         # Получаем OpenAI API ключ
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             return jsonify({'error': 'OPENAI_API_KEY not configured'}), 500
         
-        client = openai.OpenAI(api_key=api_key)
-        assistant_id = 'asst_mn2FIw7vNCgGbnuud4m71BUN'
+        client = get_openai_client()
+        assistant_id = CHAT_ASSISTANT_ID
         
         # Получаем данные пользователя из Supabase (только для логирования, НЕ отправляем в сообщении)
         # Ассистент уже имеет доступ к этой информации через свой промпт и инструменты
         try:
-            from brand_service_v4 import get_supabase_client
+            from supabase_client import get_supabase_client
             supabase = get_supabase_client()
             if supabase:
                 # Получаем профиль пользователя (только для логирования)
@@ -2256,7 +2162,6 @@ def chat_style():
                             print(f"⚠️ Не удалось отменить run {run.id}: {e}")
                     
                     # Ждем немного, чтобы отмена применилась
-                    import time
                     time.sleep(0.5)
                     
             except Exception as e:
@@ -2330,19 +2235,19 @@ def chat_style():
         if image_base64:
             print(f"📤 Текст сообщения (первые 100 символов): {full_message[:100]}...")
         
-        # Добавляем сообщение в thread
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message_content
-        )
-        
-        # Запускаем run с streaming
-        stream = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-            stream=True
-        )
+        # Добавляем сообщение в thread и запускаем run с streaming (в очереди запросов к OpenAI)
+        with get_openai_scheduler().slot(PRIORITY_CHAT, tokens=estimate_tokens([{'content': message_content}])):
+            client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=message_content
+            )
+            
+            stream = client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True
+            )
         
         # Функция для streaming ответа
         def generate():
@@ -2438,28 +2343,8 @@ def chat_style():
                                     print(f"   📋 Найдено {len(tool_calls)} вызовов инструментов", flush=True)
                                     sys.stdout.flush()
                                     
-                                    # Обрабатываем каждый инструмент
-                                    tool_outputs = []
-                                    for tool_call in tool_calls:
-                                        tool_name = tool_call.function.name if hasattr(tool_call, 'function') and hasattr(tool_call.function, 'name') else 'unknown'
-                                        tool_args = {}
-                                        if hasattr(tool_call, 'function') and hasattr(tool_call.function, 'arguments'):
-                                            try:
-                                                tool_args = json.loads(tool_call.function.arguments)
-                                            except:
-                                                tool_args = {}
-                                        
-                                        print(f"   🔨 Инструмент: {tool_name}, аргументы: {tool_args}", flush=True)
-                                        sys.stdout.flush()
-                                        
-                                        # Обрабатываем каждый инструмент
-                                        result = handle_tool_call(tool_name, tool_args, telegram_id, client)
-                                        print(f"   📥 Результат инструмента {tool_name}: {result[:200]}...", flush=True)
-                                        sys.stdout.flush()
-                                        tool_outputs.append({
-                                            "tool_call_id": tool_call.id,
-                                            "output": result
-                                        })
+                                    # Инструменты выполняются параллельно (общий профиль, таймаут на инструмент)
+                                    tool_outputs = run_tool_calls(tool_calls, telegram_id, client)
                                     
                                     # Отправляем результаты инструментов
                                     try:
@@ -2695,24 +2580,7 @@ def chat_style():
                                                                         tool_calls = run_status.required_action.submit_tool_outputs.tool_calls
                                                                         print(f"   📋 Найдено {len(tool_calls)} вызовов инструментов в опросе", flush=True)
                                                                         
-                                                                        # Обрабатываем инструменты
-                                                                        tool_outputs = []
-                                                                        for tool_call in tool_calls:
-                                                                            tool_name = tool_call.function.name if hasattr(tool_call, 'function') and hasattr(tool_call.function, 'name') else 'unknown'
-                                                                            tool_args = {}
-                                                                            if hasattr(tool_call, 'function') and hasattr(tool_call.function, 'arguments'):
-                                                                                try:
-                                                                                    tool_args = json.loads(tool_call.function.arguments)
-                                                                                except:
-                                                                                    tool_args = {}
-                                                                            
-                                                                            print(f"   🔨 Инструмент в опросе: {tool_name}, аргументы: {tool_args}", flush=True)
-                                                                            
-                                                                            result = handle_tool_call(tool_name, tool_args, telegram_id, client)
-                                                                            tool_outputs.append({
-                                                                                "tool_call_id": tool_call.id,
-                                                                                "output": result
-                                                                            })
+                                                                        tool_outputs = run_tool_calls(tool_calls, telegram_id, client)
                                                                         
                                                                         # Отправляем результаты
                                                                         client.beta.threads.runs.submit_tool_outputs(
@@ -2838,96 +2706,18 @@ def chat_style():
 
 @app.route('/search-items', methods=['GET'])
 def search_items():
-    """Поиск товаров по всей БД по описанию, категории и названию бренда"""
+    """Поиск товаров брендов по описанию и категории (индекс в памяти воркера, см. search_index.py)"""
     try:
-        from brand_service_v4 import get_supabase_client
-        supabase = get_supabase_client()
-        
-        if not supabase:
-            return jsonify({'error': 'Supabase не доступен'}), 500
-        
         query = request.args.get('q', '').strip()
         if not query:
             return jsonify({'error': 'Поисковый запрос не может быть пустым'}), 400
         
-        # Разбиваем запрос на слова
-        query_words = [w.strip() for w in query.split() if w.strip()]
-        if not query_words:
-            return jsonify({'error': 'Поисковый запрос не может быть пустым'}), 400
-        
-        query_lower = query.lower()
-        query_words_lower = [w.lower() for w in query_words]
-        
-        # Используем Supabase для быстрого поиска по описанию
-        # Ищем товары, где description содержит хотя бы одно слово из запроса
-        # Это быстрее, чем загружать все товары
-        search_patterns = [f'%{word}%' for word in query_words_lower]
-        
-        # Строим OR условие для Supabase: description содержит любое из слов
-        # Формат: 'description.ilike.%word1%,description.ilike.%word2%'
-        or_conditions = ','.join([f'description.ilike.{pattern}' for pattern in search_patterns])
-        
-        response = supabase.table('brand_items') \
-            .select('id, brand_id, category, season, description, image_id, shop_link, price, currency') \
-            .eq('is_approved', True) \
-            .eq('is_active', True) \
-            .or_(or_conditions) \
-            .limit(1000) \
-            .execute()
-        
-        all_items = response.data if response.data else []
-        
-        # Теперь фильтруем в Python для более точного поиска
-        # Ищем товары, где description содержит ВСЕ слова из запроса (с учетом разных форм)
-        import re
-        
-        def word_matches_in_text(word, text):
-            """Проверяет, есть ли слово или его формы в тексте"""
-            # Точное совпадение слова
-            if word in text:
-                return True
-            
-            # Если слово длиннее 3 символов, ищем слова, начинающиеся с корня
-            if len(word) > 3:
-                root_length = 3 if len(word) <= 5 else 4
-                root = word[:root_length]
-                pattern = r'\b' + re.escape(root) + r'\w*'
-                if re.search(pattern, text):
-                    return True
-            
-            return False
-        
-        # Фильтруем: товар должен содержать ВСЕ слова из запроса
-        # Приоритет: если запрос содержит существительное (последнее слово), оно должно быть в описании
-        filtered_items = []
-        for item in all_items:
-            description = (item.get('description') or '').lower()
-            category = (item.get('category') or '').lower()
-            text_to_search = f'{description} {category}'
-            
-            # Проверяем, содержит ли текст всю фразу целиком (высший приоритет)
-            if query_lower in text_to_search:
-                filtered_items.append((item, 0))  # Приоритет 0 - точная фраза
-                continue
-            
-            # Проверяем, содержит ли текст все слова из запроса
-            word_matches = [word_matches_in_text(word, text_to_search) for word in query_words_lower]
-            if all(word_matches):
-                # Приоритет: если последнее слово (обычно существительное) есть в описании - выше приоритет
-                last_word = query_words_lower[-1] if query_words_lower else ''
-                priority = 1
-                if last_word and word_matches_in_text(last_word, description):
-                    priority = 2  # Средний приоритет - есть основное слово
-                else:
-                    priority = 3  # Низкий приоритет - все слова есть, но основное не в описании
-                filtered_items.append((item, priority))
-        
-        # Сортируем результаты по приоритету
-        filtered_items.sort(key=lambda x: x[1])
-        items = [item for item, _ in filtered_items[:500]]  # Ограничиваем 500 результатами
+        # Все слова запроса (или их корни); приоритет: точная фраза > главное слово в описании > остальное
+        items = get_search_index().search(query, limit=500)
         
         # Формируем image_url и добавляем brand_name
         for item in items:
+            item.pop('updated_at', None)
             if item.get('image_id') and item.get('brand_id'):
                 item['image_url'] = f"https://lipolo.store/storage/v1/object/public/brand-items-images/{item['brand_id']}/{item['image_id']}.jpg"
             else:
@@ -2951,5 +2741,34 @@ def search_items():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/search-items/suggest', methods=['GET'])
+def search_items_suggest():
+    """Подсказки для строки поиска: дописывание слова и категории (без полного поиска)"""
+    try:
+        query = request.args.get('q', '')
+        try:
+            limit = max(1, min(int(request.args.get('limit', 8)), 20))
+        except ValueError:
+            limit = 8
+        suggestions = get_search_index().suggest(query, limit=limit) if query.strip() else []
+        return jsonify({
+            'suggestions': suggestions,
+            'query': query
+        })
+    except Exception as e:
+        print(f"❌ Ошибка подсказок поиска: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# Прогреваем каталог брендов текущего сезона в фоне (один раз на воркер),
+# чтобы первый /generate-capsules не ждал публичный API
+try:
+    from brand_catalog import get_brand_catalog
+    get_brand_catalog().warm(get_season_from_date())
+except Exception as _bc_err:
+    print(f"⚠️ Не удалось прогреть каталог брендов: {_bc_err}")
+
+# Поисковый индекс товаров брендов — тоже в фоне, чтобы первый /search-items не ждал загрузку
+get_search_index().warm()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=False) 
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Бенчмарк: колоночный каталог брендов (brand_columns.py) против построчной проверки
+
+Генерирует синтетический каталог сезона, сверяет, что векторный фильтр дает те же
+товары в тех же категориях, что и is_suitable_for_temp_and_season во всех
+температурных зонах V6, и сравнивает время:
+- фильтр по погоде + группировка по категориям (list comprehension против маски)
+- выбор неиспользованных товаров в ответе (список с фильтром против CategoryPool)
+
+Запуск: python bench_brand_catalog.py [число товаров]
+"""
+
+import contextlib
+import io
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from brand_columns import CatalogColumns
+from brand_service_v5 import identify_accessory_subtype, map_brand_category_to_engine_category
+from capsule_engine_v6 import TEMPERATURE_BREAKPOINTS, is_suitable_for_temp_and_season, zone_temperature
+
+_TEMPLATES = {
+    'Верх': ['Блуза из шелка', 'Рубашка хлопковая', 'Свитер шерстяной', 'Футболка льняная', 'Рубашка джинсовая',
+             'Топ из вискозы', 'Водолазка трикотажная', 'Джемпер кашемировый'],
+    'Низ': ['Брюки шерстяные', 'Джинсы прямые', 'Юбка миди из шифона', 'Шорты льняные', 'Брюки из твида'],
+    'Обувь': ['Кроссовки белые', 'Ботинки кожаные', 'Туфли лодочки', 'Сапоги замшевые', 'Лоферы кожаные',
+              'Сандалии на плоской подошве'],
+    'Сумка': ['Сумка кожаная', 'Сумка плетеная', 'Рюкзак из нейлона'],
+    'Верхняя одежда': ['Пальто из драпа', 'Куртка джинсовая', 'Пуховик стеганый', 'Тренч хлопковый'],
+    'Аксессуары': ['Серьги с жемчугом', 'Шарф шерстяной', 'Ремень кожаный', 'Шапка вязаная', 'Перчатки кожаные',
+                   'Колье из металла', 'Браслет плетеный'],
+}
+_SEASONS = ['', 'Осень', 'Весна', 'Лето', 'Зима', 'Всесезон', 'Демисезон', 'Осень-Зима']
+
+
+def make_catalog(n: int, seed: int = 1) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    categories = list(_TEMPLATES)
+    items = []
+    for i in range(n):
+        category = rng.choice(categories)
+        items.append({
+            'id': f'b{i}',
+            'category': category,
+            'description': f"{rng.choice(_TEMPLATES[category])} {rng.choice(['черный', 'бежевый', 'синий', ''])}".strip(),
+            'season': rng.choice(_SEASONS),
+            'impressions_count': rng.randrange(1000),
+            'is_brand_item': True,
+        })
+    return items
+
+
+def partition_rows(items: List[Dict[str, Any]], temperature: float, season: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Прежний путь: is_suitable_for_temp_and_season по каждому товару и группировка"""
+    buckets = defaultdict(list)
+    for item in [item for item in items if is_suitable_for_temp_and_season(item, temperature, season)]:
+        engine_cat = map_brand_category_to_engine_category(item.get('category', ''))
+        if engine_cat == 'accessories':
+            engine_cat = f"acc_{identify_accessory_subtype(item.get('description', '').lower())}"
+        buckets[engine_cat].append(item)
+    return dict(buckets)
+
+
+def timed(fn, repeat: int) -> float:
+    """Среднее время вызова, мс"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    items = make_catalog(n)
+    zones = range(len(TEMPERATURE_BREAKPOINTS) + 1)
+
+    with contextlib.redirect_stdout(io.StringIO()):  # построчный фильтр логирует каждый отказ
+        started = time.perf_counter()
+        columns = CatalogColumns(items)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        # 1. Тот же результат во всех зонах и сезонах
+        for season in ('Осень', 'Лето', 'Зима'):
+            for zone in zones:
+                temp = zone_temperature(zone)
+                expected = {cat: [it['id'] for it in rows] for cat, rows in partition_rows(items, temp, season).items()}
+                actual = {cat: [it['id'] for it in pool.items] for cat, pool in columns.pools(temp, season).items()}
+                assert expected == actual, f"расхождение: сезон {season}, зона {zone} ({temp}°C)"
+
+        # 2. Фильтр + группировка
+        rows_ms = timed(lambda: partition_rows(items, 12.0, 'Осень'), 5)
+    mask_ms = timed(lambda: columns.pools(12.0, 'Осень'), 50)
+
+    # 3. Выбор 20 неиспользованных товаров одной категории
+    with contextlib.redirect_stdout(io.StringIO()):
+        tops_rows = partition_rows(items, 12.0, 'Осень')['tops']
+    tops_pool = columns.pools(12.0, 'Осень')['tops']
+
+    def pick_rows():
+        rng, used = random.Random(7), set()
+        picked = []
+        for _ in range(20):
+            available = [item for item in tops_rows if item['id'] not in used]
+            item = rng.choice(available)
+            used.add(item['id'])
+            picked.append(item['id'])
+        return picked
+
+    def pick_pool():
+        rng, pool = random.Random(7), tops_pool.fresh()
+        return [pool.take_random_unused(rng)['id'] for _ in range(20)]
+
+    assert pick_rows() == pick_pool(), 'выбор товаров разошелся'
+    pick_rows_ms = timed(pick_rows, 50)
+    pick_pool_ms = timed(pick_pool, 50)
+
+    print(f"Каталог: {n} товаров, разбор в колонки {build_ms:.1f} мс (один раз при загрузке)")
+    print(f"Результаты совпадают во всех {len(zones)} зонах")
+    print(f"Фильтр + группировка: построчно {rows_ms:.2f} мс, маски {mask_ms:.2f} мс (x{rows_ms / mask_ms:.0f})")
+    print(f"20 выборов без повторов ({len(tops_rows)} товаров): списки {pick_rows_ms:.2f} мс, пул {pick_pool_ms:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Пул процессов для удаления фона (rembg u2net + alpha matting)
+
+Раньше remove_bg выполнялся прямо в потоке запроса: 2–5 секунд CPU держали
+поток gthread-воркера, а каждый воркер gunicorn загружал свою копию модели (~300 MB).
+
+Теперь:
+- отдельный процесс-сервер (запускается из мастера gunicorn, см. gunicorn.conf.py)
+  держит пул из BG_REMOVAL_WORKERS процессов, модель загружается один раз на процесс пула
+- воркеры gunicorn отправляют задачи через unix-сокет и только ждут ответ (без CPU и без модели)
+- очередь ограничена: при BG_REMOVAL_WORKERS + BG_REMOVAL_QUEUE_SIZE задачах в работе
+  новые отклоняются сразу (BackgroundRemovalBusy → HTTP 429)
+
+Без сервера (например, `python app.py`) используется локальный пул в текущем процессе.
+"""
+
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from metrics import LatencyStats
+
+
+# Изображение между процессами передаем «сырыми» пикселями: (mode, size, bytes)
+RawImage = Tuple[str, Tuple[int, int], bytes]
+
+# Версия модели и параметров маттинга — входит в ключи кэша результатов (image_cache)
+BG_REMOVAL_VERSION = 'u2net-am240-10-10-pp'
+
+
+class BackgroundRemovalBusy(Exception):
+    """Очередь удаления фона заполнена"""
+
+
+class BackgroundRemovalUnavailable(Exception):
+    """Пул удаления фона недоступен или не ответил вовремя"""
+
+
+# ==========================
+# ПРОЦЕСС ПУЛА
+# ==========================
+
+_session = None
+
+
+def _init_worker() -> None:
+    """Инициализация процесса пула: модель загружается один раз на процесс"""
+    global _session
+    from rembg.bg import new_session
+    _session = new_session(model_name='u2net')
+    print(f'✅ rembg session initialized (u2net, pid {os.getpid()})')
+
+
+def _remove_background_raw(raw: RawImage) -> RawImage:
+    """Удаление фона в процессе пула; возвращает RGBA"""
+    from PIL import Image
+    from rembg.bg import remove
+
+    mode, size, data = raw
+    image = Image.frombytes(mode, size, data)
+    out = remove(
+        image,
+        session=_session,
+        alpha_matting=True,
+        alpha_matting_foreground_threshold=240,
+        alpha_matting_background_threshold=10,
+        alpha_matting_erode_size=10,
+        post_process_mask=True,
+    )
+    if isinstance(out, (bytes, bytearray)):
+        import io
+        out = Image.open(io.BytesIO(out))
+    if out.mode != 'RGBA':
+        out = out.convert('RGBA')
+    return out.mode, out.size, out.tobytes()
+
+
+class BackgroundRemovalPool:
+    """Пул процессов с ограниченным числом задач в работе (выполняются + ждут)"""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0, 'restarts': 0}
+        self._in_flight = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                import multiprocessing
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._stats['restarts'] += 1
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, raw: RawImage, timeout: float) -> RawImage:
+        if not self._slots.acquire(blocking=False):
+            self._stats['rejected'] += 1
+            raise BackgroundRemovalBusy()
+        with self._lock:
+            self._in_flight += 1
+        self._stats['submitted'] += 1
+
+        try:
+            future = self._get_executor().submit(_remove_background_raw, raw)
+        except Exception:
+            self._release()
+            self._reset_executor()
+            raise
+        # Слот освобождается, когда задача реально завершилась (а не когда истек таймаут ожидания)
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeout:
+            self._stats['timeouts'] += 1
+            raise BackgroundRemovalUnavailable(f'таймаут {timeout}с')
+        except BrokenProcessPool:
+            self._stats['errors'] += 1
+            self._reset_executor()
+            raise BackgroundRemovalUnavailable('процесс пула упал, пул пересоздан')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'in_flight': self._in_flight
+        }
+
+
+# ==========================
+# СЕРВЕР (один на контейнер)
+# ==========================
+
+def serve(socket_path: str, authkey: bytes, workers: int, queue_size: int) -> None:
+    """Принимает задачи от воркеров gunicorn через unix-сокет"""
+    from multiprocessing.connection import Listener
+
+    pool = BackgroundRemovalPool(workers, queue_size)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = Listener(socket_path, family='AF_UNIX', authkey=authkey)
+    print(f'🧵 Пул удаления фона: {pool.workers} процессов, очередь {pool.capacity - pool.workers}, сокет {socket_path}')
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            print(f'⚠️ Пул удаления фона: отклонено подключение: {e}')
+            continue
+        threading.Thread(target=_handle_connection, args=(pool, conn), daemon=True).start()
+
+
+def _handle_connection(pool: BackgroundRemovalPool, conn) -> None:
+    try:
+        while True:
+            try:
+                op, payload, timeout = conn.recv()
+            except EOFError:
+                break
+            if op == 'stats':
+                conn.send(('ok', pool.stats()))
+                continue
+            try:
+                conn.send(('ok', pool.run(payload, timeout)))
+            except BackgroundRemovalBusy:
+                conn.send(('busy', None))
+            except Exception as e:
+                conn.send(('error', str(e)))
+    finally:
+        conn.close()
+
+
+def start_server_process():
+    """
+    Запуск сервера пула из мастера gunicorn (до fork воркеров).
+    Адрес и ключ передаются воркерам через переменные окружения.
+    """
+    import multiprocessing
+
+    socket_path = os.environ.setdefault('BG_REMOVAL_SOCKET', Config.BG_REMOVAL_SOCKET_PATH)
+    authkey = os.environ.setdefault('BG_REMOVAL_AUTHKEY', secrets.token_hex(16))
+    process = multiprocessing.get_context('spawn').Process(
+        target=serve,
+        args=(socket_path, authkey.encode(), Config.BG_REMOVAL_WORKERS, Config.BG_REMOVAL_QUEUE_SIZE),
+        name='bg-removal-pool'
+    )
+    try:
+        process.start()
+    except Exception:
+        # Без сервера воркеры используют локальный пул
+        os.environ.pop('BG_REMOVAL_SOCKET', None)
+        raise
+    return process
+
+
+# ==========================
+# КЛИЕНТ (воркеры gunicorn)
+# ==========================
+
+_local_pool: Optional[BackgroundRemovalPool] = None
+_local_lock = threading.Lock()
+_latency = LatencyStats()
+_client_stats = {'busy': 0, 'unavailable': 0}
+
+
+def _get_local_pool() -> BackgroundRemovalPool:
+    global _local_pool
+    if _local_pool is None:
+        with _local_lock:
+            if _local_pool is None:
+                _local_pool = BackgroundRemovalPool(Config.BG_REMOVAL_WORKERS, Config.BG_REMOVAL_QUEUE_SIZE)
+    return _local_pool
+
+
+def _call_server(socket_path: str, op: str, payload: Any, timeout: float):
+    from multiprocessing.connection import Client
+
+    authkey = os.environ.get('BG_REMOVAL_AUTHKEY', '').encode()
+    conn = None
+    for attempt in range(3):
+        try:
+            conn = Client(socket_path, family='AF_UNIX', authkey=authkey)
+            break
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            # Сервер мог еще не подняться сразу после старта контейнера
+            if attempt == 2:
+                raise BackgroundRemovalUnavailable(f'сервер пула недоступен: {e}')
+            time.sleep(0.5)
+        except Exception as e:
+            raise BackgroundRemovalUnavailable(f'сервер пула недоступен: {e}')
+    try:
+        conn.send((op, payload, timeout))
+        # Сервер сам ограничивает ожидание timeout; здесь — запас на передачу данных
+        if not conn.poll(timeout + 5):
+            raise BackgroundRemovalUnavailable(f'нет ответа от пула за {timeout}с')
+        status, result = conn.recv()
+    finally:
+        conn.close()
+
+    if status == 'busy':
+        raise BackgroundRemovalBusy()
+    if status != 'ok':
+        raise BackgroundRemovalUnavailable(result)
+    return result
+
+
+def remove_background(image, timeout: Optional[float] = None):
+    """
+    Удаляет фон через пул; возвращает PIL.Image RGBA.
+    BackgroundRemovalBusy — очередь заполнена; BackgroundRemovalUnavailable — пул не справился.
+    """
+    from PIL import Image
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    raw = (image.mode, image.size, image.tobytes())
+    timeout = timeout or Config.BG_REMOVAL_TIMEOUT
+
+    started = time.perf_counter()
+    ok = False
+    try:
+        socket_path = os.environ.get('BG_REMOVAL_SOCKET')
+        if socket_path:
+            mode, size, data = _call_server(socket_path, 'remove', raw, timeout)
+        else:
+            mode, size, data = _get_local_pool().run(raw, timeout)
+        ok = True
+        return Image.frombytes(mode, size, data)
+    except BackgroundRemovalBusy:
+        _client_stats['busy'] += 1
+        raise
+    except BackgroundRemovalUnavailable:
+        _client_stats['unavailable'] += 1
+        raise
+    finally:
+        _latency.record((time.perf_counter() - started) * 1000, ok=ok)
+
+
+def get_bg_removal_stats() -> Dict[str, Any]:
+    """Статистика для /stats: задержки со стороны воркера и состояние пула"""
+    stats: Dict[str, Any] = {**_client_stats, 'latency': _latency.snapshot()}
+    socket_path = os.environ.get('BG_REMOVAL_SOCKET')
+    if socket_path:
+        stats['mode'] = 'server'
+        try:
+            stats['pool'] = _call_server(socket_path, 'stats', None, 2)
+        except Exception as e:
+            stats['pool'] = {'error': str(e)}
+    else:
+        stats['mode'] = 'local'
+        stats['pool'] = _local_pool.stats() if _local_pool else None
+    return stats
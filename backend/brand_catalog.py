@@ -0,0 +1,432 @@
+"""
+Каталог товаров брендов в памяти воркера
+
+Раньше каждый вызов /generate-capsules ходил в публичный API брендов
+(по разу на каждую категорию капсул), а при ошибке — делал полный скан brand_items.
+Теперь каталог хранится в памяти по сезонам:
+- загружается один раз на воркер (холодный старт — синхронно, под локом сезона)
+- обновляется в фоне по TTL (stale-while-revalidate: пока идет обновление,
+  запросы получают предыдущую версию каталога)
+- подмешивание и дополнение капсул читают только из памяти
+- товары сезона при загрузке разбираются в колоночное представление
+  (brand_columns.py) и раскладываются по температурным зонам V6 и категориям
+  движка: запрос получает готовые пулы категорий по номеру зоны
+- загруженный каталог (колонки, маски зон, товары) записывается в общий снимок
+  на диске (catalog_snapshot.py): остальные воркеры хоста и новые воркеры берут
+  его оттуда вместо запроса в API, колонки — через mmap
+- между полными загрузками (BRAND_CATALOG_FULL_SYNC) каталог обновляется
+  инкрементально: только строки brand_items, измененные после отметки updated_at
+  (brand_changes.py); снятые с публикации и удаленные товары убираются, заново
+  разбираются только измененные строки
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from catalog_snapshot import get_snapshot_store
+from config import Config
+
+
+@dataclass
+class CatalogEntry:
+    """Загруженный каталог одного сезона"""
+    season: str
+    items: List[Dict[str, Any]]
+    loaded_at: float = field(default_factory=time.time)
+    ok: bool = True  # False — загрузка не удалась (пустой каталог, короткий TTL)
+    columns: Any = None  # brand_columns.CatalogColumns
+    masks: Any = None  # np.ndarray [зона V6, товар] — пригодность товаров по зонам
+    version: Optional[str] = None  # версия снимка, из которого взят каталог
+    watermark: Optional[str] = None  # updated_at, после которого изменения еще не применены
+    synced_at: float = field(default_factory=time.time)  # последняя полная загрузка
+    partitions: Dict[int, Dict[str, Any]] = field(default_factory=dict)  # зона V6 -> категория -> CategoryPool
+    partitions_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def age(self) -> float:
+        return time.time() - self.loaded_at
+
+    def build_partitions(self) -> None:
+        """Колонки и пулы всех температурных зон (при загрузке — запросы потом только читают)"""
+        from brand_columns import CatalogColumns
+        from capsule_engine_v6 import TEMPERATURE_BREAKPOINTS
+        if self.columns is None:
+            self.columns = CatalogColumns(self.items)
+        if self.masks is None:
+            self.masks = self.columns.zone_masks(self.season)
+        for zone in range(len(TEMPERATURE_BREAKPOINTS) + 1):
+            self.partition(zone)
+
+    def with_changes(self, upserts: List[Dict[str, Any]], removed: Set[str], watermark: Optional[str]) -> 'CatalogEntry':
+        """Новая версия каталога с примененными изменениями (текущая не меняется — ее читают запросы)"""
+        if not upserts and not removed:
+            return CatalogEntry(
+                season=self.season, items=self.items, columns=self.columns, masks=self.masks,
+                partitions=self.partitions, watermark=watermark or self.watermark, synced_at=self.synced_at
+            )
+        columns = self.columns.with_changes(upserts, removed)
+        entry = CatalogEntry(
+            season=self.season, items=columns.items, columns=columns,
+            watermark=watermark or self.watermark, synced_at=self.synced_at
+        )
+        entry.build_partitions()
+        return entry
+
+    def partition(self, zone: int) -> Dict[str, Any]:
+        """Пулы товаров зоны по категориям (считаются один раз на зону и версию каталога)"""
+        pools = self.partitions.get(zone)
+        if pools is None:
+            from brand_columns import CatalogColumns
+            from capsule_engine_v6 import zone_temperature
+            with self.partitions_lock:
+                pools = self.partitions.get(zone)
+                if pools is None:
+                    if self.columns is None:
+                        self.columns = CatalogColumns(self.items)
+                    if self.masks is not None:
+                        pools = self.columns.pools_for_mask(self.masks[zone])
+                    else:
+                        pools = self.columns.pools(zone_temperature(zone), self.season)
+                    self.partitions[zone] = pools
+        return pools
+
+
+class BrandCatalogStore:
+    """Хранилище каталога брендов по сезонам с фоновым обновлением по TTL"""
+
+    def __init__(
+        self,
+        loader: Callable[[str], List[Dict[str, Any]]],
+        ttl: int = 600,
+        retry_ttl: int = 30,
+        delta_loader: Optional[Callable[[str, Optional[str]], Any]] = None,
+        full_sync_interval: int = 3600
+    ):
+        self.loader = loader
+        self.ttl = ttl
+        self.retry_ttl = retry_ttl
+        self.delta_loader = delta_loader  # (сезон, отметка) -> brand_changes.BrandItemChanges
+        self.full_sync_interval = full_sync_interval
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._lock = threading.Lock()
+        self._season_locks: Dict[str, threading.Lock] = {}
+        self._refreshing: set = set()
+        self._refresher_pid: Optional[int] = None
+        self._stats = {'hits': 0, 'cold_loads': 0, 'refreshes': 0, 'refresh_errors': 0, 'partition_builds': 0,
+                       'snapshot_loads': 0, 'snapshot_writes': 0,
+                       'full_loads': 0, 'delta_syncs': 0, 'delta_rows': 0, 'delta_errors': 0}
+
+    # ---------- чтение ----------
+
+    def get(self, season: str) -> List[Dict[str, Any]]:
+        """Возвращает товары сезона (копию списка — вызывающий код может его дополнять)"""
+        return list(self._entry(season).items)
+
+    def get_pools(self, season: str, temperature: float) -> Dict[str, Any]:
+        """
+        Подходящие для температуры товары сезона по категориям движка (CategoryPool) —
+        поиск в словаре по температурной зоне V6. Пулы новые на каждый вызов:
+        счетчики использований у каждого запроса свои.
+        """
+        from capsule_engine_v6 import temperature_zone
+        entry = self._entry(season)
+        zone = temperature_zone(temperature)
+        if zone not in entry.partitions:
+            self._stats['partition_builds'] += 1
+        return {cat: pool.fresh() for cat, pool in entry.partition(zone).items()}
+
+    def _entry(self, season: str) -> CatalogEntry:
+        entry = self._entries.get(season)
+        if entry is None:
+            entry = self._load_cold(season)
+        else:
+            self._stats['hits'] += 1
+            if self._is_expired(entry):
+                self._refresh_async(season)
+        self._ensure_refresher()
+        return entry
+
+    def available(self, season: str) -> bool:
+        """
+        Есть ли каталог сезона в памяти или живой источник для его загрузки.
+        False — API брендов и Supabase недоступны (предохранители открыты):
+        капсулы отдаются без товаров брендов, холодная загрузка не ждет.
+        """
+        if season in self._entries:
+            return True
+        from resilience import BRAND_API, SUPABASE, get_dependency
+        return get_dependency(BRAND_API).available() or get_dependency(SUPABASE).available()
+
+    def warm(self, season: str) -> None:
+        """Фоновая загрузка сезона (например, при старте воркера)"""
+        if season not in self._entries:
+            self._refresh_async(season)
+        self._ensure_refresher()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'ttl': self.ttl,
+            'seasons': {
+                season: {
+                    'items': len(entry.items),
+                    'age_sec': round(entry.age(), 1),
+                    'ok': entry.ok,
+                    'zones': sorted(entry.partitions),
+                    'snapshot': entry.version,
+                    'watermark': entry.watermark
+                }
+                for season, entry in list(self._entries.items())
+            }
+        }
+
+    # ---------- загрузка ----------
+
+    def _is_expired(self, entry: CatalogEntry) -> bool:
+        return entry.age() >= (self.ttl if entry.ok else self.retry_ttl)
+
+    def _season_lock(self, season: str) -> threading.Lock:
+        with self._lock:
+            lock = self._season_locks.get(season)
+            if lock is None:
+                lock = self._season_locks[season] = threading.Lock()
+            return lock
+
+    def _load_cold(self, season: str) -> CatalogEntry:
+        """Первая загрузка сезона: параллельные запросы ждут один и тот же лок"""
+        with self._season_lock(season):
+            entry = self._entries.get(season)
+            if entry is not None:
+                return entry
+            self._stats['cold_loads'] += 1
+            return self._load(season, previous=None)
+
+    def _load(self, season: str, previous: Optional[CatalogEntry]) -> CatalogEntry:
+        started = time.time()
+        snapshots = get_snapshot_store()
+        if snapshots is not None:
+            writer = snapshots.is_writer()
+            entry = self._read_snapshot(snapshots, season, previous)
+            if entry is not None and not (writer and self._is_expired(entry)):
+                self._stats['snapshot_loads'] += 1
+                return self._publish(entry, started, 'из снимка')
+            if not writer and previous is not None and previous.age() < 2 * self.ttl:
+                # Каталог обновляет писатель снимков — ждем его версию, в API не ходим
+                return previous
+
+        entry = None
+        if (
+            self.delta_loader is not None and previous is not None and previous.ok
+            and previous.watermark and previous.columns is not None
+            and time.time() - previous.synced_at < self.full_sync_interval
+        ):
+            entry = self._load_delta(season, previous)
+            source = 'после изменений'
+        if entry is None:
+            entry = self._load_full(season, previous)
+            source = 'из API'
+        if snapshots is not None and entry.ok and entry.masks is not None:
+            self._write_snapshot(snapshots, entry)
+        return self._publish(entry, started, source)
+
+    def _load_delta(self, season: str, previous: CatalogEntry) -> Optional[CatalogEntry]:
+        """Применяет изменения после отметки предыдущей версии (None — нужна полная загрузка)"""
+        try:
+            changes = self.delta_loader(season, previous.watermark)
+            upserts = [item for item in changes.upserts if item_in_season(item, season)]
+            # Товар сменил сезон — из каталога этого сезона он уходит
+            removed = changes.removed | {
+                str(item.get('id')) for item in changes.upserts if not item_in_season(item, season)
+            }
+            # Лента отдает и строки на самой отметке (>=): уже примененные не пересобирают каталог
+            current = {str(item.get('id')): item for item in previous.items}
+            upserts = [item for item in upserts if not _applied(current.get(str(item.get('id'))), item)]
+            removed = {item_id for item_id in removed if item_id in current}
+            entry = previous.with_changes(upserts, removed, changes.watermark)
+        except Exception as e:
+            self._stats['delta_errors'] += 1
+            print(f"⚠️ Каталог брендов [{season}]: изменения не применены ({e}) — полная загрузка")
+            return None
+        self._stats['delta_syncs'] += 1
+        self._stats['delta_rows'] += len(changes)
+        return entry
+
+    def _load_full(self, season: str, previous: Optional[CatalogEntry]) -> CatalogEntry:
+        self._stats['full_loads'] += 1
+        watermark = None
+        if self.delta_loader is not None:
+            try:
+                # Отметка — до загрузки: изменения во время загрузки придут следующей синхронизацией
+                watermark = self.delta_loader(season, None).watermark
+            except Exception as e:
+                print(f"⚠️ Каталог брендов [{season}]: отметка изменений не получена: {e}")
+        try:
+            items = self.loader(season) or []
+        except Exception as e:
+            print(f"❌ Каталог брендов: ошибка загрузки сезона {season}: {e}")
+            items = []
+
+        if not items and previous is not None and previous.items:
+            # Не затираем рабочий каталог пустым ответом — попробуем позже
+            self._stats['refresh_errors'] += 1
+            entry = CatalogEntry(
+                season=season, items=previous.items, ok=False,
+                columns=previous.columns, masks=previous.masks,
+                partitions=previous.partitions, version=previous.version,
+                watermark=previous.watermark, synced_at=previous.synced_at
+            )
+        else:
+            entry = CatalogEntry(season=season, items=items, ok=bool(items), watermark=watermark)
+            try:
+                # Разбор признаков и раскладка по зонам — до публикации, запросы не ждут
+                entry.build_partitions()
+            except Exception as e:
+                print(f"⚠️ Каталог брендов [{season}]: зоны не разложены заранее: {e}")
+        return entry
+
+    def _publish(self, entry: CatalogEntry, started: float, source: str) -> CatalogEntry:
+        self._entries[entry.season] = entry
+        print(f"📚 Каталог брендов [{entry.season}]: {len(entry.items)} товаров {source} за {time.time() - started:.2f}с")
+        return entry
+
+    def _read_snapshot(self, snapshots, season: str, previous: Optional[CatalogEntry]) -> Optional[CatalogEntry]:
+        """Каталог из общего снимка, если он новее того, что уже в памяти"""
+        from brand_columns import CatalogColumns
+        snapshot = snapshots.read(f"brand_catalog:{season}", newer_than=previous.version if previous else None)
+        if snapshot is None or (previous is not None and snapshot.written_at <= previous.loaded_at):
+            return None
+        try:
+            items = snapshot.json('items')
+            columns = CatalogColumns.from_arrays(
+                items, snapshot.json('buckets'),
+                {name: snapshot.array(name) for name in CatalogColumns.ARRAYS}
+            )
+            entry = CatalogEntry(
+                season=season, items=items, loaded_at=snapshot.written_at,
+                columns=columns, masks=snapshot.array('suitable'), version=snapshot.version,
+                watermark=snapshot.meta.get('watermark'),
+                synced_at=float(snapshot.meta.get('synced_at') or snapshot.written_at)
+            )
+            entry.build_partitions()
+        except Exception as e:
+            print(f"⚠️ Каталог брендов [{season}]: снимок {snapshot.version} не прочитан: {e}")
+            return None
+        return entry
+
+    def _write_snapshot(self, snapshots, entry: CatalogEntry) -> None:
+        version = snapshots.write(
+            f"brand_catalog:{entry.season}",
+            arrays={**entry.columns.to_arrays(), 'suitable': entry.masks},
+            documents={'items': entry.items, 'buckets': entry.columns.buckets},
+            meta={
+                'season': entry.season, 'items': len(entry.items),
+                'watermark': entry.watermark, 'synced_at': entry.synced_at
+            }
+        )
+        if version is not None:
+            entry.version = version
+            self._stats['snapshot_writes'] += 1
+
+    def _refresh_async(self, season: str) -> None:
+        with self._lock:
+            if season in self._refreshing:
+                return
+            self._refreshing.add(season)
+
+        def run():
+            try:
+                with self._season_lock(season):
+                    self._stats['refreshes'] += 1
+                    self._load(season, previous=self._entries.get(season))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(season)
+
+        threading.Thread(target=run, name=f'brand-catalog-{season}', daemon=True).start()
+
+    def _ensure_refresher(self) -> None:
+        """Фоновый поток обновления — по одному на процесс (потоки не переживают fork)"""
+        pid = os.getpid()
+        if self._refresher_pid == pid:
+            return
+        with self._lock:
+            if self._refresher_pid == pid:
+                return
+            self._refresher_pid = pid
+        threading.Thread(target=self._refresh_loop, name='brand-catalog-refresher', daemon=True).start()
+
+    def _refresh_loop(self) -> None:
+        interval = max(5, min(self.ttl, self.retry_ttl))
+        while True:
+            time.sleep(interval)
+            for season, entry in list(self._entries.items()):
+                if self._is_expired(entry):
+                    self._refresh_async(season)
+
+
+_store: Optional[BrandCatalogStore] = None
+_store_lock = threading.Lock()
+
+
+def _applied(current: Optional[Dict[str, Any]], row: Dict[str, Any]) -> bool:
+    """Строка ленты уже есть в каталоге с теми же значениями"""
+    return current is not None and all(current.get(key) == value for key, value in row.items())
+
+
+def _default_loader(season: str) -> List[Dict[str, Any]]:
+    # Импорт внутри функции: brand_service_v5 сам импортирует этот модуль
+    from brand_service_v5 import fetch_brand_items_by_season
+    from single_flight import get_single_flight
+    # Воркеры загружают сезон почти одновременно (старт, истечение TTL) — в API идет один запрос
+    return get_single_flight().run(
+        f"brand_catalog:{season}",
+        lambda: fetch_brand_items_by_season(season)
+    )
+
+
+def _default_delta_loader(season: str, since: Optional[str]):
+    from brand_service_v4 import fetch_brand_item_changes
+    return fetch_brand_item_changes(season, since)
+
+
+_SEASON_STEMS = {'Весна': 'весн', 'Лето': 'лет', 'Осень': 'осен', 'Зима': 'зим'}
+
+
+def item_in_season(item: Dict[str, Any], season: str) -> bool:
+    """
+    Относится ли товар к каталогу сезона (для строк из инкрементальной синхронизации):
+    сезон не указан, всесезонный или содержит сезон каталога (демисезон — весна и осень)
+    """
+    item_season = (item.get('season') or '').lower()
+    stem = _SEASON_STEMS.get(season)
+    if not item_season or stem is None or 'всесезон' in item_season or stem in item_season:
+        return True
+    return 'демисезон' in item_season and season in ('Весна', 'Осень')
+
+
+def get_brand_catalog() -> BrandCatalogStore:
+    """Общий для воркера каталог брендов (создается лениво)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BrandCatalogStore(
+                    loader=_default_loader,
+                    ttl=Config.BRAND_CATALOG_TTL,
+                    retry_ttl=Config.BRAND_CATALOG_RETRY_TTL,
+                    delta_loader=_default_delta_loader if Config.BRAND_CATALOG_DELTA_SYNC else None,
+                    full_sync_interval=Config.BRAND_CATALOG_FULL_SYNC
+                )
+    return _store
+
+
+def get_brand_items(season: str) -> List[Dict[str, Any]]:
+    """Товары брендов сезона из памяти воркера"""
+    return get_brand_catalog().get(season)
+
+
+def get_brand_pools(season: str, temperature: float) -> Dict[str, Any]:
+    """Подходящие для температуры товары брендов сезона по категориям движка (CategoryPool, из памяти воркера)"""
+    return get_brand_catalog().get_pools(season, temperature)
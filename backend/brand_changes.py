@@ -0,0 +1,65 @@
+"""
+Лента изменений brand_items для инкрементальной синхронизации
+(каталог брендов — brand_catalog.py, поисковый индекс — search_index.py)
+
+RLS отдает anon-ключу только одобренные активные товары, поэтому снятые
+с публикации (is_active / is_approved = false) и удаленные строки обычным
+select не видны. SQL функция brand_item_changes (BRAND_ITEMS_SYNC_SETUP.sql)
+возвращает id всех строк, измененных после отметки updated_at, с признаком
+видимости — включая снятые и удаленные (таблица brand_items_deleted).
+Полные строки видимых товаров догружаются select'ом по id.
+
+Без BRAND_ITEMS_SYNC_SETUP.sql вызов ленты падает — вызывающий код
+возвращается к полной загрузке.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+FETCH_CHUNK = 200  # id в одном запросе .in_()
+
+
+@dataclass
+class BrandItemChanges:
+    """Изменения после отметки: новые/измененные видимые строки и id снятых товаров"""
+    upserts: List[Dict[str, Any]] = field(default_factory=list)
+    removed: Set[str] = field(default_factory=set)
+    watermark: Optional[str] = None  # максимальный updated_at среди изменений
+
+    def __len__(self) -> int:
+        return len(self.upserts) + len(self.removed)
+
+
+def fetch_watermark(supabase) -> Optional[str]:
+    """Текущая отметка: последний updated_at среди видимых товаров"""
+    rows = supabase.table('brand_items').select('updated_at') \
+        .order('updated_at', desc=True).limit(1).execute().data or []
+    return rows[0].get('updated_at') if rows else None
+
+
+def fetch_changes(supabase, since: str, fields: str) -> BrandItemChanges:
+    """Строки brand_items, измененные начиная с since (граничные приходят повторно; поля fields — для видимых)"""
+    feed = supabase.rpc('brand_item_changes', {'since': since}).execute().data or []
+
+    changes = BrandItemChanges(watermark=since)
+    visible: List[str] = []
+    for row in feed:
+        item_id = str(row.get('id'))
+        if row.get('visible'):
+            visible.append(item_id)
+        else:
+            changes.removed.add(item_id)
+        updated_at = row.get('updated_at')
+        if updated_at and updated_at > changes.watermark:
+            changes.watermark = updated_at
+
+    for start in range(0, len(visible), FETCH_CHUNK):
+        chunk = visible[start:start + FETCH_CHUNK]
+        changes.upserts.extend(
+            supabase.table('brand_items').select(fields).in_('id', chunk).execute().data or []
+        )
+    # Товар успели снять между лентой и select'ом — RLS его уже не отдает
+    fetched = {str(row.get('id')) for row in changes.upserts}
+    changes.removed |= set(visible) - fetched
+    changes.removed -= fetched
+    return changes
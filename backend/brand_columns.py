@@ -0,0 +1,366 @@
+"""
+Колоночное представление каталога брендов (NumPy)
+
+Каталог сезона — тысячи товаров. Признаки, от которых зависит фильтр по погоде,
+разбираются из описаний один раз при загрузке и хранятся массивами:
+- код корзины (категория движка, для аксессуаров — acc_<подтип>) и категория V6
+- битовая маска тканей (capsule_engine_v6.FABRIC_BITS)
+- флаги сезона вещи и ключевых слов описания (деним, куртка, тип обуви, шорты)
+- число показов и признак вещи пользователя
+
+Пригодность для температуры — булева маска, которая повторяет правила
+capsule_engine_v6._is_suitable векторными операциями (без цикла по словарям).
+Выбор товаров в ответе (brand_service_v4/v5) идет через CategoryPool: «еще не
+использован в этом ответе» — маска по счетчику использований, наименее показанный —
+argmin по показам.
+
+bench_brand_catalog.py сверяет результат с построчной проверкой и сравнивает скорость.
+"""
+
+import random
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from capsule_engine_v6 import (
+    CASUAL_SHOE_WORDS,
+    COLD_ACCESSORY_SUBTYPES,
+    DENIM_WORDS,
+    JACKET_WORDS,
+    LIGHT_SHOE_WORDS,
+    TEMPERATURE_BREAKPOINTS,
+    WARM_SHOE_WORDS,
+    _fabric_text,
+    accessory_subtype,
+    detect_fabric_mask,
+    fabric_zone_masks,
+    translate_category,
+    zone_temperature,
+)
+
+# Флаги сезона вещи (подстроки — как в _is_suitable)
+SEASON_SET = 1        # сезон указан
+SEASON_WINTER = 2     # 'зим'
+SEASON_SUMMER = 4     # 'лет'
+SEASON_MIDSEASON = 8  # 'весн' / 'осен' / 'демисезон'
+SEASON_ALL = 16       # 'всесезон'
+
+# Флаги ключевых слов описания
+KW_DENIM = 1
+KW_JACKET = 2
+KW_LIGHT_SHOES = 4
+KW_WARM_SHOES = 8
+KW_CASUAL_SHOES = 16
+KW_SHORTS = 32
+
+# Категории V6 (translate_category), которые различает фильтр
+_V6_CATEGORIES = ('other', 'accessories', 'bags', 'tops', 'outerwear', 'light_outerwear', 'shoes')
+_V6_CODES = {name: code for code, name in enumerate(_V6_CATEGORIES)}
+
+
+def _season_flags(item: Dict[str, Any]) -> int:
+    item_season = (item.get('season') or item.get('сезон') or '').lower()
+    if not item_season:
+        return 0
+    flags = SEASON_SET
+    if 'зим' in item_season:
+        flags |= SEASON_WINTER
+    if 'лет' in item_season:
+        flags |= SEASON_SUMMER
+    if 'весн' in item_season or 'осен' in item_season or 'демисезон' in item_season:
+        flags |= SEASON_MIDSEASON
+    if 'всесезон' in item_season:
+        flags |= SEASON_ALL
+    return flags
+
+
+def _keyword_flags(item: Dict[str, Any]) -> int:
+    desc = (item.get('description') or item.get('описание') or '').lower()
+    flags = 0
+    for bit, words in (
+        (KW_DENIM, DENIM_WORDS),
+        (KW_JACKET, JACKET_WORDS),
+        (KW_LIGHT_SHOES, LIGHT_SHOE_WORDS),
+        (KW_WARM_SHOES, WARM_SHOE_WORDS),
+        (KW_CASUAL_SHOES, CASUAL_SHOE_WORDS),
+    ):
+        if any(word in desc for word in words):
+            flags |= bit
+    if 'шорт' in desc or 'шорт' in (item.get('category') or '').lower():
+        flags |= KW_SHORTS
+    return flags
+
+
+class CatalogColumns:
+    """Признаки товаров каталога одного сезона — по массиву на признак"""
+
+    # Колонки, которые сохраняются в снимок (catalog_snapshot.py)
+    ARRAYS = ('bucket', 'v6_category', 'cold_accessory', 'fabrics', 'season', 'keywords', 'impressions', 'is_user')
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+        self.buckets: List[str] = []  # код -> имя корзины
+        for name, array in self._parse(items).items():
+            setattr(self, name, array)
+
+    def _parse(self, items: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """Признаки товаров (новые корзины дописываются в self.buckets)"""
+        from brand_service_v5 import identify_accessory_subtype, map_brand_category_to_engine_category
+
+        n = len(items)
+        bucket_codes = {name: code for code, name in enumerate(self.buckets)}
+        bucket = np.empty(n, dtype=np.int16)
+        v6_category = np.empty(n, dtype=np.int8)
+        cold_accessory = np.zeros(n, dtype=bool)
+        fabrics = np.empty(n, dtype=np.int64)
+        season = np.empty(n, dtype=np.uint8)
+        keywords = np.empty(n, dtype=np.uint8)
+        impressions = np.empty(n, dtype=np.int64)
+        is_user = np.zeros(n, dtype=bool)
+
+        for i, item in enumerate(items):
+            engine_cat = map_brand_category_to_engine_category(item.get('category', ''))
+            if engine_cat == 'accessories':
+                engine_cat = f"acc_{identify_accessory_subtype(item.get('description', '').lower())}"
+            code = bucket_codes.get(engine_cat)
+            if code is None:
+                code = bucket_codes[engine_cat] = len(self.buckets)
+                self.buckets.append(engine_cat)
+            bucket[i] = code
+
+            item_cat = translate_category(item.get('category', ''))
+            v6_category[i] = _V6_CODES.get(item_cat, _V6_CODES['other'])
+            if item_cat == 'accessories':
+                cold_accessory[i] = accessory_subtype(item) in COLD_ACCESSORY_SUBTYPES
+            fabrics[i] = detect_fabric_mask(_fabric_text(item))
+            season[i] = _season_flags(item)
+            keywords[i] = _keyword_flags(item)
+            impressions[i] = item.get('impressions_count') or 0
+            is_user[i] = not item.get('is_brand_item', True)
+
+        return {
+            'bucket': bucket,
+            'v6_category': v6_category,
+            'cold_accessory': cold_accessory,
+            'fabrics': fabrics,
+            'season': season,
+            'keywords': keywords,
+            'impressions': impressions,
+            'is_user': is_user,
+        }
+
+    def with_changes(self, upserts: List[Dict[str, Any]], removed: Set[str]) -> 'CatalogColumns':
+        """
+        Новая версия колонок после инкрементальной синхронизации: разбираются только
+        измененные и новые товары, остальные строки копируются из массивов.
+        Поля измененной строки накладываются на прежний словарь товара.
+        """
+        position = {str(item.get('id')): i for i, item in enumerate(self.items)}
+        keep = np.ones(len(self.items), dtype=bool)
+        for item_id in removed:
+            i = position.get(item_id)
+            if i is not None:
+                keep[i] = False
+
+        changed: Dict[int, Dict[str, Any]] = {}
+        added: List[Dict[str, Any]] = []
+        for row in upserts:
+            i = position.get(str(row.get('id')))
+            if i is None:
+                added.append(row)
+            elif keep[i]:
+                changed[i] = {**self.items[i], **row}
+
+        kept = np.flatnonzero(keep)
+        columns = CatalogColumns.__new__(CatalogColumns)
+        columns.buckets = list(self.buckets)
+        arrays = {name: getattr(self, name)[kept] for name in self.ARRAYS}  # копии (и из mmap снимка)
+        items = [changed.get(i, self.items[i]) for i in kept]
+
+        if changed:
+            slots = np.flatnonzero(np.isin(kept, list(changed)))
+            parsed = columns._parse([items[slot] for slot in slots])
+            for name in self.ARRAYS:
+                arrays[name][slots] = parsed[name]
+        if added:
+            parsed = columns._parse(added)
+            arrays = {name: np.concatenate([arrays[name], parsed[name]]) for name in self.ARRAYS}
+            items.extend(added)
+
+        columns.items = items
+        for name, array in arrays.items():
+            setattr(columns, name, array)
+        return columns
+
+    @classmethod
+    def from_arrays(cls, items: List[Dict[str, Any]], buckets: List[str], arrays: Dict[str, np.ndarray]) -> 'CatalogColumns':
+        """Колонки из снимка (массивы могут быть отображены в память только для чтения)"""
+        columns = cls.__new__(cls)
+        columns.items = items
+        columns.buckets = list(buckets)
+        for name in cls.ARRAYS:
+            setattr(columns, name, arrays[name])
+        return columns
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def zone_masks(self, season: str) -> np.ndarray:
+        """Маски пригодности для всех температурных зон V6: [зона, товар]"""
+        return np.stack([
+            self.suitable_mask(zone_temperature(zone), season)
+            for zone in range(len(TEMPERATURE_BREAKPOINTS) + 1)
+        ])
+
+    def suitable_mask(self, temp_c: float, season: str) -> np.ndarray:
+        """Пригодность товаров для температуры и сезона (правила capsule_engine_v6._is_suitable)"""
+        n = len(self.items)
+        result = np.zeros(n, dtype=bool)
+        decided = np.zeros(n, dtype=bool)
+
+        def settle(condition, value) -> None:
+            # Правила проверяются по порядку: срабатывает первое подходящее
+            newly = condition & ~decided
+            result[newly] = value
+            decided[newly] = True
+
+        cat = self.v6_category
+        has = lambda flags, bit: (flags & bit) != 0  # noqa: E731
+        season_set = has(self.season, SEASON_SET)
+        winter = has(self.season, SEASON_WINTER)
+        summer = has(self.season, SEASON_SUMMER)
+        is_shoes = cat == _V6_CODES['shoes']
+        summer_hint = 'лет' in season.lower()
+
+        # Аксессуары: теплые — только при <20°C, остальные — по явной сезонности
+        accessories = cat == _V6_CODES['accessories']
+        settle(accessories & self.cold_accessory, temp_c < 20.0)
+        settle(accessories & season_set & summer & (temp_c < 15.0), False)
+        settle(accessories & season_set & winter & (temp_c >= 15.0), False)
+        settle(accessories, True)
+
+        # Сумки: только по сезону
+        bags = cat == _V6_CODES['bags']
+        settle(bags & (~season_set | has(self.season, SEASON_ALL)), True)
+        settle(bags & summer & (not summer_hint), False)
+        settle(bags & winter & (temp_c >= 15.0), False)
+        settle(bags, True)
+
+        denim = has(self.keywords, KW_DENIM)
+        if temp_c < 15.0:
+            # Джинсовый верх и джинсовые куртки — от +15°C
+            settle((cat == _V6_CODES['tops']) & denim, False)
+            outer = (cat == _V6_CODES['outerwear']) | (cat == _V6_CODES['light_outerwear'])
+            settle(outer & denim & has(self.keywords, KW_JACKET), False)
+            settle(is_shoes & has(self.keywords, KW_LIGHT_SHOES), False)
+        if temp_c >= 20.0:
+            settle(is_shoes & has(self.keywords, KW_WARM_SHOES), False)
+        if temp_c <= 10.0 or temp_c >= 25.0:
+            settle(is_shoes & has(self.keywords, KW_CASUAL_SHOES), False)
+
+        # Всесезонные (кроме обуви)
+        settle(has(self.season, SEASON_ALL) & ~is_shoes, True)
+
+        # Ткани
+        allowed, blocked = fabric_zone_masks(temp_c)
+        fabric_ok = (self.fabrics == 0) | ((self.fabrics & allowed) != 0) | ((self.fabrics & blocked) == 0)
+        settle(~fabric_ok, False)
+
+        # Сезонность вещи
+        if temp_c < 7:
+            settle(winter, True)
+        if 7 <= temp_c < 23:
+            settle(has(self.season, SEASON_MIDSEASON), True)
+        if temp_c >= 23:
+            settle(summer, True)
+
+        # Шорты — только жара или лето
+        settle(has(self.keywords, KW_SHORTS), temp_c >= 22.0 or summer_hint)
+
+        # Сезон не указан — вещь всесезонная
+        settle(~season_set, True)
+        return result
+
+    def pools(self, temp_c: float, season: str) -> Dict[str, 'CategoryPool']:
+        """Подходящие товары по корзинам категорий (шаблоны пулов, см. CategoryPool.fresh)"""
+        return self.pools_for_mask(self.suitable_mask(temp_c, season))
+
+    def pools_for_mask(self, mask: np.ndarray) -> Dict[str, 'CategoryPool']:
+        pools: Dict[str, CategoryPool] = {}
+        for code, name in enumerate(self.buckets):
+            idx = np.flatnonzero(mask & (self.bucket == code))
+            if len(idx):
+                pools[name] = CategoryPool([self.items[i] for i in idx], self.impressions[idx], self.is_user[idx])
+        return pools
+
+
+class CategoryPool:
+    """
+    Товары одной категории в одном ответе: сколько раз каждый уже использован.
+
+    Списки товаров и показы общие с каталогом (только чтение), счетчики — свои
+    у каждого пула (CategoryPool.fresh на каждый запрос).
+    """
+
+    def __init__(
+        self,
+        items: List[Dict[str, Any]],
+        impressions: np.ndarray,
+        is_user: Optional[np.ndarray] = None
+    ):
+        self.items = items
+        self.impressions = impressions
+        self.is_user = is_user if is_user is not None else np.zeros(len(items), dtype=bool)
+        self.uses = np.zeros(len(items), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def fresh(self) -> 'CategoryPool':
+        return CategoryPool(self.items, self.impressions, self.is_user)
+
+    def add_user_items(self, items: List[Dict[str, Any]]) -> None:
+        """Добавляет вещи пользователя (в конец — как раньше в списке категории)"""
+        if not items:
+            return
+        self.items = self.items + items
+        self.impressions = np.concatenate([self.impressions, np.zeros(len(items), dtype=np.int64)])
+        self.is_user = np.concatenate([self.is_user, np.ones(len(items), dtype=bool)])
+        self.uses = np.concatenate([self.uses, np.zeros(len(items), dtype=np.int32)])
+
+    # ---------- выбор ----------
+
+    def unused(self) -> np.ndarray:
+        """Индексы товаров, еще не использованных в этом ответе"""
+        return np.flatnonzero(self.uses == 0)
+
+    def all(self) -> np.ndarray:
+        return np.arange(len(self.items))
+
+    def user_only(self, candidates: np.ndarray) -> np.ndarray:
+        return candidates[self.is_user[candidates]]
+
+    @staticmethod
+    def choice(candidates: np.ndarray, rng: random.Random) -> int:
+        """Случайный индекс (тот же выбор, что rng.choice по списку кандидатов)"""
+        return int(candidates[rng.randrange(len(candidates))])
+
+    def least_used(self, candidates: np.ndarray) -> int:
+        """Наименее использованный в ответе, при равенстве — с наименьшим числом показов"""
+        uses = self.uses[candidates].astype(np.int64)
+        key = uses * (int(self.impressions.max(initial=0)) + 1) + self.impressions[candidates]
+        return int(candidates[np.argmin(key)])
+
+    def use(self, index: int) -> Dict[str, Any]:
+        self.uses[index] += 1
+        return self.items[index]
+
+    def take_random_unused(self, rng: random.Random) -> Optional[Dict[str, Any]]:
+        """Случайный еще не использованный товар (None — все использованы)"""
+        candidates = self.unused()
+        if not len(candidates):
+            return None
+        return self.use(self.choice(candidates, rng))
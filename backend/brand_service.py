@@ -2,27 +2,10 @@
 Сервис для работы с товарами брендов через прямое подключение к Supabase
 """
 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 import random
-import os
 from collections import defaultdict
-from supabase import create_client, Client
-
-
-def get_supabase_client() -> Optional[Client]:
-    """Получить клиент Supabase"""
-    try:
-        url = os.getenv('VITE_SUPABASE_URL') or os.getenv('SUPABASE_URL')
-        key = os.getenv('VITE_SUPABASE_ANON_KEY') or os.getenv('SUPABASE_ANON_KEY')
-        
-        if not url or not key:
-            print("⚠️ Supabase credentials not found in environment")
-            return None
-            
-        return create_client(url, key)
-    except Exception as e:
-        print(f"❌ Ошибка подключения к Supabase: {e}")
-        return None
+from supabase_client import get_supabase_client  # общий клиент воркера
 
 
 def get_all_brand_items() -> List[Dict[str, Any]]:
@@ -12,7 +12,12 @@
 from typing import List, Dict, Any, Optional, Set
 import random
 import os
+import threading
+import numpy as np
 from collections import defaultdict
+from supabase_client import get_supabase_client  # общий клиент воркера (app импортирует отсюда)
+
+BRAND_ITEM_FIELDS = 'id, brand_id, category, season, description, image_id, shop_link, price, currency, impressions_count'
 
 # Импортируем функцию из V5
 def identify_accessory_subtype(description: str) -> str:
@@ -43,101 +48,156 @@ def identify_accessory_subtype(description: str) -> str:
         return 'other'
 
 
-def get_supabase_client():
-    """Получить клиент Supabase (импорт внутри функции для избежания блокировки модуля)"""
-    try:
-        from supabase import create_client, Client
-        
-        url = os.getenv('VITE_SUPABASE_URL') or os.getenv('SUPABASE_URL')
-        key = os.getenv('VITE_SUPABASE_ANON_KEY') or os.getenv('SUPABASE_ANON_KEY')
-        
-        if not url or not key:
-            print("⚠️ Supabase credentials not found in environment")
-            return None
-            
-        return create_client(url, key)
-    except ImportError:
-        print("⚠️ Модуль supabase не установлен, FALLBACK на Supabase недоступен")
-        return None
-    except Exception as e:
-        print(f"❌ Ошибка подключения к Supabase: {e}")
-        return None
-
 
 def get_all_brand_items_by_season(season: str) -> List[Dict[str, Any]]:
-    """Получить ВСЕ товары брендов по сезону через ПУБЛИЧНЫЙ API"""
-    try:
-        import requests
-        
-        # Маппинг сезонов на русский язык для API
-        season_map = {
-            'Весна': 'Весна',
-            'Лето': 'Лето',
-            'Осень': 'Осень',
-            'Зима': 'Зима'
-        }
-        
-        season_ru = season_map.get(season, 'Осень')
-        
-        # Запрос к публичному API (БЕЗ категории - только сезон!)
-        api_url = f"https://linapolo.ru/api/public/items/capsule?season={season_ru}"
-        
-        print(f"📡 Запрос к API: {api_url}")
-        
-        response = requests.get(api_url, timeout=30)  # Увеличили timeout до 30 сек
+    """Получить ВСЕ товары брендов по сезону (из каталога в памяти воркера)"""
+    from brand_catalog import get_brand_items
+    return get_brand_items(season)
+
+
+_brand_fetch = None
+_brand_fetch_lock = threading.Lock()
+
+
+def get_brand_fetch():
+    """Хеджированная загрузка каталога: публичный API, при задержке — параллельно Supabase"""
+    global _brand_fetch
+    if _brand_fetch is None:
+        with _brand_fetch_lock:
+            if _brand_fetch is None:
+                from config import Config
+                from hedged_fetch import HedgedFetch
+                _brand_fetch = HedgedFetch(
+                    'Каталог брендов',
+                    hedge_after=Config.BRAND_FETCH_HEDGE_AFTER,
+                    timeout=Config.BRAND_FETCH_TIMEOUT
+                )
+    return _brand_fetch
+
+
+def fetch_brand_items_by_season(season: str) -> List[Dict[str, Any]]:
+    """
+    Загрузить ВСЕ товары брендов по сезону (используется каталогом): публичный API,
+    а если он не ответил за BRAND_FETCH_HEDGE_AFTER или упал — параллельно Supabase;
+    берется первый непустой ответ
+    """
+    items = get_brand_fetch().run(
+        lambda: fetch_brand_items_from_api(season),
+        lambda: fetch_brand_items_from_supabase(season)
+    )
+    if items is None:
+        print(f"❌ Товары брендов [{season}] не загружены ни из API, ни из Supabase")
+        return []
+    return items
+
+
+def fetch_brand_items_from_api(season: str) -> List[Dict[str, Any]]:
+    """Товары брендов сезона через ПУБЛИЧНЫЙ API"""
+    from config import Config
+    from http_client import http_get
+    from resilience import BRAND_API, guard
+
+    # Маппинг сезонов на русский язык для API
+    season_map = {
+        'Весна': 'Весна',
+        'Лето': 'Лето',
+        'Осень': 'Осень',
+        'Зима': 'Зима'
+    }
+    
+    season_ru = season_map.get(season, 'Осень')
+    
+    # Запрос к публичному API (БЕЗ категории - только сезон!)
+    api_url = f"https://linapolo.ru/api/public/items/capsule?season={season_ru}"
+    
+    print(f"📡 Запрос к API: {api_url}")
+    
+    # Один повтор при обрыве соединения; медленный ответ перекрывает хеджирование (Supabase).
+    # При открытом предохранителе API отказ мгновенный — хеджирование сразу запускает Supabase
+    with guard(BRAND_API):
+        response = http_get(api_url, timeout=Config.BRAND_FETCH_TIMEOUT, retries=1)
         response.raise_for_status()
-        
-        data = response.json()
-        items = data.get('items', [])
-        
-        # Данные уже готовы: image_url и shop_link уже есть!
-        for item in items:
-            item['is_brand_item'] = True
-            # brand_name уже есть из API
-            # Если shop_link отсутствует, устанавливаем None
-            if 'shop_link' not in item or not item['shop_link']:
-                item['shop_link'] = None
-        
-        print(f"✅ Загружено {len(items)} товаров брендов через публичный API")
-        print(f"   Алгоритм: {data.get('algorithm', 'unknown')}")
-        return items
     
-    except Exception as e:
-        print(f"❌ Ошибка загрузки товаров брендов через API: {e}")
-        print(f"🔄 Пробуем FALLBACK на прямой запрос к Supabase...")
-        
-        # FALLBACK: прямой запрос к Supabase
-        try:
-            supabase = get_supabase_client()
-            if not supabase:
-                return []
-            
-            response = supabase.table('brand_items') \
-                .select('id, brand_id, category, season, description, image_id, shop_link, price, currency') \
-                .eq('is_approved', True) \
-                .eq('is_active', True) \
-                .execute()
-            
-            items = response.data if response.data else []
-            
-            for item in items:
-                if item.get('image_id') and item.get('brand_id'):
-                    item['image_url'] = f"https://lipolo.store/storage/v1/object/public/brand-items-images/{item['brand_id']}/{item['image_id']}.jpg"
-                else:
-                    item['image_url'] = None
-                item['is_brand_item'] = True
-                item['brand_name'] = 'LiMango'
-                if 'shop_link' not in item or not item['shop_link']:
-                    item['shop_link'] = None
-                # Устанавливаем impressions_count = 0 для Supabase товаров
-                if 'impressions_count' not in item:
-                    item['impressions_count'] = 0
-            
-            print(f"✅ FALLBACK: Загружено {len(items)} товаров брендов из Supabase")
-            return items
-        except Exception as fallback_error:
-            print(f"❌ FALLBACK тоже не сработал: {fallback_error}")
-            return []
+    data = response.json()
+    items = data.get('items', [])
+    
+    # Данные уже готовы: image_url и shop_link уже есть!
+    for item in items:
+        item['is_brand_item'] = True
+        # brand_name уже есть из API
+        item.setdefault('image_url', None)
+        # Если shop_link отсутствует, устанавливаем None
+        if 'shop_link' not in item or not item['shop_link']:
+            item['shop_link'] = None
+        if 'impressions_count' not in item:
+            item['impressions_count'] = 0
+    
+    print(f"✅ Загружено {len(items)} товаров брендов через публичный API")
+    print(f"   Алгоритм: {data.get('algorithm', 'unknown')}")
+    return items
+
+
+def fetch_brand_items_from_supabase(season: str) -> List[Dict[str, Any]]:
+    """Товары брендов сезона прямым запросом к Supabase (в том же виде, что и из API)"""
+    from brand_catalog import item_in_season
+
+    supabase = get_supabase_client()
+    if not supabase:
+        raise RuntimeError('Supabase не доступен')
+
+    items: List[Dict[str, Any]] = []
+    offset, page_size = 0, 1000
+    while True:
+        page = supabase.table('brand_items') \
+            .select(BRAND_ITEM_FIELDS) \
+            .eq('is_approved', True) \
+            .eq('is_active', True) \
+            .order('id') \
+            .range(offset, offset + page_size - 1) \
+            .execute().data or []
+        items.extend(page)
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+    items = [_decorate_supabase_item(item) for item in items if item_in_season(item, season)]
+    print(f"✅ Загружено {len(items)} товаров брендов из Supabase")
+    return items
+
+
+def _decorate_supabase_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля, которые публичный API отдает готовыми, для строки brand_items из Supabase"""
+    if item.get('image_id') and item.get('brand_id'):
+        item['image_url'] = f"https://lipolo.store/storage/v1/object/public/brand-items-images/{item['brand_id']}/{item['image_id']}.jpg"
+    else:
+        item['image_url'] = None
+    item['is_brand_item'] = True
+    item['brand_name'] = 'LiMango'
+    if 'shop_link' not in item or not item['shop_link']:
+        item['shop_link'] = None
+    # Устанавливаем impressions_count = 0 для Supabase товаров
+    if 'impressions_count' not in item:
+        item['impressions_count'] = 0
+    return item
+
+
+def fetch_brand_item_changes(season: str, since: Optional[str]):
+    """
+    Изменения товаров брендов после отметки updated_at since (используется каталогом
+    для инкрементальной синхронизации; since=None — только текущая отметка).
+    Сезон не фильтруется: товары относит к сезону каталог.
+    """
+    from brand_changes import BrandItemChanges, fetch_changes, fetch_watermark
+
+    supabase = get_supabase_client()
+    if not supabase:
+        raise RuntimeError('Supabase не доступен')
+    if since is None:
+        return BrandItemChanges(watermark=fetch_watermark(supabase))
+    changes = fetch_changes(supabase, since, BRAND_ITEM_FIELDS)
+    for item in changes.upserts:
+        _decorate_supabase_item(item)
+    return changes
 
 
 def map_brand_category_to_engine_category(brand_category: str) -> str:
@@ -196,7 +256,8 @@ def mix_brand_items_v4(
     season: str,
     temperature: float = 20.0,
     mixing_percentage: float = 0.35,
-    exclude_combinations: List[List[str]] = None
+    exclude_combinations: List[List[str]] = None,
+    rng: Optional[random.Random] = None
 ) -> List[Dict[str, Any]]:
     """
     ПРАКТИЧНАЯ ЛОГИКА V4: Подмешивает товары брендов с умным приоритетом
@@ -274,7 +335,7 @@ def mix_brand_items_v4(
     # 6. Подмешиваем в случайные капсулы (минимум 7!)
     total_to_mix = max(7, int(len(user_capsules) * mixing_percentage))
     capsules_to_mix = list(range(len(user_capsules)))
-    random.shuffle(capsules_to_mix)
+    (rng or random.Random()).shuffle(capsules_to_mix)
     capsules_to_mix = capsules_to_mix[:min(total_to_mix, len(user_capsules))]
     
     mixed_count = 0
@@ -483,7 +544,8 @@ def supplement_capsules_with_brand_items(
     target_count: int,
     season: str,
     temperature: float = 20.0,
-    user_wardrobe: Optional[List[Dict[str, Any]]] = None
+    user_wardrobe: Optional[List[Dict[str, Any]]] = None,
+    rng: Optional[random.Random] = None
 ) -> List[Dict[str, Any]]:
     """
     ДОПОЛНЯЕТ капсулы брендовыми товарами, если у пользователя недостаточно вещей
@@ -493,10 +555,12 @@ def supplement_capsules_with_brand_items(
         target_count: целевое количество капсул (например, 20)
         season: сезон
         temperature: температура
+        rng: генератор случайных чисел запроса (для воспроизводимости по seed)
     
     Returns:
         Дополненный список капсул
     """
+    rng = rng or random.Random()
     missing_count = target_count - len(user_capsules)
     
     if missing_count <= 0:
@@ -511,60 +575,46 @@ def supplement_capsules_with_brand_items(
         print("  ⚠️ Нет товаров брендов для дополнения")
         return user_capsules
     
-    # Импортируем функцию фильтрации
-    try:
-        from capsule_engine_v6 import is_suitable_for_temp_and_season
-    except ImportError:
-        from capsule_engine_v4 import is_suitable_for_temp_and_season
+    # Подходящие по температуре товары брендов уже сгруппированы по категориям
+    # (каталог в памяти разложен по температурным зонам V6; пул категории считает
+    # использования товаров в этом ответе)
+    from brand_catalog import get_brand_pools
+    from brand_columns import CategoryPool
+    brand_by_category = get_brand_pools(season, temperature)
+    print(f"  ✅ Подходящих по температуре {temperature}°C товаров брендов: {sum(len(pool) for pool in brand_by_category.values())} из {len(all_brand_items)}")
+    
+    user_items_by_category = defaultdict(list)  # Для отладки
     
     # Добавляем вещи пользователя к брендовым товарам для смешивания
     if user_wardrobe:
         print(f"  👤 Добавляем {len(user_wardrobe)} вещей пользователя к брендовым товарам")
+        try:
+            from capsule_engine_v6 import is_suitable_for_temp_and_season, translate_category
+        except ImportError:
+            from capsule_engine_v4 import is_suitable_for_temp_and_season
+            translate_category = map_brand_category_to_engine_category
+        
         # Фильтруем вещи пользователя по температуре
         user_filtered = [item for item in user_wardrobe if is_suitable_for_temp_and_season(item, temperature, season)]
-        # Помечаем вещи пользователя
         for item in user_filtered:
+            # Помечаем вещи пользователя
             item['is_brand_item'] = False
             # Добавляем недостающие поля для корректного отображения
             if 'name' not in item or not item['name']:
                 item['name'] = item.get('description', 'Вещь пользователя')[:50]
             if 'image_url' not in item:
                 item['image_url'] = None
-        all_brand_items.extend(user_filtered)
-        print(f"  ✅ Итого товаров для создания капсул: {len(all_brand_items)}")
-    
-    # Фильтруем все товары по температуре
-    filtered_items = [item for item in all_brand_items if is_suitable_for_temp_and_season(item, temperature, season)]
-    print(f"  ✅ Отфильтровано {len(filtered_items)} товаров по температуре {temperature}°C")
-    
-    # Группируем по категориям
-    brand_by_category = defaultdict(list)
-    user_items_by_category = defaultdict(list)  # Для отладки
-    
-    for item in filtered_items:
-        # Для вещей пользователя используем V6 логику, для брендовых - V4
-        if not item.get('is_brand_item', True):
-            # Вещи пользователя - используем V6 логику
-            try:
-                from capsule_engine_v6 import translate_category
-                original_cat = item.get('category', '')
-                engine_cat = translate_category(original_cat)
-                # print(f"    👤 Вещь пользователя: '{original_cat}' → '{engine_cat}'")
-            except ImportError:
-                engine_cat = map_brand_category_to_engine_category(item.get('category', ''))
-        else:
-            # Брендовые товары - используем V4 логику
-            engine_cat = map_brand_category_to_engine_category(item.get('category', ''))
-        
-        if engine_cat == 'accessories':
-            subtype = identify_accessory_subtype(item.get('description', '').lower())
-            brand_by_category[f'acc_{subtype}'].append(item)
-            if not item.get('is_brand_item', True):
-                user_items_by_category[f'acc_{subtype}'].append(item)
-        else:
-            brand_by_category[engine_cat].append(item)
-            if not item.get('is_brand_item', True):
-                user_items_by_category[engine_cat].append(item)
+            
+            # Вещи пользователя - используем V6 логику категорий
+            engine_cat = translate_category(item.get('category', ''))
+            if engine_cat == 'accessories':
+                engine_cat = f"acc_{identify_accessory_subtype(item.get('description', '').lower())}"
+            user_items_by_category[engine_cat].append(item)
+        for engine_cat, items in user_items_by_category.items():
+            if engine_cat not in brand_by_category:
+                brand_by_category[engine_cat] = CategoryPool([], np.zeros(0, dtype=np.int64))
+            brand_by_category[engine_cat].add_user_items(items)
+        print(f"  ✅ Итого товаров для создания капсул: {sum(len(pool) for pool in brand_by_category.values())}")
     
     # Логируем категории вещей пользователя
     if user_items_by_category:
@@ -602,40 +652,40 @@ def supplement_capsules_with_brand_items(
             # Определяем, обязательная ли это категория (верх, низ, обувь, сумка)
             is_required = cat in ['tops', 'bottoms', 'shoes', 'bags']
             
+            pool = brand_by_category[cat]
+            
             # Берем товар, который ЕЩЕ НЕ использовался (только 1 раз!)
-            available = [item for item in brand_by_category[cat] if item_usage_count[item['id']] == 0]
+            available = pool.unused()
             
             # Если все товары использованы, но категория обязательная - разрешаем повторное использование
-            if not available and is_required:
+            if not len(available) and is_required:
                 # Для обязательных категорий разрешаем повторное использование (выбираем наименее использованный)
-                available = brand_by_category[cat]
+                available = pool.all()
                 print(f"  ⚠️ Все товары категории {cat} уже использованы, но категория обязательная - разрешаем повтор")
             
-            if not available:
+            if not len(available):
                 # Если категория необязательная (аксессуары) и все товары использованы - пропускаем
                 print(f"  ⚠️ Все товары категории {cat} уже использованы, пропускаем")
                 continue
             
             # Выбираем товар
             if len(available) == 1:
-                item = available[0]
+                index = int(available[0])
             else:
                 # Приоритет вещам пользователя (is_brand_item=False)
-                user_items = [item for item in available if not item.get('is_brand_item', True)]
-                if user_items:
+                user_items = pool.user_only(available)
+                if len(user_items):
                     # Выбираем случайный из вещей пользователя
-                    item = random.choice(user_items)
+                    index = pool.choice(user_items, rng)
                 else:
                     # Для обязательных категорий - выбираем случайный для разнообразия
                     # Для необязательных - выбираем наименее использованный
                     if is_required:
-                        item = random.choice(available)  # Случайный для разнообразия
+                        index = pool.choice(available, rng)  # Случайный для разнообразия
                     else:
-                        # Выбираем наименее использованный товар бренда
-                        item = min(available, key=lambda x: (
-                            item_usage_count[x['id']],  # Минимальное использование
-                            x.get('impressions_count', 0)  # Глобальные показы
-                        ))
+                        # Наименее использованный товар бренда, при равенстве - с меньшими глобальными показами
+                        index = pool.least_used(available)
+            item = pool.use(index)
             
             capsule_items.append(item)
             item_usage_count[item['id']] += 1
@@ -689,7 +739,7 @@ def supplement_capsules_with_brand_items(
     # СТАТИСТИКА ИСПОЛЬЗОВАНИЯ ТОВАРОВ БРЕНДОВ
     brand_items_usage = {item_id: count for item_id, count in item_usage_count.items() 
                         if any(item.get('id') == item_id and item.get('is_brand_item', True) 
-                              for cat_items in brand_by_category.values() for item in cat_items)}
+                              for pool in brand_by_category.values() for item in pool.items)}
     
     if brand_items_usage:
         print(f"\n  📈 СТАТИСТИКА ИСПОЛЬЗОВАНИЯ ТОВАРОВ БРЕНДОВ:")
@@ -701,8 +751,8 @@ def supplement_capsules_with_brand_items(
             for item_id, count in duplicates[:20]:  # Показываем первые 20
                 # Находим описание товара
                 item_desc = "Неизвестно"
-                for cat_items in brand_by_category.values():
-                    for item in cat_items:
+                for pool in brand_by_category.values():
+                    for item in pool.items:
                         if str(item.get('id')) == str(item_id) and item.get('is_brand_item', True):
                             item_desc = item.get('description', 'Нет описания')[:50]
                             break
@@ -15,58 +15,19 @@ from typing import List, Dict, Any, Optional
 import random
 import os
 from collections import defaultdict
-import requests
+
+from brand_catalog import get_brand_items, get_brand_pools
 
 
 def get_all_brand_items_by_season(season: str) -> List[Dict[str, Any]]:
-    """Получить ВСЕ товары брендов по сезону через ПУБЛИЧНЫЙ API"""
-    try:
-        # Маппинг сезонов на русский язык для API
-        season_map = {
-            'Весна': 'Весна',
-            'Лето': 'Лето',
-            'Осень': 'Осень',
-            'Зима': 'Зима'
-        }
-        
-        season_ru = season_map.get(season, 'Осень')
-        
-        # Запрос к публичному API (БЕЗ категории - только сезон!)
-        api_url = f"https://linapolo.ru/api/public/items/capsule?season={season_ru}"
-        
-        print(f"📡 V5: Запрос к API: {api_url}")
-        
-        response = requests.get(api_url, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        items = data.get('items', [])
-        
-        # Данные уже готовы: image_url и shop_link уже есть!
-        for item in items:
-            item['is_brand_item'] = True
-            if 'shop_link' not in item or not item['shop_link']:
-                item['shop_link'] = None
-            if 'impressions_count' not in item:
-                item['impressions_count'] = 0
-        
-        print(f"✅ V5: Загружено {len(items)} товаров брендов через публичный API")
-        print(f"   Алгоритм: {data.get('algorithm', 'unknown')}")
-        return items
-    
-    except Exception as e:
-        print(f"❌ V5: Ошибка загрузки товаров брендов через API: {e}")
-        print(f"🔄 V5: Пробуем FALLBACK на brand_service_v4...")
-        
-        # FALLBACK: используем функцию из brand_service_v4
-        try:
-            from brand_service_v4 import get_all_brand_items_by_season as get_v4
-            items = get_v4(season)
-            print(f"✅ V5 FALLBACK: Загружено {len(items)} товаров через V4")
-            return items
-        except Exception as fallback_error:
-            print(f"❌ V5 FALLBACK тоже не сработал: {fallback_error}")
-            return []
+    """Получить ВСЕ товары брендов по сезону (из каталога в памяти воркера)"""
+    return get_brand_items(season)
+
+
+def fetch_brand_items_by_season(season: str) -> List[Dict[str, Any]]:
+    """Загрузить ВСЕ товары брендов по сезону (используется каталогом): хеджированный запрос API/Supabase из V4"""
+    from brand_service_v4 import fetch_brand_items_by_season as fetch_v4
+    return fetch_v4(season)
 
 
 def map_brand_category_to_engine_category(brand_category: str) -> str:
@@ -115,7 +76,8 @@ def mix_brand_items_v5(
     wardrobe: List[Dict[str, Any]],
     season: str,
     temperature: float = 20.0,
-    exclude_combinations: Optional[List[List[str]]] = None
+    exclude_combinations: Optional[List[List[str]]] = None,
+    rng: Optional[random.Random] = None
 ) -> List[Dict[str, Any]]:
     """
     НОВАЯ ЛОГИКА V5: Гибкое распределение брендовых товаров
@@ -133,10 +95,13 @@ def mix_brand_items_v5(
         season: сезон
         temperature: температура
         exclude_combinations: уже показанные комбинации
+        rng: генератор случайных чисел запроса (для воспроизводимости по seed)
     
     Returns:
         Список из 20 капсул с разным уровнем подмешивания
     """
+    rng = rng or random.Random()
+    
     # Если недостаточно капсул пользователя, дополняем брендовыми товарами
     if len(user_capsules) < 20:
         print(f"  🛍️ Недостаточно капсул пользователя ({len(user_capsules)}), дополняем до 20 брендовыми товарами")
@@ -147,43 +112,23 @@ def mix_brand_items_v5(
             target_count=20,
             season=season,
             temperature=temperature,
-            user_wardrobe=wardrobe  # Передаем вещи пользователя
+            user_wardrobe=wardrobe,  # Передаем вещи пользователя
+            rng=rng
         )
     
-    # 1. Загружаем товары брендов
-    all_brand_items = get_all_brand_items_by_season(season)
-    if not all_brand_items:
-        print("  ⚠️ Нет товаров брендов для подмешивания")
-        return user_capsules
-    
-    # 2. Фильтруем по температуре
-    try:
-        from capsule_engine_v6 import is_suitable_for_temp_and_season
-    except ImportError:
-        from capsule_engine_v4 import is_suitable_for_temp_and_season
-    
-    filtered_items = [item for item in all_brand_items if is_suitable_for_temp_and_season(item, temperature, season)]
-    print(f"  ✅ Отфильтровано {len(filtered_items)} из {len(all_brand_items)} товаров брендов")
-    
-    if not filtered_items:
-        print("  ⚠️ После фильтрации не осталось товаров брендов")
+    # 1-3. Товары брендов, подходящие по температуре, уже сгруппированы по категориям
+    # (каталог в памяти разложен по температурным зонам V6; пул категории помнит,
+    # какие товары уже использованы в этом ответе)
+    brand_by_category = get_brand_pools(season, temperature)
+    filtered_count = sum(len(pool) for pool in brand_by_category.values())
+    if not filtered_count:
+        print("  ⚠️ Нет подходящих по погоде товаров брендов для подмешивания")
         return user_capsules
-    
-    # 3. Группируем по категориям
-    brand_by_category = defaultdict(list)
-    for item in filtered_items:
-        engine_cat = map_brand_category_to_engine_category(item.get('category', ''))
-        
-        if engine_cat == 'accessories':
-            subtype = identify_accessory_subtype(item.get('description', '').lower())
-            brand_by_category[f'acc_{subtype}'].append(item)
-        else:
-            brand_by_category[engine_cat].append(item)
+    print(f"  ✅ Подходящих по погоде товаров брендов: {filtered_count}")
     
     print(f"  📦 Товары брендов по категориям:")
-    for cat, items in sorted(brand_by_category.items()):
-        if items:
-            print(f"     - {cat}: {len(items)} шт.")
+    for cat, pool in sorted(brand_by_category.items()):
+        print(f"     - {cat}: {len(pool)} шт.")
     
     # 4. Создаем словарь для быстрого поиска
     wardrobe_dict = {str(item['id']): item for item in wardrobe}
@@ -199,7 +144,7 @@ def mix_brand_items_v5(
     
     # Перемешиваем капсулы для случайного распределения
     capsules_shuffled = list(enumerate(user_capsules))
-    random.shuffle(capsules_shuffled)
+    rng.shuffle(capsules_shuffled)
     
     # Группируем по типам подмешивания
     pure_user_capsules = capsules_shuffled[:7]  # 7 капсул без брендов
@@ -311,20 +256,14 @@ def mix_brand_items_v5(
             if cat not in brand_by_category or not brand_by_category[cat]:
                 continue
             
-            # Выбираем товар (ТОЛЬКО из неиспользованных!)
-            available_brand_items = [
-                item for item in brand_by_category[cat]
-                if item['id'] not in used_brand_items
-            ]
+            # Выбираем случайный товар ТОЛЬКО из неиспользованных (для разнообразия)
+            brand_item = brand_by_category[cat].take_random_unused(rng)
             
-            if not available_brand_items:
+            if brand_item is None:
                 # Все товары этой категории уже использованы - пропускаем эту замену
                 print(f"  ⚠️ Все товары категории {cat} уже использованы, пропускаем замену")
                 continue  # Пропускаем эту замену, пробуем следующую
             
-            # Выбираем случайный из неиспользованных для разнообразия
-            brand_item = random.choice(available_brand_items)
-            
             # Заменяем
             capsule['items'][idx_in_capsule] = brand_item
             used_brand_items.add(brand_item['id'])
@@ -356,14 +295,13 @@ def mix_brand_items_v5(
             if cat not in brand_by_category or not brand_by_category[cat]:
                 continue
             
-            available = [item for item in brand_by_category[cat] if item['id'] not in used_brand_items]
-            if not available:
+            # Выбираем случайный из неиспользованных
+            item = brand_by_category[cat].take_random_unused(rng)
+            if item is None:
                 # Все товары этой категории использованы - пропускаем
                 print(f"  ⚠️ Все товары категории {cat} уже использованы для полной капсулы, пропускаем")
                 continue
             
-            # Выбираем случайный из неиспользованных
-            item = random.choice(available)
             capsule_items.append(item)
             used_brand_items.add(item['id'])
             brand_usage_count[item['id']] += 1
@@ -422,8 +360,8 @@ def mix_brand_items_v5(
             for item_id, count in duplicates[:20]:  # Показываем первые 20
                 # Находим описание товара
                 item_desc = "Неизвестно"
-                for cat_items in brand_by_category.values():
-                    for item in cat_items:
+                for pool in brand_by_category.values():
+                    for item in pool.items:
                         if str(item['id']) == str(item_id):
                             item_desc = item.get('description', 'Нет описания')[:50]
                             break
@@ -0,0 +1,215 @@
+"""
+Канонические ключи кэша /generate-capsules
+
+Раньше ключ был хешем всего запроса (wardrobe, profile, weather целиком), поэтому
+почти никогда не совпадал: поля OpenWeather (dt, main.pressure, visibility, ...)
+меняются каждые несколько минут, а в вещах есть image_url и другие поля, которые
+генератор не читает.
+
+Ключ строится только из того, что влияет на результат:
+- вещи: id, category, description, season (или версия гардероба, если он загружен
+  на бэкенде по telegram_id — см. wardrobe_store.py)
+- профиль: figura, cvetotip
+- погода: температурная зона V6 (capsule_engine_v6.temperature_zone), а не градусы
+- календарный сезон, версия движка и параметры запроса (бренды, исключения, seed)
+
+Любая температура внутри одной зоны дает тот же ключ — капсулы отдаются из кэша
+на всем интервале.
+
+Ответ хранится готовыми сжатыми байтами (hash в Redis: gzip и, если установлен
+brotli, br). Попадание в кэш отдается клиенту как есть, с нужным Content-Encoding —
+без json.loads/jsonify на каждый запрос.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli опционален — тогда храним только gzip
+    brotli = None
+
+# capsules:gz — формат значения: hash {gzip, br} со сжатым JSON ответа
+CAPSULE_CACHE_PREFIX = 'capsules:gz'
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+ALL_ENCODINGS = '*'  # encode_response: все кодировки (ответ идет в кэш)
+
+# Поля вещи, которые читают генераторы (с русскими синонимами из старых записей)
+_ITEM_FIELDS = (
+    ('id', ('id',)),
+    ('category', ('category',)),
+    ('description', ('description', 'описание')),
+    ('season', ('season', 'сезон')),
+)
+
+
+def weather_temperature(weather: Optional[Dict[str, Any]], default: float = 20.0) -> float:
+    """Температура из ответа OpenWeather (main.temp) или упрощенного {'temperature': ...}"""
+    weather = weather or {}
+    temp_c = (weather.get('main') or {}).get('temp') or weather.get('temperature', default)
+    try:
+        return float(temp_c)
+    except (TypeError, ValueError):
+        return default
+
+
+def _weather_description(weather: Optional[Dict[str, Any]]) -> str:
+    weather = weather or {}
+    conditions = weather.get('weather')
+    if isinstance(conditions, list) and conditions:
+        return str((conditions[0] or {}).get('description', ''))
+    return str(weather.get('description', ''))
+
+
+def canonical_item(item: Dict[str, Any]) -> Dict[str, str]:
+    """Проекция вещи на поля, которые читает генератор"""
+    canonical = {}
+    for field, sources in _ITEM_FIELDS:
+        value = next((item.get(src) for src in sources if item.get(src)), '')
+        canonical[field] = str(value).strip()
+    return canonical
+
+
+def canonical_wardrobe(wardrobe: List[Dict[str, Any]], keep_order: bool = False) -> List[Dict[str, str]]:
+    """
+    Вещи в каноническом виде. Порядок важен только для воспроизведения по явному seed,
+    иначе сортируем по id — тот же гардероб в другом порядке дает тот же ключ.
+    """
+    items = [canonical_item(item) for item in wardrobe if isinstance(item, dict)]
+    if not keep_order:
+        items.sort(key=lambda it: (it['id'], it['category'], it['description'], it['season']))
+    return items
+
+
+def capsule_cache_key(
+    *,
+    wardrobe: List[Dict[str, Any]],
+    profile: Dict[str, Any],
+    weather: Dict[str, Any],
+    season: str,
+    engine: str,
+    use_enhanced: bool = True,
+    enable_brand_items: bool = True,
+    exclude_combinations: Optional[List[Any]] = None,
+    seed: Optional[int] = None,
+    wardrobe_fingerprint: Optional[str] = None,
+) -> str:
+    """
+    Ключ кэша капсул: capsules:{движок}:{зона}:{sha256 канонических входов}
+
+    engine — 'gpt' или любой другой (rule). Для rule с use_enhanced=True погода
+    сводится к зоне V6. У базового движка (V2) свои пороги — для него ключ по точной
+    температуре; GPT получает температуру в промпте — для него до градуса.
+
+    wardrobe_fingerprint — версия гардероба, загруженного на бэкенде
+    (wardrobe_store.WardrobeSnapshot.fingerprint): тогда вещи не хешируются.
+    """
+    profile = profile or {}
+    temp_c = weather_temperature(weather)
+
+    if engine == 'gpt':
+        # GPT видит профиль и погоду целиком в промпте
+        engine_tag = 'gpt'
+        zone = str(round(temp_c))
+        extra = {'profile': profile, 'weather_description': _weather_description(weather)}
+    elif use_enhanced:
+        from capsule_engine_v6 import ENGINE_VERSION, temperature_zone
+        engine_tag = ENGINE_VERSION
+        zone = f"z{temperature_zone(temp_c)}"
+        extra = {}
+    else:
+        engine_tag = 'v2'
+        zone = f"{temp_c:g}"
+        extra = {}
+
+    src = {
+        'wardrobe': wardrobe_fingerprint or canonical_wardrobe(wardrobe, keep_order=seed is not None),
+        'figura': str(profile.get('figura') or ''),
+        'cvetotip': str(profile.get('cvetotip') or ''),
+        'season': season,
+        'brands': bool(enable_brand_items),
+        'exclude': sorted(json.dumps(c, ensure_ascii=False, sort_keys=True) for c in (exclude_combinations or [])),
+        'seed': seed,
+        **extra,
+    }
+    digest = hashlib.sha256(json.dumps(src, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{CAPSULE_CACHE_PREFIX}:{engine_tag}:{zone}:{digest}"
+
+
+# ---------- готовый ответ ----------
+
+def encode_response(obj: Dict[str, Any], only: Optional[str] = ALL_ENCODINGS) -> Dict[str, bytes]:
+    """
+    Ответ, сериализованный один раз и сжатый во все поддерживаемые кодировки (для кэша).
+    only — ответ не кэшируется: сжимаем только в кодировку клиента (см. choose_encoding),
+    а при None отдаем тело без сжатия (ключ 'identity').
+    """
+    body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    if only is None:
+        return {'identity': body}
+    variants = {}
+    if only in (ALL_ENCODINGS, 'gzip') or brotli is None:
+        variants['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    if brotli is not None and only in (ALL_ENCODINGS, 'br'):
+        variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Лучшая кодировка из Accept-Encoding клиента (None — клиент не принимает сжатие)"""
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        try:
+            q = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            accepted.add(name.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def response_body(variants: Dict[str, bytes], encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Тело ответа для выбранной кодировки; без сжатия — распаковываем gzip (без разбора JSON)"""
+    if encoding and variants.get(encoding):
+        return variants[encoding], encoding
+    if 'identity' in variants:
+        return variants['identity'], None
+    return gzip.decompress(variants['gzip']), None
+
+
+def store_encoded(client, key: str, variants: Dict[str, bytes], ttl: int) -> None:
+    pipe = client.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=variants)
+    pipe.expire(key, ttl)
+    pipe.execute()
+
+
+def load_encoded(client, key: str, encoding: Optional[str]) -> Optional[Tuple[bytes, Optional[str]]]:
+    """(тело, Content-Encoding) из кэша — одним HGET, без распаковки, если клиент принимает сжатие"""
+    if encoding == 'br':
+        data = client.hget(key, 'br')
+        if data:
+            return data, 'br'
+    data = client.hget(key, 'gzip')
+    if not data:
+        return None
+    if encoding == 'gzip' or encoding == 'br':
+        return data, 'gzip'
+    return gzip.decompress(data), None
+
+
+def load_decoded(client, key: str) -> Optional[Dict[str, Any]]:
+    """Объект ответа из кэша (для ведомых single-flight)"""
+    data = client.hget(key, 'gzip')
+    return json.loads(gzip.decompress(data)) if data else None
@@ -431,9 +431,14 @@ def generate_capsules(
     acc_per_outfit: Tuple[int,int] = (1,2),
     include_outerwear_below: float = 18.0,
     max_total: Optional[int] = None,
-    exclude_combinations: Optional[List[List[str]]] = None
+    exclude_combinations: Optional[List[List[str]]] = None,
+    seed: Optional[int] = None,
+    rng: Optional[random.Random] = None
 ) -> Dict[str, Any]:
 
+    # Свой генератор на запрос (глобальный random общий для потоков воркера)
+    rng = rng or random.Random(seed)
+
     target_style = normalize_style(predpochtenia)
     palette = palette_for_cvetotip(cvetotip)
     ban = set(banned_ids or [])
@@ -471,11 +476,11 @@ def generate_capsules(
         print(f"✅ Обувь найдена: {len(shoes)} пар (без ограничений)")
 
     # Перемешиваем пулы для разнообразия на каждом запросе
-    random.shuffle(shoes)
-    random.shuffle(tops)
-    random.shuffle(bottoms)
-    random.shuffle(dresses)
-    random.shuffle(outer)
+    rng.shuffle(shoes)
+    rng.shuffle(tops)
+    rng.shuffle(bottoms)
+    rng.shuffle(dresses)
+    rng.shuffle(outer)
 
     shoes_q: Deque[Dict[str,Any]] = deque(shoes)
     tops_q: Deque[Dict[str,Any]] = deque(tops)
@@ -543,7 +548,7 @@ def generate_capsules(
     def pick_accessories(k_min: int, k_max: int) -> List[Dict[str,Any]]:
         if not acc_by_type:
             return []
-        target = random.randint(max(0,k_min), max(k_min,k_max))
+        target = rng.randint(max(0,k_min), max(k_min,k_max))
         got: List[Dict[str,Any]] = []
         tries = 0
         while len(got) < target and acc_type_ring and tries < 5 * len(acc_type_ring):
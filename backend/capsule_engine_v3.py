@@ -657,13 +657,16 @@ def generate_capsules_v3(wardrobe_items: List[Dict[str, Any]],
                         body_type: Optional[str] = None,
                         color_type: Optional[str] = None,
                         history: Optional[List[str]] = None,
-                        seed: Optional[int] = None) -> List[Dict[str, Any]]:
+                        seed: Optional[int] = None,
+                        rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
     """
     Основная функция генерации капсул по новому алгоритму
+    
+    Случайность — через rng (свой генератор на запрос, не глобальный random)
     """
     # Инициализация
-    if seed is not None:
-        random.seed(seed)
+    if rng is None:
+        rng = random.Random(seed)
     
     # Прикрепляем свойства к вещам один раз
     attach_props(wardrobe_items)
@@ -714,7 +717,7 @@ def generate_capsules_v3(wardrobe_items: List[Dict[str, Any]],
             break
             
         template_capsules = generate_capsules_for_template(
-            filtered_items, template, template_max, used_combinations, item_usage_count
+            filtered_items, template, template_max, used_combinations, item_usage_count, rng
         )
         capsules.extend(template_capsules)
         
@@ -763,8 +766,10 @@ def generate_capsules_for_template(items: List[Dict[str, Any]],
                                  template: CapsuleTemplate,
                                  max_count: int,
                                  used_combinations: Set[str],
-                                 item_usage_count: Dict[str, int]) -> List[Dict[str, Any]]:
+                                 item_usage_count: Dict[str, int],
+                                 rng: Optional[random.Random] = None) -> List[Dict[str, Any]]:
     """Генерация капсул для конкретного шаблона"""
+    rng = rng or random.Random()
     print(f"🎯 Генерируем капсулы для шаблона: {template.name}")
     
     # Группируем вещи по слотам
@@ -778,7 +783,7 @@ def generate_capsules_for_template(items: List[Dict[str, Any]],
         attempts += 1
         
         # Пробуем создать капсулу
-        capsule = try_create_capsule(items_by_slot, template, used_combinations, item_usage_count)
+        capsule = try_create_capsule(items_by_slot, template, used_combinations, item_usage_count, rng)
         
         if capsule:
             # Проверяем совместимость
@@ -846,8 +851,10 @@ def group_items_by_slots(items: List[Dict[str, Any]]) -> Dict[str, List[Dict[str
 def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]], 
                       template: CapsuleTemplate,
                       used_combinations: Set[str],
-                      item_usage_count: Dict[str, int]) -> Optional[Dict[str, Any]]:
+                      item_usage_count: Dict[str, int],
+                      rng: Optional[random.Random] = None) -> Optional[Dict[str, Any]]:
     """Попытка создания капсулы по шаблону"""
+    rng = rng or random.Random()
     capsule = {}
     
     # Заполняем обязательные слоты
@@ -871,7 +878,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
                     print(f"     ⚠️ Вся обувь использована 3+ раз, игнорируем ограничения и берем подходящую")
                 
                 if available_items:
-                    item = random.choice(available_items)
+                    item = rng.choice(available_items)
                     capsule[slot] = item
                     item_id = item['id']
                     if isinstance(item_id, list):
@@ -896,7 +903,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
                     available_items = items_by_slot[slot]
                     print(f"     ⚠️ Все {slot} использованы, игнорируем ограничения и берем подходящую")
                 
-                item = random.choice(available_items)
+                item = rng.choice(available_items)
                 capsule[slot] = item
                 item_id = norm_id(item)
                 item_usage_count[item_id] = item_usage_count.get(item_id, 0) + 1
@@ -911,7 +918,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
     # Заполняем опциональные слоты
     for slot in template.optional_slots:
         if slot in items_by_slot and items_by_slot[slot]:
-            if random.random() < 0.7:  # 70% вероятность добавить опциональный элемент
+            if rng.random() < 0.7:  # 70% вероятность добавить опциональный элемент
                 # Умные ограничения для аксессуаров
                 if slot == 'accessory':
                     # Аксессуары: максимум 2 использования, но если нет аксессуаров - игнорируем ограничение
@@ -930,7 +937,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
                         print(f"     ⚠️ Все аксессуары использованы 2+ раз, игнорируем ограничения и берем подходящую")
                     
                     if available_items:
-                        item = random.choice(available_items)
+                        item = rng.choice(available_items)
                         capsule[slot] = item
                         item_id = item['id']
                         if isinstance(item_id, list):
@@ -948,7 +955,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
                             available_items.append(item)
                     
                     if available_items:
-                        item = random.choice(available_items)
+                        item = rng.choice(available_items)
                         capsule[slot] = item
                         item_id = item['id']
                         if isinstance(item_id, list):
@@ -958,7 +965,7 @@ def try_create_capsule(items_by_slot: Dict[str, List[Dict[str, Any]]],
                         # Если все вещи использованы, берем подходящую (игнорируем ограничения)
                         available_items = items_by_slot[slot]
                         if available_items:
-                            item = random.choice(available_items)
+                            item = rng.choice(available_items)
                             capsule[slot] = item
                             print(f"     ⚠️ Все {slot} использованы, игнорируем ограничения и берем подходящую")
     
@@ -1005,7 +1012,8 @@ def generate_capsules(wardrobe_items: List[Dict[str, Any]],
                      body_type: Optional[str] = None,
                      color_type: Optional[str] = None,
                      history: Optional[List[str]] = None,
-                     seed: Optional[int] = None) -> Dict[str, Any]:
+                     seed: Optional[int] = None,
+                     rng: Optional[random.Random] = None) -> Dict[str, Any]:
     """
     Главная функция для генерации капсул
     Совместима с существующим API
@@ -1018,7 +1026,8 @@ def generate_capsules(wardrobe_items: List[Dict[str, Any]],
         body_type=body_type,
         color_type=color_type,
         history=history,
-        seed=seed
+        seed=seed,
+        rng=rng
     )
     
     # Преобразуем в формат, ожидаемый app.py
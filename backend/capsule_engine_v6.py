@@ -28,13 +28,41 @@ Capsule Engine V6 - ПОЛНАЯ АДАПТАЦИЯ ПОД ИНСТРУКЦИЮ
 Дата: 2025-10-14 (V6)
 """
 
+import bisect
+import math
 import random
 import time
-from typing import List, Dict, Any, Optional, Set
-from collections import deque, defaultdict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Set, Tuple
+from collections import defaultdict
 from dataclasses import dataclass
 
 
+# Версия правил генерации: менять при любом изменении логики, влияющем на результат
+# (входит в ключ кэша капсул, см. capsule_cache.py)
+ENGINE_VERSION = 'v6.1'
+
+# Все температурные пороги V6: ткани, обувь, аксессуары, сезонность вещей, названия капсул
+# и подмешивание брендов (brand_service_v4/v5 используют те же фильтры и порог 15°C).
+# Внутри интервала между соседними порогами результат генерации не зависит от температуры.
+# Ровно 10°C — отдельная зона: кроссовки/кеды отсекаются при temp_c <= 10, а ткани зоны «свежо» — с 10.
+TEMPERATURE_BREAKPOINTS = (
+    0.0, 5.0, 7.0, 10.0, math.nextafter(10.0, math.inf), 15.0, 20.0, 21.0, 22.0, 23.0, 25.0, 26.0
+)
+
+
+def temperature_zone(temp_c: float) -> int:
+    """Номер температурной зоны V6 (интервалы [порог, следующий порог))"""
+    return bisect.bisect_right(TEMPERATURE_BREAKPOINTS, temp_c)
+
+
+def zone_temperature(zone: int) -> float:
+    """Температура внутри зоны zone (нижняя граница; для самой холодной — на градус ниже первого порога)"""
+    if zone <= 0:
+        return TEMPERATURE_BREAKPOINTS[0] - 1.0
+    return TEMPERATURE_BREAKPOINTS[min(zone, len(TEMPERATURE_BREAKPOINTS)) - 1]
+
+
 @dataclass
 class Capsule:
     id: str
@@ -60,6 +88,7 @@ def tokenize_category(raw: str) -> Set[str]:
     return tokens
 
 
+@lru_cache(maxsize=4096)
 def translate_category(raw: str) -> str:
     """
     Переводит категорию в стандартный формат
@@ -167,13 +196,68 @@ def accessory_subtype(item: Dict[str, Any]) -> str:
 # АНАЛИЗ ТКАНЕЙ ПО ТЕМПЕРАТУРЕ (НОВАЯ ЛОГИКА!)
 # ==========================
 
+# Ключевые слова тканей (порядок = номер бита в маске)
+FABRIC_KEYWORDS = [
+    # Легкие ткани (жаркая погода)
+    ('лен', [' льн', 'льнян', ' льнян']),
+    ('хлопок', ['хлопок', 'хлопч']),
+    ('батист', ['батист']),
+    ('вискоза', ['вискоз']),
+    ('шифон', ['шифон']),
+    ('сетка', ['сетка', 'сеточ']),
+    # Средние ткани (теплая/прохладная погода)
+    ('деним', ['деним', 'джинс']),
+    ('трикотаж', ['трикотаж']),
+    ('фланель', ['фланел']),
+    ('модал', ['модал']),
+    ('твид', ['твид']),
+    ('штапель', ['штапел']),
+    ('вельвет', ['вельвет']),
+    ('джерси', ['джерси']),
+    # Теплые ткани (холодная погода)
+    ('шерсть', ['шерст', 'шерсян']),
+    ('кашемир', ['кашемир']),
+    ('флис', ['флис']),
+    ('стёганка', ['стёган', 'стеган']),
+    ('синтепон', ['синтепон']),
+    ('кожа', ['кожа', 'кожан']),
+    ('драп', ['драп']),
+    ('мех', ['мех', 'меховой', 'меховая']),
+    ('пух', ['пух', 'пуховик']),
+    ('болонья', ['болонь', 'болоня']),
+]
+
+FABRIC_BITS: Dict[str, int] = {name: 1 << i for i, (name, _) in enumerate(FABRIC_KEYWORDS)}
+
+
+def fabric_mask(fabrics: Set[str]) -> int:
+    """Множество тканей → битовая маска"""
+    mask = 0
+    for name in fabrics:
+        mask |= FABRIC_BITS.get(name, 0)
+    return mask
+
+
+def detect_fabric_mask(text: str) -> int:
+    """Битовая маска тканей по тексту (описание + категория в нижнем регистре)"""
+    mask = 0
+    for name, keywords in FABRIC_KEYWORDS:
+        if any(k in text for k in keywords):
+            mask |= FABRIC_BITS[name]
+    return mask
+
+
+def _fabric_text(item: Dict[str, Any]) -> str:
+    return ((item.get('description') or '') + ' ' + (item.get('category') or '')).lower()
+
+
 def detect_fabric(item: Dict[str, Any]) -> Set[str]:
     """
     Определяет ткани вещи из описания
     
     Возвращает множество тканей: {'хлопок', 'лен', 'шерсть', ...}
     """
-    text = (item.get('description', '') + ' ' + item.get('category', '')).lower()
+    text = _fabric_text(item)
     
     # Диагностика для Водолазки и Свитшота
     if 'водолазка' in text:
@@ -187,63 +271,55 @@ def detect_fabric(item: Dict[str, Any]) -> Set[str]:
         print(f"    🔍 СВИТШОТ: поиск 'свитшот' в тексте: {'свитшот' in text}")
         print(f"    🔍 СВИТШОТ: поиск 'свитш' в тексте: {'свитш' in text}")
     
-    fabrics = set()
-    
-    # Легкие ткани (жаркая погода)
-    if any(k in text for k in [' льн', 'льнян', ' льнян']):
-        fabrics.add('лен')
-    if any(k in text for k in ['хлопок', 'хлопч']):
-        fabrics.add('хлопок')
-    if any(k in text for k in ['батист']):
-        fabrics.add('батист')
-    if any(k in text for k in ['вискоз']):
-        fabrics.add('вискоза')
-    if any(k in text for k in ['шифон']):
-        fabrics.add('шифон')
-    if any(k in text for k in ['сетка', 'сеточ']):
-        fabrics.add('сетка')
-    
-    # Средние ткани (теплая/прохладная погода)
-    if any(k in text for k in ['деним', 'джинс']):
-        fabrics.add('деним')
-    if any(k in text for k in ['трикотаж']):
-        fabrics.add('трикотаж')
-    if any(k in text for k in ['фланел']):
-        fabrics.add('фланель')
-    if any(k in text for k in ['модал']):
-        fabrics.add('модал')
-    if any(k in text for k in ['твид']):
-        fabrics.add('твид')
-    if any(k in text for k in ['штапел']):
-        fabrics.add('штапель')
-    if any(k in text for k in ['вельвет']):
-        fabrics.add('вельвет')
-    if any(k in text for k in ['джерси']):
-        fabrics.add('джерси')
-    
-    # Теплые ткани (холодная погода)
-    if any(k in text for k in ['шерст', 'шерсян']):
-        fabrics.add('шерсть')
-    if any(k in text for k in ['кашемир']):
-        fabrics.add('кашемир')
-    if any(k in text for k in ['флис']):
-        fabrics.add('флис')
-    if any(k in text for k in ['стёган', 'стеган']):
-        fabrics.add('стёганка')
-    if any(k in text for k in ['синтепон']):
-        fabrics.add('синтепон')
-    if any(k in text for k in ['кожа', 'кожан']):
-        fabrics.add('кожа')
-    if any(k in text for k in ['драп']):
-        fabrics.add('драп')
-    if any(k in text for k in ['мех', 'меховой', 'меховая']):
-        fabrics.add('мех')
-    if any(k in text for k in ['пух', 'пуховик']):
-        fabrics.add('пух')
-    if any(k in text for k in ['болонь', 'болоня']):
-        fabrics.add('болонья')
-    
-    return fabrics
+    mask = detect_fabric_mask(text)
+    return {name for name, bit in FABRIC_BITS.items() if mask & bit}
+
+
+# Температурные зоны тканей: (нижняя граница °C, разрешенные, запрещенные), по убыванию.
+# Ткань из разрешенных — вещь подходит; иначе ткань из запрещенных — не подходит;
+# иначе (ткань неизвестна / нейтральна) — подходит.
+_FABRIC_ZONES = [
+    # ЖАРКО (≥26°C): ТОЛЬКО легкие дышащие ткани
+    (26.0, {'лен', 'хлопок', 'батист', 'вискоза', 'шифон', 'сетка', 'трикотаж'},
+           {'шерсть', 'кашемир', 'флис', 'мех', 'пух', 'драп'}),
+    # ТЕПЛО (21-25°C): легкие и средние ткани
+    (21.0, {'хлопок', 'вискоза', 'лен', 'деним', 'трикотаж', 'модал'},
+           {'шерсть', 'кашемир', 'флис', 'мех', 'пух', 'драп', 'стёганка'}),
+    # ПРОХЛАДНО (15-20°C): средние ткани (легкая шерсть допустима)
+    (15.0, {'хлопок', 'фланель', 'деним', 'трикотаж', 'штапель', 'модал', 'шифон', 'твид', 'вискоза'},
+           {'мех', 'пух', 'драп', 'стёганка', 'кашемир'}),
+    # СВЕЖО (10-14°C): плотные ткани, легкая шерсть
+    (10.0, {'трикотаж', 'шерсть', 'джерси', 'вельвет', 'стёганка', 'кожа', 'деним'},
+           {'лен', 'батист', 'шифон', 'сетка'}),
+    # ХОЛОДНО (5-9°C): шерсть, кашемир, флис
+    (5.0, {'шерсть', 'кашемир', 'флис', 'хлопок', 'кожа', 'синтепон', 'стёганка'},
+          {'лен', 'батист', 'шифон', 'вискоза', 'сетка'}),
+    # ОЧЕНЬ ХОЛОДНО (0-4°C): шерсть, кашемир, стёганка
+    (0.0, {'шерсть', 'кашемир', 'флис', 'стёганка', 'кожа', 'синтепон', 'болонья'},
+          {'лен', 'батист', 'шифон', 'вискоза', 'хлопок', 'сетка'}),
+    # МОРОЗ (<0°C): только теплые ткани
+    (float('-inf'), {'флис', 'драп', 'мех', 'шерсть', 'кашемир', 'пух', 'болонья', 'стёганка'},
+                    {'лен', 'батист', 'шифон', 'вискоза', 'хлопок', 'деним', 'трикотаж'}),
+]
+_FABRIC_ZONE_MASKS = [(low, fabric_mask(allowed), fabric_mask(blocked)) for low, allowed, blocked in _FABRIC_ZONES]
+
+
+def fabric_zone_masks(temp_c: float) -> Tuple[int, int]:
+    """(разрешенные, запрещенные) маски тканей для температуры"""
+    for low, allowed, blocked in _FABRIC_ZONE_MASKS:
+        if temp_c >= low:
+            return allowed, blocked
+    return 0, 0
+
+
+def is_fabric_mask_suitable_for_temp(mask: int, temp_c: float) -> bool:
+    """То же, что is_fabric_suitable_for_temp, но по битовой маске тканей"""
+    if not mask:
+        return True  # Если ткань не определена - пропускаем (всесезонная)
+    allowed, blocked = fabric_zone_masks(temp_c)
+    if mask & allowed:
+        return True
+    return not (mask & blocked)
 
 
 def is_fabric_suitable_for_temp(fabrics: Set[str], temp_c: float) -> bool:
@@ -259,87 +335,7 @@ def is_fabric_suitable_for_temp(fabrics: Set[str], temp_c: float) -> bool:
     - 0-4°C: шерсть, кашемир, флис, стёганка, кожа с утеплителем
     - <0°C: термофлис, драп, мех, термоткани, шерсть
     """
-    if not fabrics:
-        return True  # Если ткань не определена - пропускаем (всесезонная)
-    
-    # ЖАРКО (≥26°C): ТОЛЬКО легкие дышащие ткани
-    if temp_c >= 26.0:
-        allowed = {'лен', 'хлопок', 'батист', 'вискоза', 'шифон', 'сетка', 'трикотаж'}
-        if fabrics & allowed:
-            return True
-        # Блокируем теплые ткани
-        blocked = {'шерсть', 'кашемир', 'флис', 'мех', 'пух', 'драп'}
-        if fabrics & blocked:
-            return False
-        return True  # Если ткань неизвестна - пропускаем
-    
-    # ТЕПЛО (21-25°C): легкие и средние ткани
-    if 21.0 <= temp_c < 26.0:
-        allowed = {'хлопок', 'вискоза', 'лен', 'деним', 'трикотаж', 'модал'}
-        if fabrics & allowed:
-            return True
-        # Блокируем очень теплые
-        blocked = {'шерсть', 'кашемир', 'флис', 'мех', 'пух', 'драп', 'стёганка'}
-        if fabrics & blocked:
-            return False
-        return True
-    
-    # ПРОХЛАДНО (15-20°C): средние ткани
-    if 15.0 <= temp_c < 21.0:
-        allowed = {'хлопок', 'фланель', 'деним', 'трикотаж', 'штапель', 'модал', 'шифон', 'твид', 'вискоза'}
-        if fabrics & allowed:
-            return True
-        # Блокируем теплые зимние
-        blocked = {'мех', 'пух', 'драп', 'стёганка', 'кашемир'}
-        if fabrics & blocked:
-            return False
-        # Легкая шерсть - допустима
-        return True
-    
-    # СВЕЖО (10-14°C): плотные ткани, легкая шерсть
-    if 10.0 <= temp_c < 15.0:
-        allowed = {'трикотаж', 'шерсть', 'джерси', 'вельвет', 'стёганка', 'кожа', 'деним'}
-        if fabrics & allowed:
-            return True
-        # Блокируем очень легкие
-        blocked = {'лен', 'батист', 'шифон', 'сетка'}
-        if fabrics & blocked:
-            return False
-        return True
-    
-    # ХОЛОДНО (5-9°C): шерсть, кашемир, флис
-    if 5.0 <= temp_c < 10.0:
-        allowed = {'шерсть', 'кашемир', 'флис', 'хлопок', 'кожа', 'синтепон', 'стёганка'}
-        if fabrics & allowed:
-            return True
-        # Блокируем легкие
-        blocked = {'лен', 'батист', 'шифон', 'вискоза', 'сетка'}
-        if fabrics & blocked:
-            return False
-        return True
-    
-    # ОЧЕНЬ ХОЛОДНО (0-4°C): шерсть, кашемир, стёганка
-    if 0.0 <= temp_c < 5.0:
-        allowed = {'шерсть', 'кашемир', 'флис', 'стёганка', 'кожа', 'синтепон', 'болонья'}
-        if fabrics & allowed:
-            return True
-        blocked = {'лен', 'батист', 'шифон', 'вискоза', 'хлопок', 'сетка'}
-        if fabrics & blocked:
-            return False
-        return True
-    
-    # МОРОЗ (<0°C): только теплые ткани
-    if temp_c < 0.0:
-        allowed = {'флис', 'драп', 'мех', 'шерсть', 'кашемир', 'пух', 'болонья', 'стёганка'}
-        if fabrics & allowed:
-            return True
-        # Блокируем ВСЕ легкие
-        blocked = {'лен', 'батист', 'шифон', 'вискоза', 'хлопок', 'деним', 'трикотаж'}
-        if fabrics & blocked:
-            return False
-        return True
-    
-    return True
+    return is_fabric_mask_suitable_for_temp(fabric_mask(fabrics), temp_c)
 
 
 def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season: str) -> bool:
@@ -352,14 +348,35 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
     - Фильтрует шорты и легкие вещи по температуре
     """
     item_cat = translate_category(item.get('category', ''))
+    subtype = accessory_subtype(item) if item_cat == 'accessories' else ''
+    return _is_suitable(item, item_cat, subtype, None, temp_c, season)
+
+
+# Ключевые слова описания для фильтра по погоде (общие с колоночным фильтром brand_columns.py)
+DENIM_WORDS = ('деним', 'джинс', 'denim', 'jeans')
+JACKET_WORDS = ('куртк', 'jacket')
+LIGHT_SHOE_WORDS = ('туфл', 'балетк', 'сандал', 'босоножк', 'шлепк', 'сланц')
+WARM_SHOE_WORDS = ('ботинк', 'сапог', 'полуботинк', 'ботильон')
+CASUAL_SHOE_WORDS = ('кроссовк', 'кеды', 'мокасин', 'лофер')
+COLD_ACCESSORY_SUBTYPES = ('headwear', 'scarf', 'gloves')
+
+
+def _is_suitable(
+    item: Dict[str, Any],
+    item_cat: str,
+    subtype: str,
+    fabrics: Optional[int],
+    temp_c: float,
+    season: str
+) -> bool:
+    """Проверка пригодности по уже вычисленным признакам (fabrics=None — маска тканей считается по запросу)"""
     item_season = (item.get('season') or item.get('сезон') or '').lower()
     desc = (item.get('description') or item.get('описание') or '').lower()
     
     # АКСЕССУАРЫ - фильтруем только по сезону (температурно-нейтральные)
     if item_cat == 'accessories':
-        subtype = accessory_subtype(item)
         # Теплые аксессуары (шапки, шарфы, перчатки) - только для холода
-        if subtype in ['headwear', 'scarf', 'gloves']:
+        if subtype in COLD_ACCESSORY_SUBTYPES:
             return temp_c < 20.0  # Холодные аксессуары только при <20°C
         # Остальные аксессуары - всесезонные, но проверяем явную сезонность
         if item_season:
@@ -383,7 +400,7 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
     # ВЕРХ ИЗ ДЖИНСЫ - только от +15°C (легкий верх)
     if item_cat == 'tops':
         # Проверяем, содержит ли вещь джинсовую ткань (деним, джинс)
-        if any(word in desc for word in ['деним', 'джинс', 'denim', 'jeans']):
+        if any(word in desc for word in DENIM_WORDS):
             if temp_c < 15.0:
                 print(f"  ❌ Верх из джинсы отфильтрован: {desc[:50]} (легкий верх при {temp_c}°C, нужна температура ≥15°C)")
                 return False
@@ -391,7 +408,7 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
     # ДЖИНСОВЫЕ КУРТКИ - только от +15°C (легкая верхняя одежда)
     if item_cat in ['outerwear', 'light_outerwear']:
         # Проверяем, содержит ли вещь джинсовую ткань (деним, джинс) и является ли курткой
-        if any(word in desc for word in ['деним', 'джинс', 'denim', 'jeans']) and any(word in desc for word in ['куртк', 'jacket']):
+        if any(word in desc for word in DENIM_WORDS) and any(word in desc for word in JACKET_WORDS):
             if temp_c < 15.0:
                 print(f"  ❌ Джинсовая куртка отфильтрована: {desc[:50]} (легкая верхняя одежда при {temp_c}°C, нужна температура ≥15°C)")
                 return False
@@ -399,24 +416,21 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
     # ОБУВЬ - специальная проверка по температуре (ПЕРЕД проверкой на всесезонность!)
     if item_cat == 'shoes':
         # Легкая обувь (туфли, балетки, сандалии) - только для тепла
-        light_shoes = ['туфл', 'балетк', 'сандал', 'босоножк', 'шлепк', 'сланц']
-        if any(word in desc for word in light_shoes):
+        if any(word in desc for word in LIGHT_SHOE_WORDS):
             # Туфли/балетки/сандалии - только при ≥15°C
             if temp_c < 15.0:
                 print(f"  ❌ Обувь отфильтрована: {desc[:50]} (легкая обувь при {temp_c}°C)")
                 return False
         
         # Полуботинки, ботинки, сапоги - для прохлады и холода
-        warm_shoes = ['ботинк', 'сапог', 'полуботинк', 'ботильон']
-        if any(word in desc for word in warm_shoes):
+        if any(word in desc for word in WARM_SHOE_WORDS):
             # Ботинки/сапоги - подходят для <20°C
             if temp_c >= 20.0:
                 print(f"  ❌ Обувь отфильтрована: {desc[:50]} (теплая обувь при {temp_c}°C)")
                 return False
         
         # Кроссовки, кеды, мокасины - проверяем по температуре
-        casual_shoes = ['кроссовк', 'кеды', 'мокасин', 'лофер']
-        if any(word in desc for word in casual_shoes):
+        if any(word in desc for word in CASUAL_SHOE_WORDS):
             # Кроссовки/кеды/мокасины - подходят для 10-25°C (включительно)
             # При 10°C они НЕ должны показываться - нужны ботинки/полуботинки
             if temp_c <= 10.0 or temp_c >= 25.0:
@@ -431,8 +445,9 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
         return True
     
     # ТКАНИ - новая логика!
-    fabrics = detect_fabric(item)
-    if not is_fabric_suitable_for_temp(fabrics, temp_c):
+    if fabrics is None:
+        fabrics = fabric_mask(detect_fabric(item))
+    if not is_fabric_mask_suitable_for_temp(fabrics, temp_c):
         return False
     
     # СЕЗОННОСТЬ (логика из продакшена V2)
@@ -463,6 +478,64 @@ def is_suitable_for_temp_and_season(item: Dict[str, Any], temp_c: float, season:
     return False
 
 
+@dataclass
+class ItemFeatures:
+    """Предвычисленные признаки вещи (строки описания разбираются один раз на генерацию)"""
+    item: Dict[str, Any]
+    id: str
+    category: str   # tops, bottoms, dresses, ... (translate_category)
+    subtype: str    # подтип аксессуара (accessory_subtype), '' для остальных
+    fabrics: int    # битовая маска тканей (FABRIC_BITS)
+    suitable: bool  # подходит по температуре и сезону
+
+
+def extract_features(item: Dict[str, Any], temp_c: float, season: str) -> ItemFeatures:
+    """Один проход по вещи: категория, подтип, ткани и пригодность по погоде"""
+    item_cat = translate_category(item.get('category', ''))
+    subtype = accessory_subtype(item) if item_cat == 'accessories' else ''
+    fabrics = detect_fabric_mask(_fabric_text(item))
+    return ItemFeatures(
+        item=item,
+        id=str(item.get('id')),
+        category=item_cat,
+        subtype=subtype,
+        fabrics=fabrics,
+        suitable=_is_suitable(item, item_cat, subtype, fabrics, temp_c, season)
+    )
+
+
+class UnusedPool:
+    """
+    Неиспользованные вещи одной категории: случайный выбор и удаление за O(1)
+    
+    Список + индекс id → позиция; при использовании вещь меняется местами
+    с последней и удаляется (swap-remove).
+    """
+
+    def __init__(self, items: List[ItemFeatures]):
+        self._items: List[ItemFeatures] = []
+        self._pos: Dict[str, int] = {}
+        for it in items:
+            if it.id not in self._pos:
+                self._pos[it.id] = len(self._items)
+                self._items.append(it)
+        self.size = len(self._items)  # сколько вещей категории было в гардеробе
+
+    def sample(self, rng: random.Random) -> Optional[ItemFeatures]:
+        if not self._items:
+            return None
+        return self._items[rng.randrange(len(self._items))]
+
+    def remove(self, item_id: str) -> None:
+        idx = self._pos.pop(item_id, None)
+        if idx is None:
+            return
+        last = self._items.pop()
+        if idx < len(self._items):
+            self._items[idx] = last
+            self._pos[last.id] = idx
+
+
 # ==========================
 # ОСНОВНОЙ ГЕНЕРАТОР
 # ==========================
@@ -477,7 +550,9 @@ def generate_capsules(
     banned_ids: Optional[List[str]] = None,
     allowed_ids: Optional[List[str]] = None,
     max_total: int = 20,
-    exclude_combinations: Optional[List[List[str]]] = None
+    exclude_combinations: Optional[List[List[str]]] = None,
+    seed: Optional[int] = None,
+    rng: Optional[random.Random] = None
 ) -> Dict[str, Any]:
     """
     Генерирует капсулы с НОВОЙ ЛОГИКОЙ V6
@@ -487,6 +562,10 @@ def generate_capsules(
     - Циклическое использование вещей (БЕЗ лимита)
     - Строгая валидация капсул
     - Правильная обувь и головные уборы по температуре
+    
+    Случайность — только через rng (свой генератор на запрос). Если не передан,
+    создается из seed (или из текущего времени); одинаковые seed и входные
+    данные дают одинаковый результат.
     """
     
     print("=" * 80)
@@ -503,30 +582,35 @@ def generate_capsules(
     is_warm = 21.0 <= temp_c < 26.0       # 21-25°C - тепло
     is_hot = temp_c >= 26.0               # ≥26°C - жарко
     
+    # Признаки вещей считаем один раз, дальше работаем только с ними
+    banned = set(banned_ids or [])
+    allowed = set(allowed_ids) if allowed_ids else None
+    features_by_id: Dict[str, ItemFeatures] = {}
+    
     # Фильтрация + группировка
-    by_category: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    by_category: Dict[str, List[ItemFeatures]] = defaultdict(list)
     filtered_out = defaultdict(list)
     
     for item in wardrobe_items:
         iid = str(item.get('id'))
-        if banned_ids and iid in banned_ids:
+        if iid in banned:
             continue
-        if allowed_ids and iid not in allowed_ids:
+        if allowed is not None and iid not in allowed:
             continue
         
-        item_cat = translate_category(item.get('category', ''))
+        feat = extract_features(item, temp_c, season_hint)
+        features_by_id.setdefault(feat.id, feat)
         
-        if not is_suitable_for_temp_and_season(item, temp_c, season_hint):
-            filtered_out[item_cat].append(item.get('description', 'no desc')[:30])
+        if not feat.suitable:
+            filtered_out[feat.category].append(item.get('description', 'no desc')[:30])
             continue
         
-        by_category[item_cat].append(item)
+        by_category[feat.category].append(feat)
     
     # Группируем аксессуары по подтипам
-    accessories_by_subtype = defaultdict(list)
+    accessories_by_subtype: Dict[str, List[ItemFeatures]] = defaultdict(list)
     for acc in by_category['accessories']:
-        subtype = accessory_subtype(acc)
-        accessories_by_subtype[subtype].append(acc)
+        accessories_by_subtype[acc.subtype].append(acc)
     
     # Статистика
     print(f"📊 Категории: tops={len(by_category['tops'])}, bottoms={len(by_category['bottoms'])}, "
@@ -542,38 +626,45 @@ def generate_capsules(
             if items:
                 print(f"   - {cat}: {len(items)} шт. (примеры: {', '.join(items[:3])})")
     
-    # Устанавливаем seed для рандомизации на основе времени
-    # Это обеспечивает разнообразие при каждой генерации
-    random.seed(int(time.time() * 1000) % (2**32))  # Используем миллисекунды для уникальности
+    # Свой генератор на запрос: глобальный random общий для потоков воркера.
+    # Без seed — миллисекунды, чтобы каждая генерация была разной
+    if rng is None:
+        if seed is None:
+            seed = int(time.time() * 1000) % (2**32)
+        rng = random.Random(seed)
     
-    # Перемешиваем для разнообразия (теперь с уникальным seed)
+    # Перемешиваем для разнообразия
     for key in ['tops', 'bottoms', 'dresses', 'outerwear', 'light_outerwear', 'shoes', 'bags']:
-        random.shuffle(by_category[key])
+        rng.shuffle(by_category[key])
     
     # Дополнительное перемешивание аксессуаров
     for subtype, items in accessories_by_subtype.items():
-        random.shuffle(items)
-    
-    # Создаем очереди
-    tops_q = deque(by_category['tops'])
-    bottoms_q = deque(by_category['bottoms'])
-    dresses_q = deque(by_category['dresses'])
-    outer_q = deque(by_category['outerwear'])
-    light_q = deque(by_category['light_outerwear'])
-    shoes_q = deque(by_category['shoes'])
-    bags_q = deque(by_category['bags'])
-    
-    # Очереди аксессуаров
-    earrings_q = deque(accessories_by_subtype.get('earrings', []))
-    necklace_q = deque(accessories_by_subtype.get('necklace', []))
-    belt_q = deque(accessories_by_subtype.get('belt', []))
-    bracelet_q = deque(accessories_by_subtype.get('bracelet', []))
-    ring_q = deque(accessories_by_subtype.get('ring', []))
-    scarf_q = deque(accessories_by_subtype.get('scarf', []))
-    headwear_q = deque(accessories_by_subtype.get('headwear', []))
-    gloves_q = deque(accessories_by_subtype.get('gloves', []))
-    watch_q = deque(accessories_by_subtype.get('watch', []))
-    sunglasses_q = deque(accessories_by_subtype.get('sunglasses', []))
+        rng.shuffle(items)
+    
+    # Пулы неиспользованных вещей по категориям
+    pools = {
+        key: UnusedPool(by_category[key])
+        for key in ['tops', 'bottoms', 'dresses', 'outerwear', 'light_outerwear', 'shoes', 'bags']
+    }
+    tops_q = pools['tops']
+    bottoms_q = pools['bottoms']
+    dresses_q = pools['dresses']
+    outer_q = pools['outerwear']
+    light_q = pools['light_outerwear']
+    shoes_q = pools['shoes']
+    bags_q = pools['bags']
+    
+    # Аксессуары (без ограничения на повтор — достаточно списков)
+    earrings_q = accessories_by_subtype.get('earrings', [])
+    necklace_q = accessories_by_subtype.get('necklace', [])
+    belt_q = accessories_by_subtype.get('belt', [])
+    bracelet_q = accessories_by_subtype.get('bracelet', [])
+    ring_q = accessories_by_subtype.get('ring', [])
+    scarf_q = accessories_by_subtype.get('scarf', [])
+    headwear_q = accessories_by_subtype.get('headwear', [])
+    gloves_q = accessories_by_subtype.get('gloves', [])
+    watch_q = accessories_by_subtype.get('watch', [])
+    sunglasses_q = accessories_by_subtype.get('sunglasses', [])
     
     # Трекинг использования (ОГРАНИЧЕНО ДО 1 РАЗА!)
     used_items = set()  # Множество использованных ID вещей
@@ -588,76 +679,58 @@ def generate_capsules(
         print(f"  🚫 Исключено {len(exclude_combinations)} уже показанных комбинаций")
     
     # Вспомогательные функции
-    def mark_used(item: Dict[str, Any]) -> None:
+    def mark_used(item: ItemFeatures) -> None:
         """Помечает вещь как использованную (только 1 раз!)"""
-        used_items.add(str(item['id']))
+        used_items.add(item.id)
+        pool = pools.get(item.category)
+        if pool is not None:
+            pool.remove(item.id)
     
-    def pick_from_queue(q: deque) -> Optional[Dict[str, Any]]:
+    def pick_from_queue(pool: UnusedPool) -> Optional[ItemFeatures]:
         """
-        Выбор вещи из очереди с ограничением: каждая вещь используется ТОЛЬКО 1 РАЗ
+        Выбор вещи из пула с ограничением: каждая вещь используется ТОЛЬКО 1 РАЗ
         С РАНДОМИЗАЦИЕЙ для разнообразия
         """
-        if not q:
-            return None
-        
-        # Собираем все НЕ использованные вещи
-        unused_candidates = []
-        
-        for _ in range(len(q)):
-            it = q.popleft()
-            item_id = str(it['id'])
-            
-            # Если вещь еще не использовалась - добавляем в кандидаты
-            if item_id not in used_items:
-                unused_candidates.append(it)
-            
-            q.append(it)
-        
-        if not unused_candidates:
-            return None  # Все вещи уже использованы
-        
-        # Выбираем случайную из неиспользованных для разнообразия
-        selected = random.choice(unused_candidates)
-        return selected
-    
-    def pick_accessory_from_queue(q: deque) -> Optional[Dict[str, Any]]:
+        while True:
+            selected = pool.sample(rng)
+            if selected is None:
+                return None  # Все вещи уже использованы
+            if selected.id not in used_items:
+                return selected
+            # Тот же id встретился в другой категории и уже использован
+            pool.remove(selected.id)
+    
+    def pick_accessory_from_queue(q: List[ItemFeatures]) -> Optional[ItemFeatures]:
         """
-        Выбор аксессуара из очереди БЕЗ ограничения на повторное использование
+        Выбор аксессуара БЕЗ ограничения на повторное использование
         Аксессуары могут использоваться многократно для более живых капсул
         """
         if not q:
             return None
-        
-        # Просто выбираем случайный аксессуар из очереди (можно повторно использовать)
-        all_items = list(q)
-        if not all_items:
-            return None
-        
-        selected = random.choice(all_items)
-        return selected
+        return rng.choice(q)
     
-    def get_capsule_key(items: List[Dict[str, Any]]) -> str:
-        return '_'.join(sorted(str(i['id']) for i in items))
+    def get_capsule_key(items: List[ItemFeatures]) -> str:
+        return '_'.join(sorted(i.id for i in items))
     
-    def pick_accessories_warm() -> List[Dict[str, Any]]:
+    def pick_accessories_warm() -> List[ItemFeatures]:
         """Теплая погода: серьги/бусы + ремень/браслет + опции"""
         acc = []
         x = pick_accessory_from_queue(earrings_q) or pick_accessory_from_queue(necklace_q)
         if x: acc.append(x)
         y = pick_accessory_from_queue(belt_q) or pick_accessory_from_queue(bracelet_q)
         if y: acc.append(y)
-        if watch_q and random.random() < 0.7:
+        if watch_q and rng.random() < 0.7:
             z = pick_accessory_from_queue(watch_q)
             if z: acc.append(z)
-        if sunglasses_q and random.random() < 0.4:
+        if sunglasses_q and rng.random() < 0.4:
             z = pick_accessory_from_queue(sunglasses_q)
             if z: acc.append(z)
-        if ring_q and random.random() < 0.2:
+        if ring_q and rng.random() < 0.2:
             z = pick_accessory_from_queue(ring_q)
             if z: acc.append(z)
         return acc
     
-    def pick_accessories_cold() -> List[Dict[str, Any]]:
+    def pick_accessories_cold() -> List[ItemFeatures]:
         """Холодная погода: шапка + шарф + перчатки + макс серьги"""
         acc = []
         h = pick_accessory_from_queue(headwear_q)
@@ -666,19 +739,19 @@ def generate_capsules(
         if h: acc.append(h)
         if s: acc.append(s)
         if g: acc.append(g)
-        if earrings_q and random.random() < 0.7:
+        if earrings_q and rng.random() < 0.7:
             e = pick_accessory_from_queue(earrings_q)
             if e: acc.append(e)
         return acc
     
-    def build_capsule(items: List[Dict[str, Any]]) -> Optional[Capsule]:
+    def build_capsule(items: List[ItemFeatures]) -> Optional[Capsule]:
         """Строит капсулу со СТРОГОЙ валидацией"""
         key = get_capsule_key(items)
         if key in produced_keys:
             return None
         
         # СТРОГАЯ ВАЛИДАЦИЯ: проверяем обязательные элементы
-        cats = [translate_category(i.get('category', '')) for i in items]
+        cats = [i.category for i in items]
         
         # Обязательно: обувь
         if 'shoes' not in cats:
@@ -693,11 +766,11 @@ def generate_capsules(
             return None
         
         # Обязательно: сумка (если есть хоть одна в гардеробе)
-        if bags_q and 'bags' not in cats:
+        if bags_q.size and 'bags' not in cats:
             return None
         
         # ВАЛИДАЦИЯ АКСЕССУАРОВ по температуре
-        acc_subtypes = [accessory_subtype(i) for i in items if translate_category(i.get('category', '')) == 'accessories']
+        acc_subtypes = [i.subtype for i in items if i.category == 'accessories']
         
         if is_cool:  # 15-20°C: ОБЯЗАТЕЛЬНО кардиган + аксессуары
             # Обязательно: кардиган/пиджак при прохладе
@@ -711,16 +784,15 @@ def generate_capsules(
         # Помечаем все вещи (кроме аксессуаров - они могут повторяться)
         for it in items:
             # Аксессуары не помечаем как использованные, чтобы они могли использоваться повторно
-            item_cat = translate_category(it.get('category', ''))
-            if item_cat != 'accessories':
+            if it.category != 'accessories':
                 mark_used(it)
         
         produced_keys.add(key)
         
         # Название
-        has_dress = any(translate_category(i.get('category', '')) == 'dresses' for i in items)
-        has_outer = any(translate_category(i.get('category', '')) == 'outerwear' for i in items)
-        has_light = any(translate_category(i.get('category', '')) == 'light_outerwear' for i in items)
+        has_dress = 'dresses' in cats
+        has_outer = 'outerwear' in cats
+        has_light = 'light_outerwear' in cats
         
         if has_dress:
             if has_outer:
@@ -742,11 +814,11 @@ def generate_capsules(
         else:
             name = "Повседневный сет"
         
-        desc = f"{len(items)} вещей: " + ", ".join([i.get('category', 'вещь') for i in items[:4]])
+        desc = f"{len(items)} вещей: " + ", ".join([i.item.get('category', 'вещь') for i in items[:4]])
         if len(items) > 4:
             desc += f" + еще {len(items) - 4}"
         
-        return Capsule(id=f"c{len(capsules)+1}", name=name, items=[str(i['id']) for i in items], description=desc)
+        return Capsule(id=f"c{len(capsules)+1}", name=name, items=[i.id for i in items], description=desc)
     
     # ==========================
     # ГЕНЕРАЦИЯ КАПСУЛ
@@ -756,9 +828,9 @@ def generate_capsules(
     iteration = 0
     
     # СТРАТЕГИЯ 1: Капсулы с платьями
-    if dresses_q:
+    if dresses_q.size:
         print(f"   👗 Генерируем капсулы с платьями...")
-        for _ in range(len(dresses_q) * 3):  # Больше попыток
+        for _ in range(dresses_q.size * 3):  # Больше попыток
             if len(capsules) >= max_total:
                 break
             if iteration >= max_iterations:
@@ -790,7 +862,7 @@ def generate_capsules(
                 items.append(outer)
                 
                 # Многослойность (30% chance)
-                if light_q and random.random() < 0.3:
+                if light_q.size and rng.random() < 0.3:
                     lo = pick_from_queue(light_q)
                     if lo: items.append(lo)
                 
@@ -801,7 +873,7 @@ def generate_capsules(
                 light_outer = pick_from_queue(light_q)
                 if light_outer:
                     items.append(light_outer)
-                elif outer_q and random.random() < 0.3:  # Fallback на outerwear
+                elif outer_q.size and rng.random() < 0.3:  # Fallback на outerwear
                     outer = pick_from_queue(outer_q)
                     if outer: items.append(outer)
                 
@@ -809,7 +881,7 @@ def generate_capsules(
             
             elif is_warm:
                 # ТЕПЛО (21-25°C): легкая верхняя одежда опционально (40%)
-                if light_q and random.random() < 0.4:
+                if light_q.size and rng.random() < 0.4:
                     lo = pick_from_queue(light_q)
                     if lo: items.append(lo)
                 
@@ -817,7 +889,7 @@ def generate_capsules(
             
             else:  # is_hot
                 # ЖАРКО (≥26°C): БЕЗ верхней одежды (редко 10%)
-                if light_q and random.random() < 0.1:
+                if light_q.size and rng.random() < 0.1:
                     lo = pick_from_queue(light_q)
                     if lo: items.append(lo)
                 
@@ -842,7 +914,7 @@ def generate_capsules(
             break
         
         # ВАЖНО: top не должен быть light_outerwear!
-        if translate_category(top.get('category', '')) == 'light_outerwear':
+        if top.category == 'light_outerwear':
             continue
         
         bottom = pick_from_queue(bottoms_q)
@@ -868,7 +940,7 @@ def generate_capsules(
             items.append(outer)
             
             # Многослойность под верхнюю одежду (30%)
-            if light_q and random.random() < 0.3:
+            if light_q.size and rng.random() < 0.3:
                 lo = pick_from_queue(light_q)
                 if lo: items.append(lo)
             
@@ -879,7 +951,7 @@ def generate_capsules(
             light_outer = pick_from_queue(light_q)
             if light_outer:
                 items.append(light_outer)
-            elif outer_q and random.random() < 0.3:
+            elif outer_q.size and rng.random() < 0.3:
                 outer = pick_from_queue(outer_q)
                 if outer: items.append(outer)
             
@@ -887,7 +959,7 @@ def generate_capsules(
         
         elif is_warm:
             # ТЕПЛО (21-25°C): легкая многослойность (40%)
-            if light_q and random.random() < 0.4:
+            if light_q.size and rng.random() < 0.4:
                 lo = pick_from_queue(light_q)
                 if lo: items.append(lo)
             
@@ -895,7 +967,7 @@ def generate_capsules(
         
         else:  # is_hot
             # ЖАРКО (≥26°C): минимум слоев (10%)
-            if light_q and random.random() < 0.1:
+            if light_q.size and rng.random() < 0.1:
                 lo = pick_from_queue(light_q)
                 if lo: items.append(lo)
             
@@ -910,17 +982,15 @@ def generate_capsules(
     for i, cap in enumerate(capsules[:3], 1):
         items_desc = []
         for item_id in cap.items:
-            for item in wardrobe_items:
-                if str(item['id']) == item_id:
-                    cat = translate_category(item.get('category', ''))
-                    if cat == 'accessories':
-                        subtype = accessory_subtype(item)
-                        items_desc.append(f"{cat}({subtype})")
-                    elif cat == 'light_outerwear':
-                        items_desc.append(f"light_outer({item.get('description', '')[:15]})")
-                    else:
-                        items_desc.append(cat)
-                    break
+            feat = features_by_id.get(item_id)
+            if feat is None:
+                continue
+            if feat.category == 'accessories':
+                items_desc.append(f"{feat.category}({feat.subtype})")
+            elif feat.category == 'light_outerwear':
+                items_desc.append(f"light_outer({feat.item.get('description', '')[:15]})")
+            else:
+                items_desc.append(feat.category)
         print(f"   {i}. {cap.name}: {', '.join(items_desc)}")
     
     print(f"✅ Сгенерировано капсул: {len(capsules)}")
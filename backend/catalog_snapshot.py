@@ -0,0 +1,183 @@
+"""
+Снимки каталога на локальном диске, общие для воркеров gunicorn
+
+Каждый из GUNICORN_WORKERS воркеров держал свою копию каталога брендов и
+поискового индекса, а новый воркер начинал с пустого каталога (запрос в API).
+Теперь один процесс хоста — писатель (держит flock на CATALOG_SNAPSHOT_DIR/.writer;
+при смерти процесса лок освобождается, и писателем становится следующий) —
+после загрузки записывает снимок:
+- колонки каталога (brand_columns.CatalogColumns) и маски пригодности по всем
+  температурным зонам — файлами .npy; остальные воркеры открывают их через
+  np.load(mmap_mode='r'), страницы общие в page cache
+- товары — JSON (словари Python у каждого воркера свои)
+
+Запись атомарная: версия пишется во временный каталог, переименовывается,
+затем заменяется указатель CURRENT (os.replace). Старые версии удаляются
+(открытые mmap остаются валидными до закрытия).
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from config import Config
+
+SNAPSHOT_FORMAT = 1
+_CURRENT = 'CURRENT'
+_WRITER_LOCK = '.writer'
+_KEEP_VERSIONS = 2
+
+
+@dataclass
+class Snapshot:
+    """Прочитанный снимок: метаданные и доступ к файлам версии"""
+    name: str
+    version: str
+    path: str
+    meta: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def written_at(self) -> float:
+        return float(self.meta.get('written_at', 0))
+
+    def age(self) -> float:
+        return time.time() - self.written_at
+
+    def array(self, key: str) -> np.ndarray:
+        """Массив только для чтения, отображенный в память (общий для процессов)"""
+        return np.load(os.path.join(self.path, f'{key}.npy'), mmap_mode='r')
+
+    def json(self, key: str) -> Any:
+        with open(os.path.join(self.path, f'{key}.json'), 'rb') as f:
+            return json.loads(f.read())
+
+
+class SnapshotStore:
+    """Каталог снимков на диске: запись одним писателем, чтение всеми воркерами"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._writer_fd: Optional[int] = None
+        self._writer_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stats = {'writes': 0, 'reads': 0, 'write_errors': 0}
+
+    # ---------- писатель ----------
+
+    def is_writer(self) -> bool:
+        """Этот процесс пишет снимки (первый, кто взял flock; держит его до выхода)"""
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return True
+        with self._lock:
+            if self._writer_pid == pid:
+                return True
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                fd = os.open(os.path.join(self.root, _WRITER_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                print(f"⚠️ Снимки каталога: {self.root} недоступен: {e}")
+                return False
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._writer_fd, self._writer_pid = fd, pid
+            print(f"📝 Снимки каталога: процесс {pid} — писатель ({self.root})")
+            return True
+
+    def write(self, name: str, arrays: Dict[str, np.ndarray], documents: Dict[str, Any], meta: Dict[str, Any]) -> Optional[str]:
+        """Атомарно публикует новую версию снимка name; возвращает версию (None — не записан)"""
+        if not self.is_writer():
+            return None
+        base = self._dir(name)
+        version = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        tmp = os.path.join(base, f'.tmp-{version}')
+        try:
+            os.makedirs(tmp)
+            for key, array in arrays.items():
+                np.save(os.path.join(tmp, f'{key}.npy'), np.ascontiguousarray(array))
+            for key, document in documents.items():
+                with open(os.path.join(tmp, f'{key}.json'), 'w', encoding='utf-8') as f:
+                    json.dump(document, f, ensure_ascii=False)
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({**meta, 'format': SNAPSHOT_FORMAT, 'written_at': time.time()}, f)
+            os.rename(tmp, os.path.join(base, version))
+
+            pointer = os.path.join(base, f'.{_CURRENT}-{version}')
+            with open(pointer, 'w') as f:
+                f.write(version)
+            os.replace(pointer, os.path.join(base, _CURRENT))
+        except Exception as e:
+            self._stats['write_errors'] += 1
+            print(f"⚠️ Снимок {name} не записан: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return None
+        self._stats['writes'] += 1
+        self._cleanup(base, keep=version)
+        return version
+
+    def _cleanup(self, base: str, keep: str) -> None:
+        versions = sorted(v for v in os.listdir(base) if not v.startswith('.') and v != _CURRENT)
+        for version in versions[:-_KEEP_VERSIONS]:
+            if version != keep:
+                shutil.rmtree(os.path.join(base, version), ignore_errors=True)
+
+    # ---------- читатели ----------
+
+    def current_version(self, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._dir(name), _CURRENT)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def read(self, name: str, newer_than: Optional[str] = None) -> Optional[Snapshot]:
+        """Текущий снимок name (None — нет, не новее newer_than или другого формата)"""
+        version = self.current_version(name)
+        if version is None or version == newer_than:
+            return None
+        path = os.path.join(self._dir(name), version)
+        try:
+            with open(os.path.join(path, 'meta.json'), 'rb') as f:
+                meta = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            return None
+        self._stats['reads'] += 1
+        return Snapshot(name=name, version=version, path=path, meta=meta)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'root': self.root, 'writer': self._writer_pid == os.getpid()}
+
+    def _dir(self, name: str) -> str:
+        # Имена снимков бывают русскими (сезоны) — в имени каталога только hex
+        path = os.path.join(self.root, name.encode('utf-8').hex())
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store() -> Optional[SnapshotStore]:
+    """Общее хранилище снимков (None — CATALOG_SNAPSHOT_DIR не задан)"""
+    global _store
+    if not Config.CATALOG_SNAPSHOT_DIR:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore(Config.CATALOG_SNAPSHOT_DIR)
+    return _store
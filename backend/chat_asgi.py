@@ -0,0 +1,428 @@
+"""
+Асинхронный чат со стилистом (ASGI, uvicorn)
+
+Синхронный /chat-style в app.py держит поток gthread-воркера на все время
+разговора (5–30 с): поток OpenAI читается блокирующе, инструменты выполняются
+по очереди, а обработка фото ожидается через time.sleep.
+
+Здесь тот же API (/chat-style и /chat-style/history) на asyncio:
+- один процесс uvicorn обслуживает сотни SSE-потоков одновременно
+- инструменты одного requires_action выполняются параллельно (asyncio.gather);
+  синхронные Supabase/HTTP-вызовы уходят в пул потоков
+- ожидание обработки фото в OpenAI не занимает поток
+- запросы к OpenAI проходят ту же очередь по приоритету и учет лимитов
+  RPM/TPM, что и в app.py (openai_client.py, aslot): остаток лимитов берется
+  из заголовков x-ratelimit-* ответов
+- остальные вызовы OpenAI (threads, runs, files) идут под предохранителем
+  (resilience.py): при недоступном OpenAI чат сразу отвечает 503
+
+Процесс запускается из мастера gunicorn (см. gunicorn.conf.py), nginx/traefik
+проксируют /chat-style на CHAT_ASGI_PORT.
+"""
+
+import asyncio
+import base64
+import io
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from config import Config
+from openai_client import PRIORITY_CHAT, estimate_tokens, get_openai_scheduler
+from resilience import OPENAI, DependencyUnavailable, get_dependency, guard, is_failure
+from chat_service import (
+    CHAT_ASSISTANT_ID, TEXT_BATCH_DELAY, TEXT_MIN_BATCH_SIZE, ToolCallContext,
+    extract_text_delta, format_history_messages, handle_tool_call,
+    parse_tool_call, prepare_chat_image, sse_event, tool_timeout_result
+)
+
+load_dotenv()
+
+_client: Optional[openai.AsyncOpenAI] = None
+
+
+def get_openai_client() -> Optional[openai.AsyncOpenAI]:
+    """Один асинхронный клиент на процесс (общий пул HTTP-соединений)"""
+    global _client
+    if _client is None:
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            return None
+        _client = openai.AsyncOpenAI(
+            api_key=api_key,
+            timeout=Config.OPENAI_TIMEOUT,
+            max_retries=Config.OPENAI_MAX_RETRIES
+        )
+    return _client
+
+
+async def _raw_call(method, **kwargs):
+    """Вызов через with_raw_response: лимиты из заголовков ответа попадают в очередь запросов"""
+    raw = await method(**kwargs)
+    get_openai_scheduler().update_from_headers(raw.headers)
+    return raw.parse()
+
+
+def _track_stream(stream):
+    """Лимиты из заголовков ответа, открывшего поток событий run"""
+    response = getattr(stream, 'response', None)
+    if response is not None:
+        get_openai_scheduler().update_from_headers(response.headers)
+    return stream
+
+
+def _unavailable_response(error: Optional[DependencyUnavailable] = None) -> Response:
+    """503 без ожидания: OpenAI недоступен (предохранитель открыт) или очередь переполнена"""
+    retry_in = int(getattr(error, 'retry_in', 0) or 0) or 5
+    return JSONResponse(
+        {'error': 'Стилист временно недоступен, попробуйте через минуту'},
+        status_code=503,
+        headers={'Retry-After': str(retry_in)}
+    )
+
+
+async def _read_request(request: Request) -> Dict[str, Any]:
+    """Поля запроса: multipart/form-data или JSON (как в Flask-версии)"""
+    content_type = request.headers.get('content-type', '')
+    if 'multipart/form-data' in content_type or 'application/x-www-form-urlencoded' in content_type:
+        form = await request.form()
+        return dict(form)
+    try:
+        return await request.json() or {}
+    except Exception:
+        return {}
+
+
+async def _read_image(upload) -> Optional[str]:
+    """Фото из формы → base64 JPEG (обработка Pillow — в пуле потоков)"""
+    if upload is None or isinstance(upload, str) or not getattr(upload, 'filename', None):
+        return None
+    data = await upload.read()
+    return await asyncio.to_thread(prepare_chat_image, io.BytesIO(data), upload.filename)
+
+
+async def _prepare_thread(client: openai.AsyncOpenAI, thread_id: Optional[str]) -> str:
+    """Создает thread или отменяет активные runs в существующем"""
+    if not thread_id:
+        with guard(OPENAI):
+            return (await client.beta.threads.create()).id
+    try:
+        with guard(OPENAI):
+            await client.beta.threads.retrieve(thread_id)
+            runs = await client.beta.threads.runs.list(thread_id=thread_id, limit=1)
+        active_runs = [run for run in runs.data if run.status in ['queued', 'in_progress', 'requires_action']]
+        if active_runs:
+            print(f"⚠️ Найден активный run {active_runs[0].id}, отменяем...")
+            results = await asyncio.gather(
+                *(client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id) for run in active_runs),
+                return_exceptions=True
+            )
+            for run, result in zip(active_runs, results):
+                if isinstance(result, Exception):
+                    print(f"⚠️ Не удалось отменить run {run.id}: {result}")
+            # Ждем немного, чтобы отмена применилась
+            await asyncio.sleep(0.5)
+        return thread_id
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        print(f"⚠️ Ошибка при проверке thread: {e}")
+        # Если thread не существует, создаем новый
+        with guard(OPENAI):
+            return (await client.beta.threads.create()).id
+
+
+async def _wait_file_processed(client: openai.AsyncOpenAI, file_id: str, timeout: float) -> bool:
+    """Ожидание обработки файла в OpenAI: опрос с растущим интервалом, без блокировки потока"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.1
+    while True:
+        with guard(OPENAI):
+            file_status = await client.files.retrieve(file_id)
+        if file_status.status == 'processed':
+            print(f"✅ Файл обработан OpenAI, статус: {file_status.status}")
+            return True
+        if file_status.status == 'error':
+            print(f"⚠️ OpenAI не смог обработать файл {file_id}")
+            return False
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            print(f"⚠️ Файл не обработан за {timeout} секунд, продолжаем...")
+            return False
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 1.0)
+
+
+async def _upload_image(client: openai.AsyncOpenAI, image_base64: str) -> Optional[str]:
+    """Загружает фото в OpenAI Files API; возвращает file_id (None — продолжаем без фото)"""
+    try:
+        temp_file = io.BytesIO(base64.b64decode(image_base64))
+        temp_file.name = "image.jpg"  # Нужно для Files API
+        with guard(OPENAI):
+            file_response = await client.files.create(file=temp_file, purpose="assistants")
+        await _wait_file_processed(client, file_response.id, Config.CHAT_FILE_WAIT_TIMEOUT)
+        print(f"✅ Изображение загружено в OpenAI, file_id: {file_response.id}")
+        return file_response.id
+    except DependencyUnavailable:
+        raise
+    except Exception as e:
+        print(f"⚠️ Ошибка загрузки изображения в OpenAI: {e}")
+        return None
+
+
+async def _run_tools(tool_calls, telegram_id: str, client) -> List[Dict[str, str]]:
+    """Выполняет все инструменты одного requires_action параллельно (таймаут на каждый)"""
+    context = ToolCallContext(telegram_id)
+    timeout = Config.CHAT_TOOL_TIMEOUT
+
+    async def run_one(tool_call) -> Dict[str, str]:
+        tool_name, tool_args = parse_tool_call(tool_call)
+        print(f"   🔨 Инструмент: {tool_name}, аргументы: {tool_args}", flush=True)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.to_thread(handle_tool_call, tool_name, tool_args, telegram_id, client, context),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            result = tool_timeout_result(tool_name, timeout)
+        print(f"   📥 Результат инструмента {tool_name}: {result[:200]}...", flush=True)
+        return {"tool_call_id": tool_call.id, "output": result}
+
+    started = time.perf_counter()
+    tool_outputs = await asyncio.gather(*(run_one(tool_call) for tool_call in tool_calls))
+    print(f"   ⏱️ Инструменты ({len(tool_calls)}) выполнены за {(time.perf_counter() - started) * 1000:.0f} мс", flush=True)
+    return list(tool_outputs)
+
+
+async def _chat_events(client: openai.AsyncOpenAI, thread_id: str, telegram_id: str, stream):
+    """SSE-события ответа ассистента, включая продолжение после инструментов"""
+    yield sse_event({'type': 'thread_id', 'thread_id': thread_id})
+
+    text_buffer = ""  # Буфер для батчинга текста
+    last_send_time = time.monotonic()
+    try:
+        while stream is not None:
+            next_stream = None
+            async for event in stream:
+                event_type = getattr(event, 'event', None)
+
+                if event_type == 'thread.message.delta':
+                    delta_text = extract_text_delta(event)
+                    if delta_text:
+                        text_buffer += delta_text
+                        current_time = time.monotonic()
+                        if len(text_buffer) >= TEXT_MIN_BATCH_SIZE or current_time - last_send_time >= TEXT_BATCH_DELAY:
+                            yield sse_event({'type': 'text_delta', 'text': text_buffer})
+                            text_buffer = ""
+                            last_send_time = current_time
+
+                elif event_type == 'thread.message.completed':
+                    if text_buffer:
+                        yield sse_event({'type': 'text_delta', 'text': text_buffer})
+                        text_buffer = ""
+                    yield sse_event({'type': 'message_completed'})
+
+                elif event_type == 'thread.run.requires_action':
+                    run = event.data
+                    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                    print(f"🔧 Ассистент требует выполнения инструментов: {len(tool_calls)}", flush=True)
+                    tool_outputs = await _run_tools(tool_calls, telegram_id, client)
+                    # Продолжение run приходит отдельным потоком
+                    async with get_openai_scheduler().aslot(PRIORITY_CHAT):
+                        next_stream = _track_stream(await client.beta.threads.runs.submit_tool_outputs(
+                            thread_id=thread_id,
+                            run_id=run.id,
+                            tool_outputs=tool_outputs,
+                            stream=True
+                        ))
+                    break
+
+                elif event_type == 'thread.run.completed':
+                    if text_buffer:
+                        yield sse_event({'type': 'text_delta', 'text': text_buffer})
+                        text_buffer = ""
+                    print("✅ Run завершен", flush=True)
+                    yield sse_event({'type': 'done'})
+                    return
+
+                elif event_type == 'thread.run.failed':
+                    if text_buffer:
+                        yield sse_event({'type': 'text_delta', 'text': text_buffer})
+                        text_buffer = ""
+                    last_error = getattr(event.data, 'last_error', None)
+                    error_msg = str(last_error or event.data)
+                    print(f"❌ Run провалился: {error_msg}")
+                    yield sse_event({'type': 'error', 'error': error_msg})
+                    return
+
+                elif event_type == 'error' or event_type is None:
+                    if text_buffer:
+                        yield sse_event({'type': 'text_delta', 'text': text_buffer})
+                        text_buffer = ""
+                    error_msg = str(getattr(event, 'data', 'Unknown error'))
+                    print(f"❌ Ошибка события: {error_msg}")
+                    yield sse_event({'type': 'error', 'error': error_msg})
+                    return
+
+            await stream.close()
+            stream = next_stream
+
+        # Отправляем остаток буфера в конце
+        if text_buffer:
+            yield sse_event({'type': 'text_delta', 'text': text_buffer})
+
+    except Exception as e:
+        if isinstance(e, openai.APIError) and is_failure(e):
+            # Обрыв/таймаут OpenAI посреди потока событий — сбой для предохранителя
+            get_dependency(OPENAI).breaker.record_failure()
+        print(f"❌ Ошибка в streaming: {e}")
+        import traceback
+        traceback.print_exc()
+        yield sse_event({'type': 'error', 'error': str(e)})
+    finally:
+        # Клиент мог отключиться посреди ответа — закрываем соединение с OpenAI
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception:
+                pass
+
+
+async def chat_style(request: Request) -> Response:
+    """
+    Чат с AI-стилистом (асинхронная версия, API как у /chat-style в app.py)
+
+    Body (multipart/form-data или JSON):
+    - message: текст сообщения
+    - telegram_id: ID пользователя в Telegram
+    - thread_id: (опционально) ID thread для продолжения разговора
+    - image: (опционально) файл изображения
+    """
+    if request.method == 'OPTIONS':
+        return Response(status_code=204)
+
+    try:
+        data = await _read_request(request)
+        telegram_id = data.get('telegram_id')
+        if not telegram_id:
+            return JSONResponse({'error': 'telegram_id is required'}, status_code=400)
+
+        message = data.get('message') or ''
+        thread_id = data.get('thread_id') or None
+
+        client = get_openai_client()
+        if client is None:
+            return JSONResponse({'error': 'OPENAI_API_KEY not configured'}, status_code=500)
+        if not get_dependency(OPENAI).available():
+            return _unavailable_response()
+
+        # Подготовка фото и thread не зависят друг от друга
+        image_base64, thread_id = await asyncio.gather(
+            _read_image(data.get('image')),
+            _prepare_thread(client, thread_id)
+        )
+
+        # ВАЖНО: Для Assistants API изображение должно быть ПЕРЕД текстом
+        message_content = []
+        if image_base64:
+            file_id = await _upload_image(client, image_base64)
+            if file_id:
+                message_content.append({"type": "image_file", "image_file": {"file_id": file_id}})
+        message_content.append({"type": "text", "text": message})
+
+        # Сообщение и запуск run — в общей очереди запросов к OpenAI (приоритет чата)
+        async with get_openai_scheduler().aslot(PRIORITY_CHAT, tokens=estimate_tokens([{'content': message_content}])):
+            await _raw_call(
+                client.beta.threads.messages.with_raw_response.create,
+                thread_id=thread_id, role="user", content=message_content
+            )
+            stream = _track_stream(await client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=CHAT_ASSISTANT_ID,
+                stream=True
+            ))
+        print(f"📤 Начало streaming для thread {thread_id}", flush=True)
+
+        return StreamingResponse(
+            _chat_events(client, thread_id, telegram_id, stream),
+            media_type='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+                'Connection': 'keep-alive'
+            }
+        )
+    except DependencyUnavailable as e:
+        print(f"⚡ chat_style (async): {e}")
+        return _unavailable_response(e)
+    except Exception as e:
+        print(f"❌ Ошибка в chat_style (async): {e}")
+        import traceback
+        traceback.print_exc()
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def chat_history(request: Request) -> Response:
+    """История сообщений thread (query: thread_id, telegram_id)"""
+    if request.method == 'OPTIONS':
+        return Response(status_code=204)
+
+    thread_id = request.query_params.get('thread_id')
+    if not thread_id:
+        return JSONResponse({'error': 'thread_id required'}, status_code=400)
+
+    client = get_openai_client()
+    if client is None:
+        return JSONResponse({'error': 'OpenAI API key not configured'}, status_code=500)
+
+    try:
+        async with get_openai_scheduler().aslot(PRIORITY_CHAT):
+            messages = await client.beta.threads.messages.list(thread_id=thread_id, limit=100)
+        return JSONResponse({
+            'messages': format_history_messages(messages.data),
+            'thread_id': thread_id
+        })
+    except DependencyUnavailable as e:
+        return _unavailable_response(e)
+    except Exception as e:
+        print(f"❌ Ошибка получения истории: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def health(request: Request) -> Response:
+    return JSONResponse({'status': 'healthy', 'service': 'chat'})
+
+
+app = Starlette(
+    routes=[
+        Route('/chat-style', chat_style, methods=['POST', 'OPTIONS']),
+        Route('/chat-style/history', chat_history, methods=['GET', 'OPTIONS']),
+        Route('/chat-health', health, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ]
+)
+
+
+def start_server_process() -> subprocess.Popen:
+    """Запуск uvicorn из мастера gunicorn (отдельный процесс, свой event loop)"""
+    return subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'chat_asgi:app',
+        '--host', '0.0.0.0',
+        '--port', str(Config.CHAT_ASGI_PORT),
+        '--workers', str(Config.CHAT_ASGI_WORKERS),
+        '--timeout-keep-alive', '75',
+    ])
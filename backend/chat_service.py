@@ -0,0 +1,427 @@
+"""
+Общая логика чата со стилистом (OpenAI Assistants API)
+
+Используется двумя реализациями /chat-style:
+- app.py — синхронная (Flask, gthread-воркер на все время чата)
+- chat_asgi.py — асинхронная (uvicorn), много SSE-потоков на процесс
+"""
+
+import base64
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from config import Config
+
+
+CHAT_ASSISTANT_ID = 'asst_mn2FIw7vNCgGbnuud4m71BUN'
+
+# Батчинг текста для SSE
+TEXT_BATCH_DELAY = 0.05  # Задержка между отправками (50ms для плавности)
+TEXT_MIN_BATCH_SIZE = 3  # Минимальный размер батча
+
+# Максимальный размер стороны изображения для чата (OpenAI имеет ограничения)
+CHAT_IMAGE_MAX_SIZE = 1024
+
+# Пул для параллельного выполнения инструментов (общий для всех чатов воркера)
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=Config.CHAT_TOOL_WORKERS,
+                    thread_name_prefix='chat-tool'
+                )
+    return _tool_executor
+
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """Событие Server-Sent Events"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def prepare_chat_image(file_obj, filename: str) -> Optional[str]:
+    """
+    Готовит фото для чата: открывает (включая HEIC), уменьшает до CHAT_IMAGE_MAX_SIZE,
+    сохраняет в JPEG и возвращает base64. None — если изображение не удалось обработать.
+    """
+    from PIL import Image
+
+    try:
+        if filename.lower().endswith(('.heic', '.heif')):
+            print(f"📸 Обнаружен HEIC файл: {filename}")
+            # Для HEIC нужно использовать pillow-heif
+            try:
+                import pillow_heif
+                pillow_heif.register_heif_opener()
+            except ImportError:
+                print("⚠️ pillow-heif не установлен, пытаемся открыть как обычное изображение")
+
+        img = Image.open(file_obj)
+        print(f"✅ Изображение открыто: {img.format}, размер: {img.size}, режим: {img.mode}")
+
+        if max(img.size) > CHAT_IMAGE_MAX_SIZE:
+            img.thumbnail((CHAT_IMAGE_MAX_SIZE, CHAT_IMAGE_MAX_SIZE), Image.Resampling.LANCZOS)
+            print(f"📐 Изображение уменьшено до: {img.size}")
+
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Сохраняем с меньшим качеством для уменьшения размера
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=75, optimize=True)
+        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        print(f"✅ Изображение конвертировано в base64, размер: {len(image_base64)} символов ({len(image_base64) / 1024 / 1024:.2f} MB)")
+        return image_base64
+    except Exception as e:
+        print(f"⚠️ Ошибка обработки изображения: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def extract_text_delta(event) -> str:
+    """Текст из события thread.message.delta (пустая строка, если текста нет)"""
+    delta = getattr(getattr(event, 'data', None), 'delta', None)
+    text = ''
+    for content_block in getattr(delta, 'content', None) or []:
+        if getattr(content_block, 'type', None) == 'text':
+            value = getattr(getattr(content_block, 'text', None), 'value', None)
+            if value:
+                text += value
+    return text
+
+
+def format_history_messages(messages) -> List[Dict[str, Any]]:
+    """Сообщения thread в формате фронтенда (старые первыми)"""
+    formatted_messages = []
+    for msg in messages:
+        content_text = ''
+        image_url = None
+
+        # Извлекаем текст и изображения из content
+        for content_block in getattr(msg, 'content', None) or []:
+            block_type = getattr(content_block, 'type', None)
+            if block_type == 'text':
+                value = getattr(getattr(content_block, 'text', None), 'value', None)
+                if value:
+                    content_text += value
+            elif block_type == 'image_file':
+                file_id = getattr(getattr(content_block, 'image_file', None), 'file_id', None)
+                if file_id:
+                    # Для изображений можно вернуть file_id или загрузить файл
+                    image_url = f"file_id:{file_id}"
+
+        if content_text or image_url:
+            formatted_messages.append({
+                'role': msg.role,
+                'content': content_text,
+                'image_url': image_url
+            })
+
+    formatted_messages.reverse()
+    return formatted_messages
+
+
+def parse_tool_call(tool_call):
+    """(имя, аргументы) вызова инструмента ассистента"""
+    function = getattr(tool_call, 'function', None)
+    tool_name = getattr(function, 'name', None) or 'unknown'
+    try:
+        tool_args = json.loads(function.arguments) if function and function.arguments else {}
+    except Exception:
+        tool_args = {}
+    return tool_name, tool_args
+
+
+class ToolCallContext:
+    """
+    Данные, общие для инструментов одного requires_action.
+
+    about_user и get_weather читают один и тот же user_profile — при параллельном
+    выполнении запрос в Supabase делает первый инструмент, остальные ждут его результат.
+    """
+
+    def __init__(self, telegram_id: str, supabase=None):
+        self.telegram_id = telegram_id
+        self._supabase = supabase
+        self._supabase_loaded = supabase is not None
+        self._profile: Optional[Dict[str, Any]] = None
+        self._profile_loaded = False
+        self._lock = threading.Lock()
+
+    def get_supabase(self):
+        if not self._supabase_loaded:
+            from supabase_client import get_supabase_client
+            self._supabase = get_supabase_client()
+            self._supabase_loaded = True
+        return self._supabase
+
+    def get_profile(self) -> Optional[Dict[str, Any]]:
+        """Профиль пользователя (None — профиля нет). Ошибки Supabase не кэшируются."""
+        with self._lock:
+            if not self._profile_loaded:
+                supabase = self.get_supabase()
+                profile_response = supabase.table('user_profile').select('*').eq('telegram_id', self.telegram_id).execute()
+                self._profile = profile_response.data[0] if profile_response.data else None
+                self._profile_loaded = True
+            return self._profile
+
+
+def _tool_output(tool_call, result: str) -> Dict[str, str]:
+    return {"tool_call_id": tool_call.id, "output": result}
+
+
+def tool_timeout_result(tool_name: str, timeout: float) -> str:
+    """Ответ инструмента, не уложившегося в таймаут (run продолжается без его данных)"""
+    print(f"   ⏱️ Инструмент {tool_name} не ответил за {timeout:.0f} с", flush=True)
+    return json.dumps({"error": f"Инструмент {tool_name} не ответил за {timeout:.0f} с"}, ensure_ascii=False)
+
+
+def run_tool_calls(tool_calls, telegram_id: str, openai_client, timeout: Optional[float] = None) -> List[Dict[str, str]]:
+    """
+    Выполняет все инструменты одного requires_action параллельно.
+
+    Время ответа — максимум задержек инструментов, а не их сумма. Инструмент,
+    не уложившийся в timeout (CHAT_TOOL_TIMEOUT), получает ответ с ошибкой,
+    чтобы run продолжился. Порядок tool_outputs совпадает с tool_calls.
+    """
+    if timeout is None:
+        timeout = Config.CHAT_TOOL_TIMEOUT
+    context = ToolCallContext(telegram_id)
+    calls = [(tool_call, *parse_tool_call(tool_call)) for tool_call in tool_calls]
+    for _, tool_name, tool_args in calls:
+        print(f"   🔨 Инструмент: {tool_name}, аргументы: {tool_args}", flush=True)
+
+    started = time.perf_counter()
+    executor = _get_tool_executor()
+    futures = [
+        executor.submit(handle_tool_call, tool_name, tool_args, telegram_id, openai_client, context)
+        for _, tool_name, tool_args in calls
+    ]
+    deadline = time.monotonic() + timeout
+    outputs = []
+    for (tool_call, tool_name, _), future in zip(calls, futures):
+        try:
+            result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            # Таймаут (или сбой вне handle_tool_call); поток инструмента досчитает в фоне
+            future.cancel()
+            result = tool_timeout_result(tool_name, timeout)
+        outputs.append(_tool_output(tool_call, result))
+
+    for (_, tool_name, _), output in zip(calls, outputs):
+        print(f"   📥 Результат инструмента {tool_name}: {output['output'][:200]}...", flush=True)
+    print(f"   ⏱️ Инструменты ({len(calls)}) выполнены за {(time.perf_counter() - started) * 1000:.0f} мс", flush=True)
+    return outputs
+
+
+def handle_tool_call(tool_name: str, tool_args: dict, telegram_id: str, openai_client,
+                     context: Optional[ToolCallContext] = None) -> str:
+    """
+    Обработка вызовов инструментов ассистента
+    
+    Args:
+        tool_name: название инструмента
+        tool_args: аргументы инструмента
+        telegram_id: ID пользователя
+        openai_client: клиент OpenAI
+        context: общие данные инструментов одного requires_action (профиль читается один раз)
+    
+    Returns:
+        JSON строка с результатом выполнения инструмента
+    """
+    if context is None:
+        context = ToolCallContext(telegram_id)
+    try:
+        supabase = context.get_supabase()
+        
+        if tool_name == 'about_user':
+            # Получаем данные пользователя
+            if not supabase:
+                return json.dumps({"error": "Supabase не доступен"})
+            
+            profile = context.get_profile()
+            if profile:
+                return json.dumps({
+                    "figura": profile.get('figura', 'не указано'),
+                    "cvetotip": profile.get('cvetotip', 'не указано'),
+                    "stil_zhizni": profile.get('stil_zhizni', 'не указано'),
+                    "celi": profile.get('celi', 'не указано'),
+                    "predpochtenia": profile.get('predpochtenia', 'не указано'),
+                    "name": profile.get('name', 'не указано'),
+                    "age": profile.get('age', 'не указано')
+                }, ensure_ascii=False)
+            else:
+                return json.dumps({"error": "Профиль не найден"})
+        
+        elif tool_name == 'wardrobe':
+            # Получаем гардероб пользователя
+            if not supabase:
+                return json.dumps({"error": "Supabase не доступен"})
+            
+            wardrobe_response = supabase.table('wardrobe').select('id, category, description, season').eq('telegram_id', telegram_id).execute()
+            if wardrobe_response.data:
+                wardrobe_items = wardrobe_response.data  # Возвращаем все вещи без ограничений
+                return json.dumps({
+                    "items": [
+                        {
+                            "id": str(item.get('id', '')),
+                            "category": item.get('category', ''),
+                            "description": item.get('description', ''),
+                            "season": item.get('season', '')
+                        }
+                        for item in wardrobe_items
+                    ],
+                    "count": len(wardrobe_items)
+                }, ensure_ascii=False)
+            else:
+                return json.dumps({"items": [], "count": 0})
+        
+        elif tool_name == 'get_weather':
+            # Получаем погоду по координатам из профиля (как на главной странице)
+            if not supabase:
+                return json.dumps({"error": "Supabase не доступен"})
+            
+            try:
+                # Получаем профиль пользователя с координатами
+                profile = context.get_profile()
+                if not profile:
+                    return json.dumps({
+                        "error": "Профиль пользователя не найден. Пожалуйста, укажите температуру вручную."
+                    }, ensure_ascii=False)
+                
+                location_latitude = profile.get('location_latitude')
+                location_longitude = profile.get('location_longitude')
+                
+                # Проверяем наличие координат
+                if not location_latitude or not location_longitude:
+                    return json.dumps({
+                        "error": "Координаты не указаны в профиле. Пожалуйста, укажите температуру вручную или добавьте геолокацию в профиль."
+                    }, ensure_ascii=False)
+                
+                # Погода через OpenWeatherMap (общий кэш с главной страницей, см. weather_cache.py)
+                from resilience import DependencyUnavailable
+                from weather_cache import WeatherError, get_weather_cache
+                
+                print(f"   🌤️ Запрос погоды для координат: lat={location_latitude}, lon={location_longitude}", flush=True)
+                
+                try:
+                    weather_data = get_weather_cache().get(float(location_latitude), float(location_longitude))
+                    weather_status = 200
+                except WeatherError as e:
+                    weather_data, weather_status = None, e.status
+                except DependencyUnavailable:
+                    weather_data, weather_status = None, 503
+                
+                if weather_status == 200:
+                    
+                    # Формируем ответ в удобном формате
+                    result = {
+                        "temperature": round(weather_data.get('main', {}).get('temp', 20), 1),
+                        "feels_like": round(weather_data.get('main', {}).get('feels_like', 20), 1),
+                        "temp_max": round(weather_data.get('main', {}).get('temp_max', 20), 1),
+                        "temp_min": round(weather_data.get('main', {}).get('temp_min', 20), 1),
+                        "humidity": weather_data.get('main', {}).get('humidity', 0),
+                        "description": weather_data.get('weather', [{}])[0].get('description', 'ясно') if weather_data.get('weather') else 'ясно',
+                        "main_condition": weather_data.get('weather', [{}])[0].get('main', 'Clear') if weather_data.get('weather') else 'Clear',
+                        "city": weather_data.get('name', 'Неизвестно'),
+                        "country": weather_data.get('sys', {}).get('country', ''),
+                        "full_data": weather_data  # Полные данные для совместимости
+                    }
+                    
+                    print(f"   ✅ Погода получена: {result['temperature']}°C, {result['description']}", flush=True)
+                    
+                    return json.dumps(result, ensure_ascii=False)
+                else:
+                    error_msg = f"Ошибка получения погоды: HTTP {weather_status}"
+                    print(f"   ⚠️ {error_msg}", flush=True)
+                    return json.dumps({
+                        "error": error_msg
+                    }, ensure_ascii=False)
+                    
+            except requests.exceptions.RequestException as e:
+                error_msg = f"Ошибка запроса к API погоды: {str(e)}"
+                print(f"   ⚠️ {error_msg}", flush=True)
+                return json.dumps({
+                    "error": error_msg
+                }, ensure_ascii=False)
+            except Exception as e:
+                error_msg = f"Ошибка получения погоды: {str(e)}"
+                print(f"   ⚠️ {error_msg}", flush=True)
+                import traceback
+                traceback.print_exc()
+                return json.dumps({
+                    "error": error_msg
+                }, ensure_ascii=False)
+        
+        elif tool_name == 'recommend':
+            # Рекомендации товаров брендов
+            if not supabase:
+                return json.dumps({"error": "Supabase не доступен"})
+            
+            season = tool_args.get('season', 'Всесезонно')
+            category = tool_args.get('category', None)
+            
+            query = supabase.table('brand_items').select('id, brand_id, category, season, description, image_id, shop_link, price, currency').eq('is_approved', True).eq('is_active', True)
+            
+            if season and season != 'Всесезонно':
+                query = query.eq('season', season)
+            
+            if category:
+                query = query.eq('category', category)
+            
+            response = query.limit(20).execute()
+            items = response.data if response.data else []
+            
+            # Формируем image_url
+            for item in items:
+                if item.get('image_id') and item.get('brand_id'):
+                    item['image_url'] = f"https://lipolo.store/storage/v1/object/public/brand-items-images/{item['brand_id']}/{item['image_id']}.jpg"
+                else:
+                    item['image_url'] = None
+            
+            return json.dumps({
+                "items": [
+                    {
+                        "id": str(item.get('id', '')),
+                        "category": item.get('category', ''),
+                        "description": item.get('description', ''),
+                        "season": item.get('season', ''),
+                        "image_url": item.get('image_url', ''),
+                        "shop_link": item.get('shop_link', ''),
+                        "price": item.get('price', ''),
+                        "currency": item.get('currency', '')
+                    }
+                    for item in items
+                ],
+                "count": len(items)
+            }, ensure_ascii=False)
+        
+        elif tool_name == 'search_web':
+            # Поиск в интернете (пока заглушка)
+            query = tool_args.get('query', '')
+            return json.dumps({
+                "query": query,
+                "results": [],
+                "note": "Поиск в интернете пока не реализован. Используйте инструмент recommend для поиска товаров."
+            }, ensure_ascii=False)
+        
+        else:
+            return json.dumps({"error": f"Неизвестный инструмент: {tool_name}"})
+    
+    except Exception as e:
+        print(f"⚠️ Ошибка обработки инструмента {tool_name}: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return json.dumps({"error": str(e)})
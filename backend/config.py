@@ -37,7 +37,81 @@ class Config:
     # Redis настройки
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
     REDIS_TTL = int(os.getenv('REDIS_TTL', '86400'))  # 24 часа для AI результатов
-    
+    AI_ANALYSIS_CACHE_TTL = int(os.getenv('AI_ANALYSIS_CACHE_TTL', str(30 * 86400)))  # распознавание вещи по фото
+    AI_ANALYSIS_L1_SIZE = int(os.getenv('AI_ANALYSIS_L1_SIZE', '512'))  # записей в памяти воркера
+
+    # Каталог товаров брендов (в памяти воркера)
+    BRAND_CATALOG_TTL = int(os.getenv('BRAND_CATALOG_TTL', '600'))  # фоновое обновление раз в 10 минут
+    BRAND_CATALOG_RETRY_TTL = int(os.getenv('BRAND_CATALOG_RETRY_TTL', '30'))  # повтор после неудачной загрузки
+    BRAND_CATALOG_DELTA_SYNC = os.getenv('BRAND_CATALOG_DELTA_SYNC', 'true').lower() == 'true'  # нужен BRAND_ITEMS_SYNC_SETUP.sql
+    BRAND_CATALOG_FULL_SYNC = int(os.getenv('BRAND_CATALOG_FULL_SYNC', '3600'))  # сек между полными загрузками (между ними — изменения)
+    BRAND_FETCH_HEDGE_AFTER = float(os.getenv('BRAND_FETCH_HEDGE_AFTER', '3'))  # сек (≈p95 API), потом параллельно Supabase
+    BRAND_FETCH_TIMEOUT = float(os.getenv('BRAND_FETCH_TIMEOUT', '30'))  # сек на загрузку из любого источника
+    # Общий снимок каталога и поискового индекса на диске хоста (см. catalog_snapshot.py); пусто — выключено
+    CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR', '/tmp/catalog_snapshot')
+
+    # Удаление фона (отдельный пул процессов rembg, см. bg_removal_pool.py)
+    BG_REMOVAL_WORKERS = int(os.getenv('BG_REMOVAL_WORKERS', '2'))  # процессов (по модели u2net на каждый)
+    BG_REMOVAL_QUEUE_SIZE = int(os.getenv('BG_REMOVAL_QUEUE_SIZE', '8'))  # сверх этого — 429
+    BG_REMOVAL_TIMEOUT = float(os.getenv('BG_REMOVAL_TIMEOUT', '60'))  # сек ожидания результата
+    BG_REMOVAL_SOCKET_PATH = os.getenv('BG_REMOVAL_SOCKET_PATH', '/tmp/bg_removal.sock')
+
+    # Кэш результатов обработки фото по содержимому (см. image_cache.py)
+    IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '/tmp/image_cache')
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '512'))
+    IMAGE_CACHE_REDIS_TTL = int(os.getenv('IMAGE_CACHE_REDIS_TTL', str(7 * 86400)))
+    IMAGE_CACHE_REDIS_MAX_KB = int(os.getenv('IMAGE_CACHE_REDIS_MAX_KB', '1024'))  # крупнее — только на диск
+
+    # Гардероб по telegram_id (см. wardrobe_store.py): кэш по версии гардероба
+    WARDROBE_CACHE_L1_SIZE = int(os.getenv('WARDROBE_CACHE_L1_SIZE', '1024'))  # пользователей в памяти воркера
+    WARDROBE_CACHE_TTL = int(os.getenv('WARDROBE_CACHE_TTL', '86400'))  # сек в Redis (ключ включает версию)
+
+    # Поисковый индекс товаров брендов в памяти воркера (см. search_index.py)
+    SEARCH_INDEX_REFRESH = int(os.getenv('SEARCH_INDEX_REFRESH', '60'))  # сек между загрузками изменений (updated_at)
+    SEARCH_INDEX_SWEEP = int(os.getenv('SEARCH_INDEX_SWEEP', '600'))  # сек между сверками удаленных/снятых товаров
+
+    # Внешние HTTP-запросы: общая keep-alive сессия процесса (см. http_client.py)
+    HTTP_POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', '10'))  # хостов с собственным пулом соединений
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))  # соединений на хост (≈ потоков gthread)
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))  # повторов GET при обрыве/таймауте/429/502-504
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.2'))  # сек, база экспоненциальной паузы с jitter
+
+    # Погода (см. weather_cache.py): кэш по ячейкам координат, общий для /weather и чата
+    OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY', 'd69e489c7ddeb793bff2350cc232dab7')
+    WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', '600'))  # сек (память воркера и Redis)
+    WEATHER_CELL_DEGREES = float(os.getenv('WEATHER_CELL_DEGREES', '0.05'))  # шаг сетки, ° (~5 км)
+    WEATHER_CACHE_L1_SIZE = int(os.getenv('WEATHER_CACHE_L1_SIZE', '4096'))  # ячеек в памяти воркера
+
+    # OpenAI: общий клиент и очередь запросов по приоритету (см. openai_client.py)
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))  # сек на запрос
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))  # повторы SDK (429, 5xx, обрывы)
+    OPENAI_MAX_CONCURRENT = int(os.getenv('OPENAI_MAX_CONCURRENT', '8'))  # одновременных запросов на воркер
+    OPENAI_WAIT_CHAT = float(os.getenv('OPENAI_WAIT_CHAT', '30'))  # сек в очереди, потом отказ
+    OPENAI_WAIT_ANALYSIS = float(os.getenv('OPENAI_WAIT_ANALYSIS', '20'))
+    OPENAI_WAIT_RECOMMENDATIONS = float(os.getenv('OPENAI_WAIT_RECOMMENDATIONS', '5'))  # рекомендации уходят в fallback
+
+    # Предохранители и bulkhead внешних зависимостей (см. resilience.py)
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))  # сбоев подряд до открытия
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))  # сек до пробного вызова
+    BULKHEAD_WAIT = float(os.getenv('BULKHEAD_WAIT', '0.5'))  # сек ожидания места, потом отказ
+    BULKHEAD_BRAND_API = int(os.getenv('BULKHEAD_BRAND_API', '4'))  # одновременных вызовов на воркер
+    BULKHEAD_OPENWEATHER = int(os.getenv('BULKHEAD_OPENWEATHER', '8'))
+    BULKHEAD_SUPABASE = int(os.getenv('BULKHEAD_SUPABASE', '16'))  # ≈ потоков gthread
+
+    # Single-flight: одинаковые одновременные расчеты (см. single_flight.py)
+    SINGLE_FLIGHT_LOCK_TTL = float(os.getenv('SINGLE_FLIGHT_LOCK_TTL', '60'))  # сек, лок лидера в Redis
+    SINGLE_FLIGHT_WAIT = float(os.getenv('SINGLE_FLIGHT_WAIT', '20'))  # сек ожидания лидера, потом считаем сами
+
+    # Асинхронный чат со стилистом (см. chat_asgi.py)
+    CHAT_ASGI_ENABLED = os.getenv('CHAT_ASGI_ENABLED', 'true').lower() == 'true'
+    CHAT_ASGI_PORT = int(os.getenv('CHAT_ASGI_PORT', '5002'))
+    CHAT_ASGI_WORKERS = int(os.getenv('CHAT_ASGI_WORKERS', '1'))  # процессов uvicorn; каждый держит сотни SSE-потоков
+    CHAT_FILE_WAIT_TIMEOUT = float(os.getenv('CHAT_FILE_WAIT_TIMEOUT', '10'))  # сек ожидания обработки фото в OpenAI
+    CHAT_TOOL_TIMEOUT = float(os.getenv('CHAT_TOOL_TIMEOUT', '15'))  # сек на один инструмент ассистента
+    CHAT_TOOL_WORKERS = int(os.getenv('CHAT_TOOL_WORKERS', '8'))  # потоков для параллельных инструментов (Flask)
+
     # Производительность
     MAX_WARDROBE_ITEMS = int(os.getenv('MAX_WARDROBE_ITEMS', '50'))
     MAX_CAPSULES_PER_CATEGORY = int(os.getenv('MAX_CAPSULES_PER_CATEGORY', '8'))
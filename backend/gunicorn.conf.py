@@ -0,0 +1,37 @@
+"""
+Хуки gunicorn (файл подхватывается автоматически из рабочей директории)
+
+Пул удаления фона запускается один раз на контейнер из мастера —
+воркеры gunicorn наследуют адрес сокета через окружение и не грузят модель сами.
+
+Асинхронный чат (chat_asgi.py, uvicorn) тоже запускается из мастера:
+SSE-потоки чата не занимают потоки gthread-воркеров.
+"""
+
+_bg_removal_process = None
+_chat_process = None
+
+
+def on_starting(server):
+    global _bg_removal_process, _chat_process
+    try:
+        from bg_removal_pool import start_server_process
+        _bg_removal_process = start_server_process()
+    except Exception as e:
+        server.log.warning(f"Пул удаления фона не запущен: {e}")
+
+    from config import Config
+    if Config.CHAT_ASGI_ENABLED:
+        try:
+            from chat_asgi import start_server_process as start_chat_process
+            _chat_process = start_chat_process()
+        except Exception as e:
+            # /chat-style продолжит обслуживать Flask (резервный upstream в nginx)
+            server.log.warning(f"Асинхронный чат не запущен: {e}")
+
+
+def on_exit(server):
+    if _bg_removal_process is not None and _bg_removal_process.is_alive():
+        _bg_removal_process.terminate()
+    if _chat_process is not None and _chat_process.poll() is None:
+        _chat_process.terminate()
@@ -0,0 +1,101 @@
+"""
+Хеджированный запрос к двум источникам одних и тех же данных
+
+Основной источник запрашивается сразу. Если он не ответил за бюджет (p95 его
+обычной задержки, см. /stats) или упал, параллельно стартует запасной.
+Побеждает первый полезный ответ; проигравший поток дорабатывает в фоне, его
+результат отбрасывается. Худшая задержка ограничена более быстрым источником
+(плюс бюджет), а не таймаутом медленного.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from metrics import LatencyStats
+
+PRIMARY = 'primary'
+SECONDARY = 'secondary'
+
+
+class HedgedFetch:
+    """Гонка основного и запасного источника с отложенным стартом запасного"""
+
+    def __init__(self, name: str, hedge_after: float, timeout: float):
+        self.name = name
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.latency = {PRIMARY: LatencyStats(), SECONDARY: LatencyStats()}
+        self._stats = {'calls': 0, 'hedged': 0, 'primary_wins': 0, 'secondary_wins': 0, 'failures': 0}
+
+    def run(
+        self,
+        primary: Callable[[], Any],
+        secondary: Callable[[], Any],
+        accept: Callable[[Any], bool] = bool
+    ) -> Optional[Any]:
+        """
+        Первый ответ, прошедший accept (по умолчанию — непустой).
+        None — оба источника упали, вернули негодный ответ или не уложились в timeout.
+        """
+        self._stats['calls'] += 1
+        results: queue.Queue = queue.Queue()
+        deadline = time.monotonic() + self.timeout
+        hedge_at = time.monotonic() + self.hedge_after
+        started = {PRIMARY}
+        self._start(PRIMARY, primary, accept, results)
+        finished = 0
+
+        while finished < len(started):
+            now = time.monotonic()
+            if SECONDARY not in started:
+                wait = min(hedge_at, deadline) - now
+            else:
+                wait = deadline - now
+            try:
+                label, ok, result = results.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if SECONDARY in started or time.monotonic() >= deadline:
+                    break
+                print(f"⏱️ {self.name}: основной источник не ответил за {self.hedge_after:.1f}с — запускаем запасной")
+                self._hedge(secondary, accept, results, started)
+                continue
+
+            finished += 1
+            if ok:
+                self._stats[f'{label}_wins'] += 1
+                return result
+            if SECONDARY not in started:
+                # Основной упал раньше бюджета — запасной сразу
+                self._hedge(secondary, accept, results, started)
+
+        self._stats['failures'] += 1
+        return None
+
+    def _hedge(self, secondary, accept, results: queue.Queue, started: set) -> None:
+        self._stats['hedged'] += 1
+        started.add(SECONDARY)
+        self._start(SECONDARY, secondary, accept, results)
+
+    def _start(self, label: str, fn: Callable[[], Any], accept, results: queue.Queue) -> None:
+        def run():
+            started = time.monotonic()
+            try:
+                result = fn()
+                ok = bool(accept(result))
+            except Exception as e:
+                print(f"⚠️ {self.name} [{label}]: {e}")
+                result, ok = None, False
+            self.latency[label].record((time.monotonic() - started) * 1000, ok=ok)
+            results.put((label, ok, result))
+
+        threading.Thread(target=run, name=f'hedged-{self.name}-{label}', daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'hedge_after_sec': self.hedge_after,
+            PRIMARY: self.latency[PRIMARY].snapshot(),
+            SECONDARY: self.latency[SECONDARY].snapshot(),
+        }
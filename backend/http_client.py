@@ -0,0 +1,119 @@
+"""
+Общий HTTP-клиент воркера для внешних запросов (погода, публичный API брендов)
+
+Раньше каждый вызов requests.get открывал новое TCP+TLS соединение. Теперь
+запросы идут через одну requests.Session на процесс:
+- пул keep-alive соединений на каждый хост (HTTP_POOL_HOSTS хостов,
+  до HTTP_POOL_SIZE соединений на хост — по числу потоков gthread)
+- таймауты по умолчанию: connect HTTP_CONNECT_TIMEOUT, read HTTP_READ_TIMEOUT
+- повтор идемпотентных запросов при обрыве соединения, таймауте, 429 и 5xx
+  шлюза — с экспоненциальной паузой и случайным разбросом (jitter)
+- гистограмма задержек по хостам (get_http_stats / /stats)
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from metrics import LatencyHistogram
+
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+_hosts: Dict[str, LatencyHistogram] = {}
+_counters = {'requests': 0, 'retries': 0, 'errors': 0}
+
+
+def _get_session() -> requests.Session:
+    """Сессия процесса (созданная до fork в дочернем процессе не используется)"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=Config.HTTP_POOL_HOSTS,
+                pool_maxsize=Config.HTTP_POOL_SIZE,
+                max_retries=0  # повторы — в http_request, с jitter
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session, _session_pid = session, pid
+        return _session
+
+
+def _host_stats(host: str) -> LatencyHistogram:
+    stats = _hosts.get(host)
+    if stats is None:
+        with _session_lock:
+            stats = _hosts.setdefault(host, LatencyHistogram())
+    return stats
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: случайная пауза до base * 2^attempt — повторы воркеров не совпадают
+    return random.uniform(0, Config.HTTP_RETRY_BACKOFF * (2 ** attempt))
+
+
+def http_request(method: str, url: str, timeout=None, retries: Optional[int] = None, **kwargs) -> requests.Response:
+    """
+    Запрос через общую сессию. timeout — секунды или (connect, read);
+    retries — число повторов (по умолчанию HTTP_RETRIES, только для идемпотентных методов).
+    Ответ с ошибочным статусом возвращается как есть (после исчерпания повторов).
+    """
+    method = method.upper()
+    if timeout is None:
+        timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (min(Config.HTTP_CONNECT_TIMEOUT, timeout), timeout)
+    if retries is None:
+        retries = Config.HTTP_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+    stats = _host_stats(urlsplit(url).netloc)
+    attempt = 0
+    while True:
+        _counters['requests'] += 1
+        started = time.perf_counter()
+        try:
+            response = _get_session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            stats.record((time.perf_counter() - started) * 1000, ok=False)
+            if attempt >= retries:
+                _counters['errors'] += 1
+                raise
+            print(f"🔁 {urlsplit(url).netloc}: {type(e).__name__}, повтор {attempt + 1}/{retries}")
+        else:
+            ok = response.status_code < 500
+            stats.record((time.perf_counter() - started) * 1000, ok=ok)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                if not ok:
+                    _counters['errors'] += 1
+                return response
+            response.close()
+        _counters['retries'] += 1
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    return http_request('GET', url, **kwargs)
+
+
+def get_http_stats() -> Dict[str, Any]:
+    """Счетчики и гистограммы задержек внешних запросов по хостам"""
+    return {
+        **_counters,
+        'hosts': {host: stats.snapshot() for host, stats in list(_hosts.items())}
+    }
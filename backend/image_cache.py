@@ -0,0 +1,197 @@
+"""
+Кэш результатов обработки фото по содержимому (content-addressed)
+
+Пользователи часто загружают одно и то же фото повторно (повтор после ошибки,
+превью HEIC и затем настоящая загрузка, редактирование карточки) — и каждый раз
+платили за u2net + alpha matting. Ключ кэша — sha256 от декодированных пикселей
+после поворота по EXIF и уменьшения до 1024 px (app._normalize_photo). Ключ
+точный: совпадает для повторной загрузки тех же пикселей (тот же файл, в том
+числе с другими метаданными), но не для пересжатого с потерями снимка.
+
+Уровни:
+- локальный диск (LRU по времени доступа, общий для воркеров контейнера)
+- Redis (опционально, общий для контейнеров; только небольшие значения)
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+from config import Config
+from redis_client import get_redis_client
+
+
+def image_key(image, version: str = '') -> str:
+    """Точный ключ по пикселям изображения (режим, размер и байты) и версии обработки"""
+    h = hashlib.sha256()
+    h.update(f'{version}|{image.mode}|{image.size[0]}x{image.size[1]}|'.encode('utf-8'))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class DiskLRUCache:
+    """Файлы на диске с ограничением общего размера; вытесняются давно не читанные"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None  # оценка размера (точно пересчитывается при вытеснении)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        try:
+            os.utime(path)  # отметка доступа для LRU
+        except OSError:
+            pass
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Атомарная запись: читатели в других воркерах не увидят недописанный файл
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            need_evict = self._size > self.max_bytes
+        if need_evict:
+            self._evict()
+
+    def _entries(self):
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, entry.path
+
+    def _scan_size(self) -> int:
+        try:
+            return sum(size for _, size, _ in self._entries())
+        except FileNotFoundError:
+            return 0
+
+    def _evict(self) -> None:
+        """Удаляем самые старые файлы, пока не останется 90% лимита"""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    pass
+            self._size = total
+
+    def stats(self) -> Dict[str, Any]:
+        return {'dir': self.directory, 'bytes': self._size, 'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class ImageResultCache:
+    """Результаты обработки фото: диск → Redis"""
+
+    def __init__(self, disk: DiskLRUCache, redis_ttl: int, redis_max_bytes: int):
+        self.disk = disk
+        self.redis_ttl = redis_ttl
+        self.redis_max_bytes = redis_max_bytes
+        self._stats = {'disk_hits': 0, 'redis_hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+    def get(self, key: str, variant: str) -> Optional[bytes]:
+        name = f'{variant}-{key}'
+        try:
+            data = self.disk.get(name)
+            if data is not None:
+                self._stats['disk_hits'] += 1
+                return data
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"⚠️ Кэш фото (диск): ошибка чтения: {e}")
+
+        client = get_redis_client()
+        if client is not None:
+            try:
+                data = client.get(f'img:{variant}:{key}')
+                if data is not None:
+                    self._stats['redis_hits'] += 1
+                    self._set_disk(name, data)
+                    return data
+            except Exception as e:
+                self._stats['errors'] += 1
+                print(f"⚠️ Кэш фото (Redis): ошибка чтения: {e}")
+
+        self._stats['misses'] += 1
+        return None
+
+    def set(self, key: str, variant: str, data: bytes) -> None:
+        self._stats['writes'] += 1
+        self._set_disk(f'{variant}-{key}', data)
+        client = get_redis_client()
+        if client is not None and len(data) <= self.redis_max_bytes:
+            try:
+                client.setex(f'img:{variant}:{key}', self.redis_ttl, data)
+            except Exception as e:
+                self._stats['errors'] += 1
+                print(f"⚠️ Кэш фото (Redis): ошибка записи: {e}")
+
+    def _set_disk(self, name: str, data: bytes) -> None:
+        try:
+            self.disk.set(name, data)
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"⚠️ Кэш фото (диск): ошибка записи: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'disk': self.disk.stats()}
+
+
+_cache: Optional[ImageResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageResultCache:
+    """Общий кэш результатов обработки фото"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageResultCache(
+                    disk=DiskLRUCache(Config.IMAGE_CACHE_DIR, Config.IMAGE_CACHE_MAX_MB * 1024 * 1024),
+                    redis_ttl=Config.IMAGE_CACHE_REDIS_TTL,
+                    redis_max_bytes=Config.IMAGE_CACHE_REDIS_MAX_KB * 1024
+                )
+    return _cache
@@ -0,0 +1,69 @@
+"""
+Простые метрики задержек в памяти воркера (для /stats)
+"""
+
+import bisect
+import threading
+from collections import deque
+from typing import Any, Dict
+
+
+class LatencyStats:
+    """Последние N замеров задержки (мс) и перцентили по ним"""
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.errors = 0
+
+    def record(self, ms: float, ok: bool = True) -> None:
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+            count, errors = self.count, self.errors
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': _percentile(samples, 0.50),
+            'p95_ms': _percentile(samples, 0.95),
+            'p99_ms': _percentile(samples, 0.99),
+        }
+
+
+def _percentile(sorted_samples, q: float):
+    if not sorted_samples:
+        return None
+    idx = min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))
+    return round(sorted_samples[idx], 1)
+
+
+# Границы корзин гистограммы задержек, мс (последняя корзина — все, что больше)
+HISTOGRAM_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram(LatencyStats):
+    """Перцентили по последним замерам и гистограмма по всем замерам"""
+
+    def __init__(self, window: int = 1000, buckets=HISTOGRAM_BUCKETS_MS):
+        super().__init__(window)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+
+    def record(self, ms: float, ok: bool = True) -> None:
+        idx = bisect.bisect_left(self.buckets, ms)
+        with self._lock:
+            self._counts[idx] += 1
+        super().record(ms, ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+        labels = [f'<={b}' for b in self.buckets] + [f'>{self.buckets[-1]}']
+        return {**super().snapshot(), 'histogram_ms': dict(zip(labels, counts))}
@@ -0,0 +1,358 @@
+"""
+Общий клиент OpenAI на воркер и планировщик запросов с учетом лимитов
+
+Раньше рекомендации, генерация капсул, определение сезона и чат создавали
+openai.OpenAI на каждый запрос (новый HTTP-пул и TLS), а при всплеске все
+запросы одновременно упирались в лимиты RPM/TPM и падали с 429.
+Теперь:
+- клиент один на процесс (пул соединений httpx, повторы SDK)
+- запросы проходят через планировщик: очередь по приоритету
+  (чат > распознавание вещей > рекомендации), не больше OPENAI_MAX_CONCURRENT
+  одновременно на воркер
+- остаток лимитов берется из заголовков ответа x-ratelimit-* (лимиты общие
+  для организации, поэтому видны всем воркерам) и уменьшается локально до
+  следующего ответа
+- асинхронный чат (chat_asgi.py) встает в ту же очередь через aslot: ожидание
+  места не блокирует event loop
+- низкоприоритетным запросам оставляется запас лимита для чата: рядом с лимитом
+  они ждут сброса окна, а не дождавшись — отклоняются (OpenAIBusy), и
+  вызывающий код уходит в свой fallback
+- при сбоях самого OpenAI (обрывы, таймауты, 5xx) срабатывает предохранитель
+  (resilience.py): запросы отклоняются сразу, не занимая очередь
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+from config import Config
+from resilience import OPENAI, DependencyUnavailable, guard
+
+PRIORITY_CHAT = 0
+PRIORITY_ANALYSIS = 1
+PRIORITY_RECOMMENDATIONS = 2
+
+_PRIORITY_NAMES = {PRIORITY_CHAT: 'chat', PRIORITY_ANALYSIS: 'analysis', PRIORITY_RECOMMENDATIONS: 'recommendations'}
+
+# Доля лимита, которую приоритет не трогает (запас для более важных запросов)
+_RESERVE = {PRIORITY_CHAT: 0.0, PRIORITY_ANALYSIS: 0.10, PRIORITY_RECOMMENDATIONS: 0.25}
+
+# Оценка токенов запроса: ~3 символа на токен для текста, фиксированно за картинку
+_CHARS_PER_TOKEN = 3
+_IMAGE_TOKENS = 1000
+
+_ASYNC_POLL = 0.05  # сек между проверками очереди асинхронным ожидающим
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+class OpenAIBusy(DependencyUnavailable):
+    """Запрос отклонен планировщиком: лимиты OpenAI на исходе, очередь не продвинулась"""
+
+    def __init__(self, message: str):
+        super().__init__(OPENAI, message)
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Длительность из заголовка x-ratelimit-reset-* ('1s', '6m0s', '20ms') в секундах"""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def estimate_tokens(messages, max_tokens: int = 0) -> int:
+    """Грубая оценка токенов запроса (промпт + лимит ответа) для учета TPM"""
+    chars, images = 0, 0
+    for message in messages or []:
+        content = message.get('content') if isinstance(message, dict) else message
+        if isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'image_url':
+                    images += 1
+                else:
+                    chars += len(json.dumps(part, ensure_ascii=False))
+        else:
+            chars += len(str(content or ''))
+    return chars // _CHARS_PER_TOKEN + images * _IMAGE_TOKENS + (max_tokens or 0)
+
+
+class _Budget:
+    """Остаток одного лимита (запросы или токены) по заголовкам ответов"""
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[float] = None
+        self.reset_at = 0.0
+
+    def update(self, limit, remaining, reset) -> None:
+        try:
+            self.limit = int(limit)
+            self.remaining = float(remaining)
+        except (TypeError, ValueError):
+            return
+        self.reset_at = time.monotonic() + (parse_reset(reset) or 0.0)
+
+    def refill(self) -> None:
+        # Окно сброшено, а свежего ответа нет — считаем лимит восстановленным
+        if self.limit is not None and time.monotonic() >= self.reset_at:
+            self.remaining = float(self.limit)
+
+    def allows(self, cost: float, reserve: float) -> bool:
+        if self.limit is None or self.remaining is None:
+            return True  # лимиты еще неизвестны
+        if reserve == 0.0:
+            return self.remaining >= min(cost, 1.0)
+        return self.remaining - cost >= self.limit * reserve
+
+    def spend(self, cost: float) -> None:
+        if self.remaining is not None:
+            self.remaining -= cost
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'remaining': None if self.remaining is None else int(self.remaining),
+            'reset_in_sec': round(max(0.0, self.reset_at - time.monotonic()), 1) if self.limit else None
+        }
+
+
+class OpenAIScheduler:
+    """Очередь запросов к OpenAI по приоритету с учетом RPM/TPM"""
+
+    def __init__(self, max_concurrent: int = 8, max_wait: Optional[Dict[int, float]] = None):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait or {PRIORITY_CHAT: 30.0, PRIORITY_ANALYSIS: 20.0, PRIORITY_RECOMMENDATIONS: 5.0}
+        self.requests = _Budget()
+        self.tokens = _Budget()
+        self._cond = threading.Condition()
+        self._waiting: list = []  # куча (приоритет, номер)
+        self._tickets = itertools.count()
+        self._in_flight = 0
+        self._stats = {name: {'admitted': 0, 'shed': 0, 'waited_ms': 0.0} for name in _PRIORITY_NAMES.values()}
+        self._stats['rate_limited'] = 0
+
+    # ---------- вызовы ----------
+
+    def chat_completion(self, priority: int, client=None, **kwargs):
+        """client.chat.completions.create через очередь; лимиты обновляются по заголовкам ответа"""
+        client = client or get_openai_client()
+        if client is None:
+            raise RuntimeError('OPENAI_API_KEY не настроен')
+        cost = estimate_tokens(kwargs.get('messages'), kwargs.get('max_tokens') or 0)
+        with self.slot(priority, tokens=cost):
+            try:
+                raw = client.chat.completions.with_raw_response.create(**kwargs)
+            except Exception as e:
+                self._on_error(e)
+                raise
+            self.update_from_headers(raw.headers)
+            return raw.parse()
+
+    @contextmanager
+    def slot(self, priority: int, tokens: int = 0):
+        """Место в очереди для любого вызова OpenAI (Assistants, Files и т.п.)"""
+        # Предохранитель проверяется до очереди: при недоступном OpenAI не ждем места
+        with guard(OPENAI):
+            self._acquire(priority, tokens)
+            try:
+                yield
+            finally:
+                self._release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int, tokens: int = 0):
+        """slot для asyncio (ASGI-чат): та же очередь и лимиты, ожидание не блокирует event loop"""
+        with guard(OPENAI):
+            await self._acquire_async(priority, tokens)
+            try:
+                yield
+            finally:
+                self._release()
+
+    def update_from_headers(self, headers) -> None:
+        if headers is None:
+            return
+        with self._cond:
+            self.requests.update(
+                headers.get('x-ratelimit-limit-requests'),
+                headers.get('x-ratelimit-remaining-requests'),
+                headers.get('x-ratelimit-reset-requests')
+            )
+            self.tokens.update(
+                headers.get('x-ratelimit-limit-tokens'),
+                headers.get('x-ratelimit-remaining-tokens'),
+                headers.get('x-ratelimit-reset-tokens')
+            )
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **{key: dict(value) if isinstance(value, dict) else value for key, value in self._stats.items()},
+                'in_flight': self._in_flight,
+                'queued': len(self._waiting),
+                'requests': self.requests.snapshot(),
+                'tokens': self.tokens.snapshot()
+            }
+
+    # ---------- очередь ----------
+
+    def _acquire(self, priority: int, tokens: int) -> None:
+        ticket = self._enqueue(priority)
+        with self._cond:
+            try:
+                while not self._admit(ticket, tokens):
+                    self._cond.wait(timeout=self._wait_time(ticket))
+            except BaseException:
+                self._dequeue(ticket)
+                raise
+
+    async def _acquire_async(self, priority: int, tokens: int) -> None:
+        # Асинхронные ожидающие стоят в той же куче, но опрашивают ее, а не ждут Condition
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    if self._admit(ticket, tokens):
+                        return
+                    wait = self._wait_time(ticket)
+                await asyncio.sleep(min(wait, _ASYNC_POLL))
+        except BaseException:
+            with self._cond:
+                self._dequeue(ticket)
+            raise
+
+    def _enqueue(self, priority: int) -> Dict[str, Any]:
+        started = time.monotonic()
+        ticket = {
+            'entry': (priority, next(self._tickets)),
+            'name': _PRIORITY_NAMES.get(priority, 'recommendations'),
+            'reserve': _RESERVE.get(priority, _RESERVE[PRIORITY_RECOMMENDATIONS]),
+            'started': started,
+            'deadline': started + self.max_wait.get(priority, 5.0)
+        }
+        with self._cond:
+            heapq.heappush(self._waiting, ticket['entry'])
+        return ticket
+
+    def _admit(self, ticket: Dict[str, Any], tokens: int) -> bool:
+        """Под self._cond: занимает место, если очередь дошла и лимиты позволяют; OpenAIBusy — срок вышел"""
+        self.requests.refill()
+        self.tokens.refill()
+        reserve = ticket['reserve']
+        if not (
+            self._waiting[0] == ticket['entry']
+            and self._in_flight < self.max_concurrent
+            and self.requests.allows(1, reserve)
+            and self.tokens.allows(tokens, reserve)
+        ):
+            if time.monotonic() >= ticket['deadline']:
+                self._stats[ticket['name']]['shed'] += 1
+                raise OpenAIBusy(f"OpenAI: лимиты на исходе, запрос ({ticket['name']}) отклонен")
+            return False
+
+        heapq.heappop(self._waiting)
+        self._in_flight += 1
+        self.requests.spend(1)
+        self.tokens.spend(tokens)
+        self._stats[ticket['name']]['admitted'] += 1
+        self._stats[ticket['name']]['waited_ms'] += (time.monotonic() - ticket['started']) * 1000
+        self._cond.notify_all()
+        return True
+
+    def _wait_time(self, ticket: Dict[str, Any]) -> float:
+        # Ждем освобождения места, ответа с новыми лимитами или сброса окна
+        now = time.monotonic()
+        deadline = ticket['deadline']
+        wake = min(deadline, max(now + 0.05, min(self.requests.reset_at, self.tokens.reset_at) or deadline))
+        return max(0.0, min(wake - now, 1.0))
+
+    def _dequeue(self, ticket: Dict[str, Any]) -> None:
+        """Под self._cond: ожидающий ушел из очереди (отказ, отмена)"""
+        if ticket['entry'] in self._waiting:
+            self._waiting.remove(ticket['entry'])
+            heapq.heapify(self._waiting)
+        self._cond.notify_all()
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_error(self, error: Exception) -> None:
+        """429 от OpenAI: остаток — ноль до retry-after (SDK уже исчерпал свои повторы)"""
+        import openai
+        if not isinstance(error, openai.RateLimitError):
+            return
+        retry_after = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            self.update_from_headers(response.headers)
+            try:
+                retry_after = float(response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = None
+        with self._cond:
+            self._stats['rate_limited'] += 1
+            for budget in (self.requests, self.tokens):
+                if budget.limit is not None:
+                    budget.remaining = 0.0
+                    if retry_after:
+                        budget.reset_at = max(budget.reset_at, time.monotonic() + retry_after)
+
+
+_client = None
+_client_pid: Optional[int] = None
+_scheduler: Optional[OpenAIScheduler] = None
+_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Общий для процесса клиент OpenAI (None — OPENAI_API_KEY не задан)"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        return None
+    with _lock:
+        # Клиент, созданный до fork, в дочернем процессе не используем
+        if _client is None or _client_pid != pid:
+            import openai
+            _client = openai.OpenAI(
+                api_key=api_key,
+                timeout=Config.OPENAI_TIMEOUT,
+                max_retries=Config.OPENAI_MAX_RETRIES
+            )
+            _client_pid = pid
+            print(f"🔌 OpenAI клиент создан (pid {pid})")
+        return _client
+
+
+def get_openai_scheduler() -> OpenAIScheduler:
+    """Общий для воркера планировщик запросов к OpenAI (создается лениво)"""
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = OpenAIScheduler(
+                    max_concurrent=Config.OPENAI_MAX_CONCURRENT,
+                    max_wait={
+                        PRIORITY_CHAT: Config.OPENAI_WAIT_CHAT,
+                        PRIORITY_ANALYSIS: Config.OPENAI_WAIT_ANALYSIS,
+                        PRIORITY_RECOMMENDATIONS: Config.OPENAI_WAIT_RECOMMENDATIONS
+                    }
+                )
+    return _scheduler
@@ -0,0 +1,35 @@
+"""
+Общий клиент Redis на процесс (Redis опционален — без него кэши просто пропускаются)
+"""
+
+import threading
+import time
+
+from config import Config
+
+_client = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_RETRY_SEC = 30
+
+
+def get_redis_client():
+    """Клиент Redis или None, если недоступен (повторная попытка не чаще раза в 30 секунд)"""
+    global _client, _checked_at
+    if _client is not None:
+        return _client
+    if time.time() - _checked_at < _RETRY_SEC:
+        return None
+    with _lock:
+        if _client is not None or time.time() - _checked_at < _RETRY_SEC:
+            return _client
+        _checked_at = time.time()
+        try:
+            import redis
+            client = redis.from_url(getattr(Config, 'REDIS_URL', 'redis://localhost:6379'))
+            client.ping()
+            _client = client
+            print(f"✅ Redis подключен: {Config.REDIS_URL}")
+        except Exception as e:
+            print(f"⚠️ Redis недоступен или не сконфигурирован: {e}")
+    return _client
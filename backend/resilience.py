@@ -0,0 +1,286 @@
+"""
+Предохранители (circuit breaker) и ограничители параллельности (bulkhead)
+для внешних зависимостей: OpenAI, публичный API брендов, OpenWeatherMap, Supabase
+
+Раньше при деградации зависимости каждый запрос ждал ее полный таймаут
+(10–60 с), и потоки gthread заканчивались на всех маршрутах сразу. Теперь
+каждый вызов зависимости идет через guard(имя):
+- bulkhead: не больше BULKHEAD_<ИМЯ> одновременных вызовов на воркер; сверх
+  лимита вызов ждет место не дольше BULKHEAD_WAIT и отклоняется (BulkheadFull)
+- breaker: после CIRCUIT_FAILURE_THRESHOLD сбоев подряд (обрыв соединения,
+  таймаут, 5xx) зависимость считается недоступной на CIRCUIT_RESET_TIMEOUT —
+  вызовы сразу отклоняются (CircuitOpen); затем пропускается один пробный
+  вызов, и по его результату предохранитель закрывается или снова открывается
+Отказ — обычное исключение: вызывающий код уходит в свой fallback (капсулы
+по правилам, капсулы без товаров брендов, 503 на /weather).
+
+Параллельность OpenAI ограничивает очередь openai_client.py, поэтому для
+нее здесь только предохранитель.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+
+OPENAI = 'openai'
+BRAND_API = 'brand_api'
+OPENWEATHER = 'openweather'
+SUPABASE = 'supabase'
+
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+# Исключения без HTTP статуса, которые означают недоступность зависимости
+# (requests, httpx, openai, socket): по имени класса, чтобы не импортировать клиентов
+_TRANSPORT_ERROR_MARKERS = ('Timeout', 'Connect', 'Protocol', 'Network')
+
+
+class DependencyUnavailable(Exception):
+    """Вызов зависимости отклонен без обращения к ней"""
+
+    def __init__(self, dependency: str, message: str):
+        super().__init__(message)
+        self.dependency = dependency
+
+
+class CircuitOpen(DependencyUnavailable):
+    """Предохранитель зависимости открыт: вызов отклонен сразу"""
+
+    def __init__(self, dependency: str, retry_in: float):
+        super().__init__(dependency, f"{dependency}: зависимость недоступна, повтор через {retry_in:.0f}с")
+        self.retry_in = retry_in
+
+
+class BulkheadFull(DependencyUnavailable):
+    """Все места для вызовов зависимости заняты"""
+
+    def __init__(self, dependency: str):
+        super().__init__(dependency, f"{dependency}: превышен лимит одновременных вызовов")
+
+
+def is_failure(error: BaseException) -> bool:
+    """Сбой зависимости (считается предохранителем), а не ошибка запроса (4xx, разбор ответа)"""
+    if isinstance(error, DependencyUnavailable):
+        return False
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None) \
+        or getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(marker in type(error).__name__ for marker in _TRANSPORT_ERROR_MARKERS)
+
+
+class CircuitBreaker:
+    """Потокобезопасный предохранитель: CLOSED -> OPEN -> HALF_OPEN (один пробный вызов)"""
+
+    def __init__(self, name: str = 'ai', failure_threshold: int = 5, timeout: float = 60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.timeout = timeout
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self.state = CLOSED
+        self._probe = False  # пробный вызов в HALF_OPEN уже выдан
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'short_circuited': 0}
+
+    def allow(self) -> bool:
+        """Можно ли вызывать зависимость; в HALF_OPEN пропускает ровно один вызов"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.timeout:
+                    self._stats['short_circuited'] += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probe = False
+            if self.state == HALF_OPEN:
+                if self._probe:
+                    self._stats['short_circuited'] += 1
+                    return False
+                self._probe = True
+            return True
+
+    def is_open(self) -> bool:
+        """Открыт ли предохранитель (без выдачи пробного вызова)"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.timeout
+            return self.state == HALF_OPEN and self._probe
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"✅ Предохранитель {self.name}: зависимость снова доступна")
+            self.failure_count = 0
+            self.state = CLOSED
+            self._probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failure_count += 1
+            if self.state == HALF_OPEN or self.failure_count >= self.failure_threshold:
+                if self.state != OPEN:
+                    self._stats['opened'] += 1
+                    print(f"🔌 Предохранитель {self.name} открыт после {self.failure_count} сбоев подряд "
+                          f"(на {self.timeout:.0f}с)")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probe = False
+
+    def release(self) -> None:
+        """Выданный пробный вызов не состоялся (например, bulkhead отказал) — вернуть его"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                'state': self.state,
+                'failures_in_row': self.failure_count,
+                'retry_in_sec': round(self.retry_in(), 1) if self.state == OPEN else None
+            }
+
+
+class Bulkhead:
+    """Не больше max_concurrent одновременных вызовов; ожидание места — не дольше max_wait"""
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 0.5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'rejected': 0, 'peak': 0}
+
+    def acquire(self) -> None:
+        if not self._semaphore.acquire(timeout=self.max_wait):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise BulkheadFull(self.name)
+        with self._lock:
+            self._in_flight += 1
+            self._stats['peak'] = max(self._stats['peak'], self._in_flight)
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'in_flight': self._in_flight, 'max_concurrent': self.max_concurrent}
+
+
+class Dependency:
+    """Внешняя зависимость: предохранитель + (необязательно) bulkhead"""
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        bulkhead: Optional[Bulkhead] = None,
+        failure: Callable[[BaseException], bool] = is_failure
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.bulkhead = bulkhead
+        self.failure = failure
+        self._stats = {'calls': 0, 'failures': 0}
+
+    @contextmanager
+    def guard(self):
+        """Вызов зависимости внутри блока; отказ — CircuitOpen / BulkheadFull без обращения к ней"""
+        if not self.breaker.allow():
+            raise CircuitOpen(self.name, self.breaker.retry_in())
+        if self.bulkhead is not None:
+            try:
+                self.bulkhead.acquire()
+            except BulkheadFull:
+                self.breaker.release()
+                raise
+        self._stats['calls'] += 1
+        try:
+            yield
+        except BaseException as e:
+            if isinstance(e, Exception) and self.failure(e):
+                self._stats['failures'] += 1
+                self.breaker.record_failure()
+            elif isinstance(e, DependencyUnavailable):
+                # Вложенный guard отклонил вызов — зависимость не вызывалась
+                self.breaker.release()
+            else:
+                # Зависимость ответила (4xx, ошибка разбора и т.п.) — она доступна
+                self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            if self.bulkhead is not None:
+                self.bulkhead.release()
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self.guard():
+            return fn(*args, **kwargs)
+
+    def available(self) -> bool:
+        """Быстрая проверка без выдачи пробного вызова (для выбора деградированного пути)"""
+        return not self.breaker.is_open()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'breaker': self.breaker.stats(),
+            'bulkhead': self.bulkhead.stats() if self.bulkhead is not None else None
+        }
+
+
+_dependencies: Dict[str, Dependency] = {}
+_lock = threading.Lock()
+
+
+def _bulkhead_size(name: str) -> Optional[int]:
+    return {
+        BRAND_API: Config.BULKHEAD_BRAND_API,
+        OPENWEATHER: Config.BULKHEAD_OPENWEATHER,
+        SUPABASE: Config.BULKHEAD_SUPABASE
+    }.get(name)
+
+
+def get_dependency(name: str) -> Dependency:
+    """Общий для воркера предохранитель/bulkhead зависимости (создается лениво)"""
+    dependency = _dependencies.get(name)
+    if dependency is None:
+        with _lock:
+            dependency = _dependencies.get(name)
+            if dependency is None:
+                size = _bulkhead_size(name)
+                dependency = _dependencies[name] = Dependency(
+                    name,
+                    CircuitBreaker(
+                        name,
+                        failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+                        timeout=Config.CIRCUIT_RESET_TIMEOUT
+                    ),
+                    Bulkhead(name, size, max_wait=Config.BULKHEAD_WAIT) if size else None
+                )
+    return dependency
+
+
+def guard(name: str):
+    """with guard('supabase'): ... — вызов зависимости под ее предохранителем и bulkhead"""
+    return get_dependency(name).guard()
+
+
+def get_resilience_stats() -> Dict[str, Any]:
+    return {name: dependency.stats() for name, dependency in list(_dependencies.items())}
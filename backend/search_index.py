@@ -0,0 +1,508 @@
+"""
+Поисковый индекс товаров брендов в памяти воркера (для /search-items)
+
+Раньше каждый поиск отправлял в Supabase OR из description.ilike.%слово%,
+забирал до 1000 строк и проверял каждую регуляркой на каждое слово запроса.
+Теперь одобренные активные brand_items лежат в памяти:
+- инвертированный индекс по нормализованным токенам (нижний регистр, ё -> е)
+  описания и категории
+- отсортированный словарь токенов для поиска по префиксу: слово запроса длиннее
+  3 букв ищется по корню (первые 3–4 буквы) — вместо регулярки \\bкорень\\w*
+- ранжирование: приоритеты как раньше (точная фраза > главное слово в описании >
+  остальное), внутри приоритета — BM25
+- подсказки (/search-items/suggest): дописывание последнего слова запроса и категорий
+  по тому же словарю, по числу товаров с термином
+
+Индекс загружается один раз на воркер и обновляется в фоне инкрементально:
+только строки с updated_at новее последней загрузки. Снятые с публикации и
+удаленные товары приходят из ленты изменений (brand_changes.py); без нее
+(не выполнен BRAND_ITEMS_SYNC_SETUP.sql) — убираются периодической сверкой списка id.
+
+Строки индекса процесс-писатель снимков (catalog_snapshot.py) сохраняет на диск
+после полной загрузки и каждой сверки: новый воркер строит индекс из снимка и
+догружает из Supabase только строки новее его updated_at.
+"""
+
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from brand_changes import fetch_changes
+from catalog_snapshot import get_snapshot_store
+from config import Config
+
+SNAPSHOT_NAME = 'search_index'
+ITEM_FIELDS = 'id, brand_id, category, season, description, image_id, shop_link, price, currency, updated_at'
+PAGE_SIZE = 1000
+
+# BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_MATCH_WEIGHT = 0.7  # совпадение по корню весит меньше точного токена
+
+SUGGEST_CACHE_SIZE = 4096  # запомненных подсказок (сбрасываются при изменении индекса)
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Токены текста: нижний регистр, ё -> е, только буквы/цифры"""
+    return _TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def word_root(word: str) -> str:
+    """Корень слова запроса (как в прежней эвристике: 3 буквы для слов до 5, иначе 4)"""
+    if len(word) <= 3:
+        return word
+    return word[:3] if len(word) <= 5 else word[:4]
+
+
+@dataclass
+class _Doc:
+    item: Dict[str, Any]
+    text: str                # нормализованные «описание категория» через пробел (для поиска фразы)
+    counts: Counter          # частоты токенов описания и категории
+    description: str         # нормализованное описание (для проверки слов запроса подстрокой)
+    description_tokens: Set[str]
+    length: int
+    category: str
+
+
+class BrandSearchIndex:
+    """Инвертированный индекс товаров брендов с поиском по корню и BM25"""
+
+    def __init__(self, refresh_interval: int = 60, sweep_interval: int = 600):
+        self.refresh_interval = refresh_interval
+        self.sweep_interval = sweep_interval
+        self._docs: Dict[str, _Doc] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._vocab: List[str] = []  # отсортированные токены (поиск по префиксу)
+        self._total_length = 0
+        self._categories: Counter = Counter()  # категория -> число товаров
+        self._suggest_cache: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+        self._infix_cache: Dict[str, List[str]] = {}  # слово -> токены, содержащие его в середине
+        self._watermark: Optional[str] = None  # максимальный updated_at среди загруженных
+        self._loaded_at: Optional[float] = None
+        self._swept_at = 0.0
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._refresher_pid: Optional[int] = None
+        self._changes_feed = True  # лента изменений доступна (иначе — сверка списка id)
+        self._stats = {'queries': 0, 'suggests': 0, 'full_loads': 0, 'delta_rows': 0, 'removed': 0, 'refresh_errors': 0,
+                       'snapshot_loads': 0, 'snapshot_writes': 0}
+
+    # ---------- поиск ----------
+
+    def search(self, query: str, limit: int = 500) -> List[Dict[str, Any]]:
+        """Товары, содержащие все слова запроса, в порядке релевантности (копии словарей)"""
+        self._ensure_loaded()
+        words = normalize_tokens(query)
+        if not words:
+            return []
+        phrase = ' '.join(words)
+        roots = [word_root(w) for w in words]
+
+        with self._lock:
+            self._stats['queries'] += 1
+            # Слово совпадает, как раньше: подстрокой любого токена («кожа» -> «экокожа»)
+            # или токеном, начинающимся с корня
+            postings = {word: self._word_postings(word, root) for word, root in zip(words, roots)}
+            candidates: Optional[Set[str]] = None
+            for matched in sorted(postings.values(), key=len):
+                candidates = set(matched) if candidates is None else candidates & matched
+                if not candidates:
+                    return []
+
+            n_docs = len(self._docs) or 1
+            avg_length = (self._total_length / n_docs) or 1.0
+            idf = {word: self._idf(len(matched), n_docs) for word, matched in postings.items()}
+
+            ranked: List[Tuple[int, float, str]] = []
+            for doc_id in candidates:
+                doc = self._docs[doc_id]
+                # Хотя бы одно слово запроса целиком — в описании (как ilike %слово% по description);
+                # корень используется только для проверки всех слов
+                if not any(word in doc.description for word in words):
+                    continue
+                if phrase in doc.text:
+                    priority = 0  # точная фраза
+                elif words[-1] in doc.description or self._has_prefix(doc.description_tokens, roots[-1]):
+                    priority = 2  # последнее (обычно существительное) слово — в описании
+                else:
+                    priority = 3
+                score = sum(
+                    idf[word] * self._bm25_tf(doc, word, root, avg_length)
+                    for word, root in zip(words, roots)
+                )
+                ranked.append((priority, -score, doc_id))
+
+            ranked.sort()
+            return [dict(self._docs[doc_id].item) for _, _, doc_id in ranked[:limit]]
+
+    def _prefix_postings(self, prefix: str) -> Set[str]:
+        docs: Set[str] = set()
+        start = bisect.bisect_left(self._vocab, prefix)
+        for token in self._vocab[start:]:
+            if not token.startswith(prefix):
+                break
+            docs |= self._postings[token]
+        return docs
+
+    def _word_postings(self, word: str, root: str) -> Set[str]:
+        docs = self._prefix_postings(root)
+        for token in self._infix_tokens(word):
+            docs |= self._postings[token]
+        return docs
+
+    def _infix_tokens(self, word: str) -> List[str]:
+        """Токены, содержащие слово не с начала (просмотр словаря; запоминается до изменения индекса)"""
+        tokens = self._infix_cache.get(word)
+        if tokens is None:
+            if len(self._infix_cache) >= SUGGEST_CACHE_SIZE:
+                self._infix_cache.clear()
+            tokens = self._infix_cache[word] = [
+                token for token in self._vocab if word in token and not token.startswith(word)
+            ]
+        return tokens
+
+    @staticmethod
+    def _idf(df: int, n_docs: int) -> float:
+        return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+    @staticmethod
+    def _has_prefix(tokens: Iterable[str], prefix: str) -> bool:
+        return any(token.startswith(prefix) for token in tokens)
+
+    @staticmethod
+    def _bm25_tf(doc: _Doc, word: str, root: str, avg_length: float) -> float:
+        tf = 0.0
+        for token, count in doc.counts.items():
+            if token == word:
+                tf += count
+            elif token.startswith(root) or word in token:
+                tf += count * PREFIX_MATCH_WEIGHT
+        if not tf:
+            return 0.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc.length / avg_length)
+        return tf * (BM25_K1 + 1) / (tf + norm)
+
+    def suggest(self, query: str, limit: int = 8) -> List[Dict[str, Any]]:
+        """
+        Дописывание набираемого запроса: термины, начинающиеся с последнего слова
+        (по числу товаров с ними), и — для первого слова — подходящие категории.
+        """
+        self._ensure_loaded()
+        words = normalize_tokens(query)
+        if not words or not query.rstrip() or query[-1].isspace():
+            return []  # последнее слово уже дописано
+        key = (' '.join(words), limit)
+
+        with self._lock:
+            self._stats['suggests'] += 1
+            cached = self._suggest_cache.get(key)
+            if cached is not None:
+                return cached
+
+            head, prefix = words[:-1], words[-1]
+            suggestions: List[Dict[str, Any]] = []
+            if not head:
+                matched = [
+                    (count, category) for category, count in self._categories.items()
+                    if any(token.startswith(prefix) for token in normalize_tokens(category))
+                ]
+                for count, category in heapq.nlargest(limit, matched):
+                    suggestions.append({'text': category, 'type': 'category', 'count': count})
+
+            start = bisect.bisect_left(self._vocab, prefix)
+            end = bisect.bisect_left(self._vocab, prefix + '\uffff', lo=start)
+            terms = heapq.nlargest(
+                limit,
+                ((len(self._postings[token]), token) for token in self._vocab[start:end]
+                 if len(token) > 1 and not token.isdigit()),
+            )
+            seen = {s['text'].lower().replace('ё', 'е') for s in suggestions}
+            for count, token in terms:
+                text = ' '.join(head + [token])
+                if text not in seen:
+                    suggestions.append({'text': text, 'type': 'term', 'count': count})
+            suggestions = suggestions[:limit]
+
+            if len(self._suggest_cache) >= SUGGEST_CACHE_SIZE:
+                self._suggest_cache.clear()
+            self._suggest_cache[key] = suggestions
+            return suggestions
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            'items': len(self._docs),
+            'tokens': len(self._vocab),
+            'categories': len(self._categories),
+            'age_sec': round(time.time() - self._loaded_at, 1) if self._loaded_at else None,
+            'watermark': self._watermark
+        }
+
+    # ---------- индексирование ----------
+
+    def _index(self, item: Dict[str, Any]) -> None:
+        doc_id = str(item.get('id'))
+        category = (item.get('category') or '').strip()
+        description_tokens = normalize_tokens(item.get('description'))
+        tokens = description_tokens + normalize_tokens(category)
+        text = ' '.join(tokens)
+
+        old = self._docs.get(doc_id)
+        if old is not None and old.text == text and old.category == category:
+            old.item = item  # текст не менялся (например, обновился счетчик показов)
+            return
+        if old is not None:
+            self._unindex(doc_id)
+
+        counts = Counter(tokens)
+        self._docs[doc_id] = _Doc(
+            item=item,
+            text=text,
+            counts=counts,
+            description=' '.join(description_tokens),
+            description_tokens=set(description_tokens),
+            length=len(tokens),
+            category=category
+        )
+        self._total_length += len(tokens)
+        if category:
+            self._categories[category] += 1
+        self._suggest_cache.clear()
+        self._infix_cache.clear()
+        for token in counts:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = set()
+                bisect.insort(self._vocab, token)
+            posting.add(doc_id)
+
+    def _unindex(self, doc_id: str) -> None:
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc.length
+        if doc.category:
+            self._categories[doc.category] -= 1
+            if self._categories[doc.category] <= 0:
+                del self._categories[doc.category]
+        self._suggest_cache.clear()
+        self._infix_cache.clear()
+        for token in doc.counts:
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            posting.discard(doc_id)
+            if not posting:
+                del self._postings[token]
+                idx = bisect.bisect_left(self._vocab, token)
+                if idx < len(self._vocab) and self._vocab[idx] == token:
+                    del self._vocab[idx]
+
+    def _apply(self, rows: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for row in rows:
+                self._index(row)
+                updated_at = row.get('updated_at')
+                if updated_at and (self._watermark is None or updated_at > self._watermark):
+                    self._watermark = updated_at
+
+    # ---------- загрузка из Supabase ----------
+
+    @staticmethod
+    def _supabase():
+        from supabase_client import get_supabase_client
+        supabase = get_supabase_client()
+        if supabase is None:
+            raise RuntimeError('Supabase не доступен')
+        return supabase
+
+    @staticmethod
+    def _fetch_pages(build_query) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = build_query().range(offset, offset + PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    def _approved(self, supabase, columns: str):
+        return supabase.table('brand_items').select(columns).eq('is_approved', True).eq('is_active', True)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded_at is None:
+            from_snapshot = False
+            with self._load_lock:
+                if self._loaded_at is None:
+                    from_snapshot = self._load_snapshot()
+                    if not from_snapshot:
+                        self._full_load()
+            if from_snapshot:
+                # Догружаем изменения после снимка (не дожидаясь фонового обновления)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self._stats['refresh_errors'] += 1
+                    print(f"⚠️ Поисковый индекс: ошибка обновления после снимка: {e}")
+        self._ensure_refresher()
+
+    def _load_snapshot(self) -> bool:
+        """Строки индекса из общего снимка (False — снимка нет, нужна полная загрузка)"""
+        snapshots = get_snapshot_store()
+        snapshot = snapshots.read(SNAPSHOT_NAME) if snapshots is not None else None
+        if snapshot is None:
+            return False
+        started = time.time()
+        try:
+            rows = snapshot.json('rows')
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Поисковый индекс: снимок {snapshot.version} не прочитан: {e}")
+            return False
+        self._apply(rows)
+        self._loaded_at = time.time()
+        self._swept_at = snapshot.written_at
+        self._stats['snapshot_loads'] += 1
+        print(f"🔎 Поисковый индекс: {len(rows)} товаров из снимка за {time.time() - started:.2f}с")
+        return True
+
+    def _write_snapshot(self) -> None:
+        snapshots = get_snapshot_store()
+        if snapshots is None or not snapshots.is_writer():
+            return
+        with self._lock:
+            rows = [doc.item for doc in self._docs.values()]
+            watermark = self._watermark
+        if snapshots.write(SNAPSHOT_NAME, arrays={}, documents={'rows': rows},
+                           meta={'items': len(rows), 'watermark': watermark}):
+            self._stats['snapshot_writes'] += 1
+
+    def _full_load(self) -> None:
+        started = time.time()
+        supabase = self._supabase()
+        rows = self._fetch_pages(lambda: self._approved(supabase, ITEM_FIELDS).order('id'))
+        with self._lock:
+            fresh_ids = {str(row.get('id')) for row in rows}
+            for doc_id in [doc_id for doc_id in self._docs if doc_id not in fresh_ids]:
+                self._unindex(doc_id)
+            self._apply(rows)
+            self._loaded_at = self._swept_at = time.time()
+        self._stats['full_loads'] += 1
+        print(f"🔎 Поисковый индекс: {len(rows)} товаров, {len(self._vocab)} токенов за {time.time() - started:.2f}с")
+        self._write_snapshot()
+
+    def refresh(self) -> None:
+        """Инкрементальное обновление: новые/измененные строки и (реже) сверка удаленных"""
+        with self._load_lock:
+            if self._loaded_at is None or self._watermark is None:
+                self._full_load()
+                return
+            supabase = self._supabase()
+            if not (self._changes_feed and self._refresh_from_feed(supabase)):
+                watermark = self._watermark
+                # gte, а не gt: строка с тем же updated_at, что и отметка, могла закоммититься
+                # после прошлой загрузки. Граничные строки приходят повторно — _index идемпотентен
+                rows = self._fetch_pages(
+                    lambda: self._approved(supabase, ITEM_FIELDS).gte('updated_at', watermark)
+                    .order('updated_at').order('id')
+                )
+                # Страницы по offset на одинаковых updated_at могут повторить строку
+                rows = list({str(row.get('id')): row for row in rows}.values())
+                if rows:
+                    self._apply(rows)
+                    self._stats['delta_rows'] += sum(1 for row in rows if (row.get('updated_at') or '') > watermark)
+            if time.time() - self._swept_at >= self.sweep_interval:
+                if self._changes_feed:
+                    # Удаления уже пришли из ленты — только обновляем снимок
+                    self._swept_at = time.time()
+                    self._write_snapshot()
+                else:
+                    self._sweep(supabase)
+            self._loaded_at = time.time()
+
+    def _refresh_from_feed(self, supabase) -> bool:
+        """Изменения из ленты brand_item_changes, включая снятые и удаленные товары"""
+        try:
+            changes = fetch_changes(supabase, self._watermark, ITEM_FIELDS)
+        except Exception as e:
+            self._changes_feed = False
+            print(f"⚠️ Поисковый индекс: лента изменений недоступна ({e}) — удаления сверкой списка id")
+            return False
+        self._apply(changes.upserts)
+        with self._lock:
+            removed = [doc_id for doc_id in changes.removed if doc_id in self._docs]
+            for doc_id in removed:
+                self._unindex(doc_id)
+            if changes.watermark and changes.watermark > self._watermark:
+                self._watermark = changes.watermark
+        self._stats['delta_rows'] += len(changes.upserts)
+        self._stats['removed'] += len(removed)
+        return True
+
+    def _sweep(self, supabase) -> None:
+        """Убирает товары, которых больше нет среди одобренных активных (RLS их просто не отдает)"""
+        live_ids = {str(row.get('id')) for row in self._fetch_pages(lambda: self._approved(supabase, 'id').order('id'))}
+        with self._lock:
+            removed = [doc_id for doc_id in self._docs if doc_id not in live_ids]
+            for doc_id in removed:
+                self._unindex(doc_id)
+        self._stats['removed'] += len(removed)
+        self._swept_at = time.time()
+        self._write_snapshot()
+
+    def warm(self) -> None:
+        """Фоновая загрузка (например, при старте воркера)"""
+        def run():
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                print(f"⚠️ Поисковый индекс не загружен: {e}")
+        threading.Thread(target=run, name='search-index-warm', daemon=True).start()
+
+    def _ensure_refresher(self) -> None:
+        """Фоновый поток обновления — по одному на процесс (потоки не переживают fork)"""
+        pid = os.getpid()
+        if self._refresher_pid == pid:
+            return
+        with self._lock:
+            if self._refresher_pid == pid:
+                return
+            self._refresher_pid = pid
+        threading.Thread(target=self._refresh_loop, name='search-index-refresher', daemon=True).start()
+
+    def _refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self._stats['refresh_errors'] += 1
+                print(f"⚠️ Поисковый индекс: ошибка обновления: {e}")
+
+
+_index: Optional[BrandSearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> BrandSearchIndex:
+    """Общий для воркера поисковый индекс (создается лениво)"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = BrandSearchIndex(
+                    refresh_interval=Config.SEARCH_INDEX_REFRESH,
+                    sweep_interval=Config.SEARCH_INDEX_SWEEP
+                )
+    return _index
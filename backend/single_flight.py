@@ -0,0 +1,202 @@
+"""
+Single-flight: один расчет на ключ при одновременных одинаковых запросах
+
+Двойной тап в мини-приложении или несколько вкладок дают одинаковые запросы
+/generate-capsules, и каждый заново гоняет движок, подмешивание брендов и загрузку
+каталога. Здесь первый запрос по ключу становится лидером и считает, остальные
+ждут его результат:
+- внутри воркера — через threading.Event (без Redis)
+- между воркерами и контейнерами — лок в Redis (SET NX PX) и канал pub/sub,
+  в который лидер публикует результат
+
+Ожидание ограничено: если лидер не успел (или упал), ведомый считает сам.
+Без Redis остается только координация внутри воркера.
+"""
+
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from config import Config
+from redis_client import get_redis_client
+
+_LOCK_PREFIX = 'sf:lock:'
+_CHANNEL_PREFIX = 'sf:done:'
+
+# Снимаем лок, только если он все еще наш (лидер мог не уложиться в TTL)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_MISSING = object()
+
+
+class _Call:
+    """Расчет, выполняемый лидером в этом процессе"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Координация одинаковых расчетов по ключу (в процессе и через Redis)"""
+
+    def __init__(self, lock_ttl: float = 60.0, wait_timeout: float = 20.0):
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'local_followers': 0, 'remote_followers': 0, 'fallbacks': 0}
+
+    def run(
+        self,
+        key: str,
+        compute: Callable[[], Any],
+        load: Optional[Callable[[], Any]] = None,
+        wait_timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Результат compute() для ключа — свой или лидера.
+
+        load — чтение готового результата из кэша (None — нет): ведомый в другом
+        воркере сначала смотрит туда, потом ждет публикации лидера. Результат
+        должен сериализоваться в JSON (передается ведомым через pub/sub).
+        """
+        if wait_timeout is None:
+            wait_timeout = self.wait_timeout
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Тот же запрос уже считается в этом воркере
+            if call.done.wait(wait_timeout) and call.error is None:
+                self._stats['local_followers'] += 1
+                return call.value
+            self._stats['fallbacks'] += 1
+            return compute()
+
+        try:
+            call.value = self._run_distributed(key, compute, load, wait_timeout)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'in_flight': len(self._calls)}
+
+    # ---------- между процессами ----------
+
+    def _run_distributed(self, key: str, compute, load, wait_timeout: float) -> Any:
+        client = get_redis_client()
+        if client is None:
+            self._stats['leaders'] += 1
+            return compute()
+
+        lock_key = _LOCK_PREFIX + key
+        token = uuid.uuid4().hex
+        try:
+            acquired = client.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            print(f"⚠️ single-flight: Redis недоступен ({e}), считаем сами")
+            acquired = True
+            client = None
+
+        if not acquired:
+            value = self._wait_remote(client, key, lock_key, load, wait_timeout)
+            if value is not _MISSING:
+                self._stats['remote_followers'] += 1
+                return value
+            self._stats['fallbacks'] += 1
+            return compute()
+
+        self._stats['leaders'] += 1
+        try:
+            value = compute()
+        except BaseException:
+            if client is not None:
+                self._release(client, lock_key, token)
+            raise
+        if client is not None:
+            try:
+                client.publish(_CHANNEL_PREFIX + key, json.dumps(value, ensure_ascii=False))
+            except Exception as e:
+                print(f"⚠️ single-flight: не удалось опубликовать результат {key}: {e}")
+            self._release(client, lock_key, token)
+        return value
+
+    def _wait_remote(self, client, key: str, lock_key: str, load, wait_timeout: float) -> Any:
+        """Ждет результат лидера из другого процесса; _MISSING — не дождались"""
+        deadline = time.monotonic() + wait_timeout
+        pubsub = None
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_CHANNEL_PREFIX + key)
+            while True:
+                # Кэш проверяем уже после подписки — публикацию между ними не пропустим
+                if load is not None:
+                    value = load()
+                    if value is not None:
+                        return value
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"⏱️ single-flight: лидер {key} не успел за {wait_timeout:.0f}с, считаем сами")
+                    return _MISSING
+                message = pubsub.get_message(timeout=min(remaining, 1.0))
+                if message and message.get('type') == 'message':
+                    return json.loads(message['data'])
+                if not client.exists(lock_key):
+                    # Лидер закончил без публикации (ошибка или процесс умер) — последний шанс через кэш
+                    if load is not None:
+                        value = load()
+                        if value is not None:
+                            return value
+                    return _MISSING
+        except Exception as e:
+            print(f"⚠️ single-flight: ошибка ожидания {key}: {e}")
+            return _MISSING
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    @staticmethod
+    def _release(client, lock_key: str, token: str) -> None:
+        try:
+            client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            print(f"⚠️ single-flight: не удалось снять лок {lock_key}: {e}")
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Общий для воркера координатор (создается лениво)"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    lock_ttl=Config.SINGLE_FLIGHT_LOCK_TTL,
+                    wait_timeout=Config.SINGLE_FLIGHT_WAIT
+                )
+    return _single_flight
@@ -0,0 +1,134 @@
+"""
+Общий клиент Supabase на воркер
+
+Раньше get_supabase_client() вызывал create_client на каждый запрос
+(и на каждый вызов инструмента в чате) — каждый раз новый HTTP-клиент
+и новое TLS-соединение. Теперь клиент создается один раз на процесс,
+а PostgREST переиспользует соединения своего пула.
+
+Все запросы к таблицам идут через обертку, которая замеряет .execute()
+по каждой таблице (см. get_supabase_stats / /stats) и выполняет его под
+предохранителем и bulkhead зависимости supabase (см. resilience.py).
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from metrics import LatencyStats
+from resilience import SUPABASE, guard
+
+
+class _TimedQuery:
+    """Обертка над построителем запроса PostgREST: замеряет execute()"""
+
+    def __init__(self, builder, name: str):
+        self._builder = builder
+        self._name = name
+
+    def execute(self):
+        # Отклоненные предохранителем запросы в задержки таблиц не попадают
+        with guard(SUPABASE):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = self._builder.execute()
+                ok = True
+                return result
+            finally:
+                _table_stats(self._name).record((time.perf_counter() - started) * 1000, ok=ok)
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if callable(attr):
+            def chained(*args, **kwargs):
+                return self._wrap(attr(*args, **kwargs))
+            return chained
+        # Свойства вроде .not_ тоже возвращают построитель
+        return self._wrap(attr)
+
+    def _wrap(self, value):
+        if hasattr(value, 'execute') and not isinstance(value, _TimedQuery):
+            return _TimedQuery(value, self._name)
+        return value
+
+
+class _InstrumentedClient:
+    """Клиент Supabase, у которого table()/from_()/rpc() возвращают замеряемые запросы"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, table_name: str):
+        return _TimedQuery(self._client.table(table_name), table_name)
+
+    def from_(self, table_name: str):
+        return _TimedQuery(self._client.from_(table_name), table_name)
+
+    def rpc(self, fn: str, *args, **kwargs):
+        return _TimedQuery(self._client.rpc(fn, *args, **kwargs), f'rpc:{fn}')
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+_client: Optional[_InstrumentedClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+_counters = {'created': 0, 'reused': 0}
+_tables: Dict[str, LatencyStats] = {}
+
+
+def _table_stats(name: str) -> LatencyStats:
+    stats = _tables.get(name)
+    if stats is None:
+        with _client_lock:
+            stats = _tables.setdefault(name, LatencyStats())
+    return stats
+
+
+def get_supabase_client():
+    """Общий для процесса клиент Supabase (None, если нет ключей или модуля)"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        _counters['reused'] += 1
+        return _client
+
+    with _client_lock:
+        # Клиент, созданный до fork, в дочернем процессе не используем
+        if _client is not None and _client_pid == pid:
+            _counters['reused'] += 1
+            return _client
+        try:
+            # Импорт внутри функции для избежания блокировки модуля
+            from supabase import create_client
+
+            url = os.getenv('VITE_SUPABASE_URL') or os.getenv('SUPABASE_URL')
+            key = os.getenv('VITE_SUPABASE_ANON_KEY') or os.getenv('SUPABASE_ANON_KEY')
+
+            if not url or not key:
+                print("⚠️ Supabase credentials not found in environment")
+                return None
+
+            _client = _InstrumentedClient(create_client(url, key))
+            _client_pid = pid
+            _counters['created'] += 1
+            print(f"🔌 Supabase клиент создан (pid {pid})")
+            return _client
+        except ImportError:
+            print("⚠️ Модуль supabase не установлен, Supabase недоступен")
+            return None
+        except Exception as e:
+            print(f"❌ Ошибка подключения к Supabase: {e}")
+            return None
+
+
+def get_supabase_stats() -> Dict[str, Any]:
+    """Статистика клиента: переиспользования, запросы и задержки по таблицам"""
+    return {
+        'clients_created': _counters['created'],
+        'client_reused': _counters['reused'],
+        'tables': {name: stats.snapshot() for name, stats in list(_tables.items())}
+    }
@@ -0,0 +1,180 @@
+"""
+Гардероб пользователя на бэкенде: загрузка по telegram_id с кэшем по версии
+
+Раньше /generate-capsules, /wardrobe-recommendations и /looks получали весь
+гардероб в теле запроса, и бэкенд заново разбирал и хешировал его. Теперь
+достаточно telegram_id: гардероб читается из таблицы wardrobe через кэш.
+
+Версия гардероба (таблица wardrobe_version, см. WARDROBE_VERSION_SETUP.sql)
+растет на каждый INSERT/UPDATE/DELETE. На запрос — одно чтение версии по ключу;
+вещи берутся из памяти воркера или Redis, пока версия не изменилась.
+Пара (telegram_id, версия) — дешевый отпечаток гардероба для остальных кэшей.
+
+Если таблицы версий нет (SQL не выполнен), гардероб читается из Supabase
+на каждый запрос, без кэша.
+"""
+
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from config import Config
+from redis_client import get_redis_client
+
+
+@dataclass
+class WardrobeSnapshot:
+    """Гардероб пользователя на момент версии version (None — версия неизвестна)"""
+    telegram_id: str
+    items: List[Dict[str, Any]]
+    version: Optional[int] = None
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        """Отпечаток для ключей кэша (None — версионирования нет, хешировать вещи)"""
+        if self.version is None:
+            return None
+        return f"{self.telegram_id}:v{self.version}"
+
+    def eligible_items(self) -> List[Dict[str, Any]]:
+        """Вещи для генерации: без помеченных как неподходящие (как фильтрует фронтенд)"""
+        return [item for item in self.items if item.get('is_suitable') is not False]
+
+
+class WardrobeStore:
+    """Read-through кэш гардеробов: память воркера (LRU) -> Redis -> Supabase"""
+
+    def __init__(self, l1_size: int = 1024, redis_ttl: int = 86400):
+        self.l1_size = l1_size
+        self.redis_ttl = redis_ttl
+        self._l1: "OrderedDict[str, WardrobeSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._versioning = True  # False — таблицы wardrobe_version нет
+        self._stats = {'l1_hits': 0, 'redis_hits': 0, 'loads': 0, 'unversioned_loads': 0}
+
+    def get(self, telegram_id: str) -> WardrobeSnapshot:
+        telegram_id = str(telegram_id)
+        supabase = self._supabase()
+        version = self._read_version(supabase, telegram_id)
+        if version is None:
+            self._stats['unversioned_loads'] += 1
+            return WardrobeSnapshot(telegram_id, self._load_items(supabase, telegram_id))
+
+        with self._lock:
+            cached = self._l1.get(telegram_id)
+            if cached is not None and cached.version == version:
+                self._l1.move_to_end(telegram_id)
+                self._stats['l1_hits'] += 1
+                return cached
+
+        snapshot = self._read_redis(telegram_id, version)
+        if snapshot is not None:
+            self._stats['redis_hits'] += 1
+        else:
+            self._stats['loads'] += 1
+            snapshot = WardrobeSnapshot(telegram_id, self._load_items(supabase, telegram_id), version)
+            self._write_redis(snapshot)
+        self._remember(snapshot)
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'l1_users': len(self._l1), 'versioning': self._versioning}
+
+    # ---------- Supabase ----------
+
+    @staticmethod
+    def _supabase():
+        from supabase_client import get_supabase_client
+        supabase = get_supabase_client()
+        if supabase is None:
+            raise RuntimeError('Supabase не доступен')
+        return supabase
+
+    def _read_version(self, supabase, telegram_id: str) -> Optional[int]:
+        if not self._versioning:
+            return None
+        try:
+            response = supabase.table('wardrobe_version').select('version').eq('telegram_id', telegram_id).limit(1).execute()
+        except Exception as e:
+            message = str(e)
+            if '42P01' in message or 'does not exist' in message or 'wardrobe_version' in message:
+                # Таблица не создана — больше не пытаемся до перезапуска воркера
+                print(f"⚠️ Таблицы wardrobe_version нет, кэш гардеробов выключен: {e}")
+                self._versioning = False
+            else:
+                print(f"⚠️ Версия гардероба недоступна: {e}")
+            return None
+        # Нет строки — пользователь еще не менял гардероб после включения триггера
+        return int(response.data[0]['version']) if response.data else 0
+
+    @staticmethod
+    def _load_items(supabase, telegram_id: str) -> List[Dict[str, Any]]:
+        response = supabase.table('wardrobe').select('*').eq('telegram_id', telegram_id).order('id', desc=True).execute()
+        return response.data or []
+
+    # ---------- кэши ----------
+
+    def _remember(self, snapshot: WardrobeSnapshot) -> None:
+        with self._lock:
+            self._l1[snapshot.telegram_id] = snapshot
+            self._l1.move_to_end(snapshot.telegram_id)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    @staticmethod
+    def _redis_key(telegram_id: str, version: int) -> str:
+        return f"wardrobe:{telegram_id}:v{version}"
+
+    def _read_redis(self, telegram_id: str, version: int) -> Optional[WardrobeSnapshot]:
+        client = get_redis_client()
+        if client is None:
+            return None
+        try:
+            data = client.get(self._redis_key(telegram_id, version))
+            if not data:
+                return None
+            return WardrobeSnapshot(telegram_id, json.loads(gzip.decompress(data)), version)
+        except Exception as e:
+            print(f"⚠️ Кэш гардероба (чтение): {e}")
+            return None
+
+    def _write_redis(self, snapshot: WardrobeSnapshot) -> None:
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            data = gzip.compress(json.dumps(snapshot.items, ensure_ascii=False).encode('utf-8'))
+            client.setex(self._redis_key(snapshot.telegram_id, snapshot.version), self.redis_ttl, data)
+        except Exception as e:
+            print(f"⚠️ Кэш гардероба (запись): {e}")
+
+
+_store: Optional[WardrobeStore] = None
+_store_lock = threading.Lock()
+
+
+def get_wardrobe_store() -> WardrobeStore:
+    """Общий для воркера кэш гардеробов (создается лениво)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WardrobeStore(
+                    l1_size=Config.WARDROBE_CACHE_L1_SIZE,
+                    redis_ttl=Config.WARDROBE_CACHE_TTL
+                )
+    return _store
+
+
+def wardrobe_image_url(telegram_id: str, image_id: Optional[str]) -> Optional[str]:
+    """Публичный URL фото вещи в Storage (как wardrobeService.getImageUrl на фронтенде, без ?v=)"""
+    if not image_id:
+        return None
+    base = (os.getenv('VITE_SUPABASE_URL') or os.getenv('SUPABASE_URL') or '').rstrip('/')
+    if not base:
+        return None
+    return f"{base}/storage/v1/object/public/wardrobe-images/{telegram_id}/{image_id}.png"
@@ -0,0 +1,146 @@
+"""
+Кэш погоды по ячейкам координат (для /weather и инструмента get_weather в чате)
+
+Раньше каждый вызов шел в OpenWeatherMap с точными координатами пользователя.
+Теперь координаты округляются до ячейки сетки (WEATHER_CELL_DEGREES, по
+умолчанию 0.05° — около 5 км), и погода ячейки запрашивается для ее центра:
+- память воркера (LRU) -> Redis -> OpenWeatherMap, TTL WEATHER_CACHE_TTL (10 минут)
+- одновременные промахи по одной ячейке объединяются (single_flight.py):
+  в OpenWeatherMap уходит один запрос на ячейку и на все воркеры
+Пользователи одного города делят один запрос к OpenWeatherMap раз в TTL.
+Запросы к OpenWeatherMap идут под предохранителем и bulkhead (resilience.py):
+при недоступном сервисе промах кэша сразу завершается DependencyUnavailable.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from redis_client import get_redis_client
+
+WEATHER_URL = 'https://api.openweathermap.org/data/2.5/weather'
+
+
+class WeatherError(Exception):
+    """OpenWeatherMap ответил ошибкой (status — HTTP статус ответа)"""
+
+    def __init__(self, status: int):
+        super().__init__(f"Weather API error: HTTP {status}")
+        self.status = status
+
+
+class WeatherCache:
+    """Read-through кэш погоды по ячейкам: память воркера -> Redis -> OpenWeatherMap"""
+
+    def __init__(self, ttl: int = 600, cell_degrees: float = 0.05, l1_size: int = 4096):
+        self.ttl = ttl
+        self.cell_degrees = cell_degrees
+        self.l1_size = l1_size
+        self._l1: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # ячейка -> {'fetched_at', 'data'}
+        self._lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'redis_hits': 0, 'fetches': 0, 'errors': 0}
+
+    def get(self, lat: float, lon: float) -> Dict[str, Any]:
+        """Ответ OpenWeatherMap (current weather) для ячейки, в которую попадают координаты"""
+        cell_lat, cell_lon = self.cell(lat, lon)
+        key = f"{cell_lat:.4f}:{cell_lon:.4f}"
+
+        with self._lock:
+            cached = self._l1.get(key)
+            if cached is not None and cached['fetched_at'] + self.ttl > time.time():
+                self._l1.move_to_end(key)
+                self._stats['l1_hits'] += 1
+                return cached['data']
+
+        entry = self._read_redis(key)
+        if entry is not None:
+            self._stats['redis_hits'] += 1
+        else:
+            from single_flight import get_single_flight
+            entry = get_single_flight().run(
+                f"weather:{key}",
+                lambda: self._fetch(key, cell_lat, cell_lon),
+                load=lambda: self._read_redis(key),
+                wait_timeout=Config.HTTP_READ_TIMEOUT
+            )
+        self._remember(key, entry)
+        return entry['data']
+
+    def cell(self, lat: float, lon: float) -> Tuple[float, float]:
+        """Центр ячейки сетки, в которую попадает точка"""
+        step = self.cell_degrees
+        return round(round(lat / step) * step, 4), round(round(lon / step) * step, 4)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, 'l1_cells': len(self._l1), 'ttl': self.ttl, 'cell_degrees': self.cell_degrees}
+
+    # ---------- OpenWeatherMap ----------
+
+    def _fetch(self, key: str, lat: float, lon: float) -> Dict[str, Any]:
+        from http_client import http_get
+        from resilience import OPENWEATHER, guard
+        with guard(OPENWEATHER):
+            self._stats['fetches'] += 1
+            response = http_get(WEATHER_URL, params={
+                'lat': lat, 'lon': lon, 'appid': Config.OPENWEATHER_API_KEY, 'units': 'metric', 'lang': 'ru'
+            }, timeout=10)
+            if response.status_code != 200:
+                self._stats['errors'] += 1
+                raise WeatherError(response.status_code)
+        entry = {'fetched_at': time.time(), 'data': response.json()}
+        self._write_redis(key, entry)
+        return entry
+
+    # ---------- кэши ----------
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._l1[key] = entry
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    @staticmethod
+    def _redis_key(key: str) -> str:
+        return f"weather:{key}"
+
+    def _read_redis(self, key: str) -> Optional[Dict[str, Any]]:
+        client = get_redis_client()
+        if client is None:
+            return None
+        try:
+            data = client.get(self._redis_key(key))
+            return json.loads(data) if data else None
+        except Exception as e:
+            print(f"⚠️ Кэш погоды (чтение): {e}")
+            return None
+
+    def _write_redis(self, key: str, entry: Dict[str, Any]) -> None:
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            client.setex(self._redis_key(key), self.ttl, json.dumps(entry, ensure_ascii=False))
+        except Exception as e:
+            print(f"⚠️ Кэш погоды (запись): {e}")
+
+
+_cache: Optional[WeatherCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_weather_cache() -> WeatherCache:
+    """Общий для воркера кэш погоды (создается лениво)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = WeatherCache(
+                    ttl=Config.WEATHER_CACHE_TTL,
+                    cell_degrees=Config.WEATHER_CELL_DEGREES,
+                    l1_size=Config.WEATHER_CACHE_L1_SIZE
+                )
+    return _cache
@@ -305,7 +305,9 @@ const CapsulePage = ({ profile, onBack, initialCapsule = null, isFavoritesView =
           mode: 'cors',
           cache: 'no-store',
           body: JSON.stringify({
-            wardrobe: slimWardrobe,
+            // Гардероб бэкенд загружает сам по telegram_id (и отфильтровывает неподходящие вещи)
+            telegram_id: profile?.telegram_id,
+            wardrobe: profile?.telegram_id ? undefined : slimWardrobe,
             profile: profile,
             weather: weather,
             // Явно обходим кэш при ручном обновлении и принудительно включаем rule-engine
@@ -109,6 +109,56 @@ const ShopPage = ({ telegramId, season = 'Осень', temperature = 15.0, onBac
     }
   }, []);
 
+  // Подсказки при наборе: дешевый запрос к индексу бэкенда, полный поиск — после паузы
+  const [suggestions, setSuggestions] = useState([]);
+  const skipSuggestRef = useRef(false);
+
+  useEffect(() => {
+    if (skipSuggestRef.current) {
+      skipSuggestRef.current = false;
+      return;
+    }
+    if (!searchQuery.trim() || /\s$/.test(searchQuery)) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timeoutId = setTimeout(async () => {
+      try {
+        const { API_ENDPOINTS, BACKEND_URL } = await import('./config');
+        const response = await fetch(`${BACKEND_URL}${API_ENDPOINTS.SEARCH_SUGGEST}?q=${encodeURIComponent(searchQuery)}&limit=6`, {
+          method: 'GET',
+          headers: {
+            'Accept': 'application/json'
+          },
+          signal: controller.signal
+        });
+        if (!response.ok) {
+          throw new Error(`HTTP ${response.status}`);
+        }
+        const data = await response.json();
+        setSuggestions(data.suggestions || []);
+      } catch (err) {
+        if (err.name !== 'AbortError') {
+          setSuggestions([]);
+        }
+      }
+    }, 100);
+
+    return () => {
+      clearTimeout(timeoutId);
+      controller.abort();
+    };
+  }, [searchQuery]);
+
+  const applySuggestion = (text) => {
+    skipSuggestRef.current = true;
+    setSuggestions([]);
+    setSearchQuery(text);
+  };
+
+  const hasSuggestions = suggestions.length > 0;
+
   // Эффект для поиска при изменении запроса
   useEffect(() => {
     const timeoutId = setTimeout(() => {
@@ -123,10 +173,10 @@ const ShopPage = ({ telegramId, season = 'Осень', temperature = 15.0, onBac
           setDisplayedItems(firstBatch);
         }
       }
-    }, 300); // Debounce 300ms
+    }, hasSuggestions ? 700 : 300); // Пока показаны подсказки, полный поиск ждет дольше
 
     return () => clearTimeout(timeoutId);
-  }, [searchQuery, searchItems, allItems, itemsPerPage]);
+  }, [searchQuery, searchItems, allItems, itemsPerPage, hasSuggestions]);
 
   // Загрузка следующей порции товаров
   const loadMoreItems = useCallback(() => {
@@ -481,6 +531,24 @@ const ShopPage = ({ telegramId, season = 'Осень', temperature = 15.0, onBac
               <X size={18} />
             </button>
           )}
+          {suggestions.length > 0 && (
+            <ul className="search-suggestions">
+              {suggestions.map((suggestion) => (
+                <li key={`${suggestion.type}:${suggestion.text}`}>
+                  <button
+                    type="button"
+                    className="search-suggestion"
+                    onClick={() => applySuggestion(suggestion.text)}
+                  >
+                    <span>{suggestion.text}</span>
+                    {suggestion.type === 'category' && (
+                      <span className="search-suggestion-type">категория</span>
+                    )}
+                  </button>
+                </li>
+              ))}
+            </ul>
+          )}
         </div>
         {searchQuery.trim() && (
           <div style={{ 
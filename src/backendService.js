@@ -244,7 +244,10 @@ export const backendService = {
       const response = await fetch(`${BACKEND_URL}${API_ENDPOINTS.WARDROBE_RECOMMENDATIONS}`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ profile, wardrobe })
+        // Гардероб бэкенд загружает сам по telegram_id; целиком шлём, только если id неизвестен
+        body: JSON.stringify(profile?.telegram_id
+          ? { profile, telegram_id: profile.telegram_id }
+          : { profile, wardrobe })
       });
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
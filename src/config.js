@@ -29,5 +29,6 @@ export const API_ENDPOINTS = {
   CHAT_HISTORY: '/chat-style/history',
   CONVERT_HEIC_PREVIEW: '/convert-heic-preview',
   WEATHER: '/weather',
-  SEARCH_ITEMS: '/search-items'
+  SEARCH_ITEMS: '/search-items',
+  SEARCH_SUGGEST: '/search-items/suggest'
 };
\ No newline at end of file